@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import (
     Category, Company, Product, ProductImage, Review,
     Cart, CartItem, Order, OrderItem, UserProfile,
-    Newsletter, ContactMessage
+    Newsletter, ContactMessage, StockReservation
 )
 
 # Register your models here.
@@ -52,6 +52,24 @@ class CartAdmin(admin.ModelAdmin):
     search_fields = ('user__username',)
     inlines = [CartItemInline]
 
+    def get_queryset(self, request):
+        # Totals are summed by the database in the changelist query
+        return super().get_queryset(request).select_related('user').with_totals()
+
+    @admin.display(description='Total items', ordering='summary_items')
+    def total_items(self, obj):
+        return obj.summary().total_items
+
+    @admin.display(description='Total price', ordering='summary_price')
+    def total_price(self, obj):
+        return obj.summary().total_price
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'cart', 'quantity', 'expires_at')
+    search_fields = ('product__name', 'cart__user__username')
+    readonly_fields = ('cart', 'product', 'quantity', 'expires_at')
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'full_name', 'total_price', 'payment_method', 'payment_status', 'order_status', 'created_at')
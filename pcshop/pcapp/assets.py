@@ -0,0 +1,167 @@
+"""
+The static asset build and its serving.
+
+Page styles live in stylesheets under pcapp/static/pcapp/css (base.css for
+every page, one file per template) rather than in inline <style> blocks,
+so browsers download them once instead of with every HTML response;
+checks.check_inline_styles keeps it that way.
+
+AssetStorage is the STORAGES['staticfiles'] backend. When collectstatic
+runs it:
+
+- minifies stylesheets (minify_css),
+- fingerprints every file with a hash of its content and records the
+  names in the manifest (ManifestStaticFilesStorage), so {% static %}
+  links change whenever a file does,
+- writes gzip, and brotli when the brotli package is installed, copies
+  of the fingerprinted text files next to them.
+
+serve() hands out the collected files when no web server does, picking
+the precompressed copy the client accepts. Fingerprinted names never
+change content, so they are cached for a year as immutable; other names
+must be revalidated.
+"""
+import gzip
+import mimetypes
+import os
+import re
+from functools import cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip copies are always written
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.map')
+# Smaller files do not gain enough to be worth a second request path
+MIN_COMPRESS_SIZE = 512
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+
+# (Content-Encoding, file suffix) in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_TOKENS = re.compile(r'/\*.*?\*/|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'', re.S)
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+
+
+def _squeeze(code):
+    code = _CSS_SPACE.sub(' ', code)
+    code = _CSS_PUNCTUATION.sub(r'\1', code)
+    # Only after the colon: a space before one is a descendant selector
+    return code.replace(': ', ':').replace(';}', '}')
+
+
+def minify_css(css):
+    """
+    Drop comments and the whitespace CSS does not need; strings are left
+    as they are.
+    """
+    parts = []
+    position = 0
+    for match in _CSS_TOKENS.finditer(css):
+        parts.append(_squeeze(css[position:match.start()]))
+        if not match.group().startswith('/*'):
+            parts.append(match.group())
+        position = match.end()
+    parts.append(_squeeze(css[position:]))
+    return ''.join(parts).strip()
+
+
+class AssetStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that minifies stylesheets and precompresses the
+    fingerprinted text files; see the module docstring.
+    """
+
+    def _save(self, name, content):
+        # Both the plain copy and the fingerprinted one pass through here
+        if name.endswith('.css'):
+            # chunks() reads from the start; hashing has already read the content once
+            content = ContentFile(minify_css(b''.join(content.chunks()).decode()).encode())
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            for name in set(self.hashed_files.values()):
+                if name.endswith(COMPRESSIBLE):
+                    self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as file:
+            data = file.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data)
+        for suffix, compressed in variants.items():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
+
+    def stored_name(self, name):
+        # Until collectstatic has run (development, tests) there is no
+        # manifest, and files are linked under their own names
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+@cache
+def fingerprinted_names():
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip().removeprefix('q=')
+        if quality not in ('0', '0.0', '0.00', '0.000'):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+@require_safe
+def serve(request, path):
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    served, encoding = full_path, None
+    accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    for coding, suffix in ENCODINGS:
+        if coding in accepted and os.path.isfile(full_path + suffix):
+            served, encoding = full_path + suffix, coding
+            break
+
+    last_modified = int(os.stat(full_path).st_mtime)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    response = FileResponse(open(served, 'rb'), content_type=content_type)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = IMMUTABLE if path in fingerprinted_names() else REVALIDATE
+    conditional = get_conditional_response(request, last_modified=last_modified, response=response)
+    if conditional is not response:
+        response.close()
+    return conditional
@@ -0,0 +1,809 @@
+"""
+Benchmark suites run by ``python manage.py benchmark <suite>``.
+
+Each suite takes the parsed command options and returns a list of flat
+result dicts, which the command prints as a table or dumps as JSON.
+"""
+import asyncio
+import logging
+import math
+import random
+import sqlite3
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db import connection, connections, reset_queries, transaction
+from django.template import Context, Template
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import urls as pcapp_urls
+from .keyset import encode_cursor, paginate
+from .models import Cart, CartItem, Category, Company, Order, OrderItem, Product, Review
+from .navigation import invalidate_navigation
+from .product_cache import get_product_page, invalidate_product
+from .reviews import REVIEW_SORTS, REVIEWS_PER_PAGE, review_page, review_queryset
+from .search import FIELDS, SEARCH_TABLE, FTS5Backend, MemoryBackend, flatten_specifications
+from .views import PRODUCTS_PER_PAGE, PRODUCT_SORTS
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def latency_summary(samples_ms):
+    return {
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p95_ms': round(percentile(samples_ms, 95), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+    }
+
+
+def time_calls(func, args_list, repeat=1):
+    """
+    Call ``func(*args)`` for every args tuple and return the latencies in ms.
+    """
+    samples = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            func(*args)
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+# Synthetic catalogue vocabulary: category -> (brands, model stems, spec values)
+SYNTHETIC_CATALOGUE = {
+    'Processors': (
+        ['AMD', 'Intel'],
+        ['Ryzen 5', 'Ryzen 7', 'Ryzen 9', 'Core i5', 'Core i7', 'Core i9'],
+        {'socket': ['AM4', 'AM5', 'LGA1700', 'LGA1851'], 'cores': [6, 8, 12, 16, 24], 'tdp': ['65W', '105W', '125W', '170W']},
+    ),
+    'Graphics Cards': (
+        ['ASUS', 'MSI', 'Gigabyte', 'Zotac', 'Sapphire'],
+        ['GeForce RTX 4060', 'GeForce RTX 4070', 'GeForce RTX 4080', 'Radeon RX 7700 XT', 'Radeon RX 7900 XTX'],
+        {'vram': ['8 GB', '12 GB', '16 GB', '24 GB'], 'memory_type': ['GDDR6', 'GDDR6X'], 'length': ['240 mm', '300 mm', '336 mm'],
+         'tdp': ['115W', '200W', '320W', '355W']},
+    ),
+    'Motherboards': (
+        ['ASUS', 'MSI', 'Gigabyte', 'ASRock'],
+        ['B650', 'X670E', 'B760', 'Z790', 'B550'],
+        {'socket': ['AM4', 'AM5', 'LGA1700'], 'memory_type': ['DDR4', 'DDR5'], 'form_factor': ['ATX', 'Micro-ATX', 'Mini-ITX']},
+    ),
+    'Memory': (
+        ['Corsair', 'G.Skill', 'Kingston', 'Crucial'],
+        ['Vengeance', 'Trident Z5', 'Fury Beast', 'Ripjaws'],
+        {'memory_type': ['DDR4', 'DDR5'], 'capacity': ['16 GB', '32 GB', '64 GB'], 'speed': ['3200 MHz', '6000 MHz', '6400 MHz']},
+    ),
+    'Storage': (
+        ['Samsung', 'WD', 'Crucial', 'Seagate'],
+        ['990 Pro', 'SN850X', 'P5 Plus', 'FireCuda 530'],
+        {'interface': ['NVMe PCIe 4.0', 'NVMe PCIe 5.0', 'SATA'], 'capacity': ['1 TB', '2 TB', '4 TB']},
+    ),
+    'Power Supplies': (
+        ['Corsair', 'Seasonic', 'be quiet!', 'Cooler Master'],
+        ['RM850x', 'Focus GX', 'Straight Power 12', 'MWE Gold'],
+        {'wattage': ['650W', '750W', '850W', '1000W'], 'efficiency': ['80+ Gold', '80+ Platinum']},
+    ),
+    'Cases': (
+        ['Lian Li', 'NZXT', 'Fractal Design', 'Corsair'],
+        ['O11 Dynamic', 'H5 Flow', 'North', '4000D Airflow'],
+        {'form_factor': ['ATX', 'Micro-ATX', 'Mini-ITX'], 'max_gpu_length': ['280 mm', '360 mm', '420 mm']},
+    ),
+}
+
+ADJECTIVES = ['gaming', 'silent', 'overclocked', 'rgb', 'compact', 'white', 'pro', 'elite', 'oc', 'edition']
+
+
+def synthetic_products(size, seed=0, start=1, catalogue=None):
+    """
+    Yield ``size`` dicts shaped like Product rows (name, brand, category,
+    description, specifications) from a seeded random generator. Names end
+    in their index, counted from ``start``, so they are unique.
+    """
+    rng = random.Random(seed)
+    categories = list((catalogue or SYNTHETIC_CATALOGUE).items())
+    for index in range(start, start + size):
+        category, (brands, models, specs) = rng.choice(categories)
+        brand = rng.choice(brands)
+        extra = rng.sample(ADJECTIVES, 2)
+        yield {
+            'id': index,
+            'name': f'{brand} {rng.choice(models)} {extra[0].title()} {index}',
+            'brand': brand,
+            'category': category,
+            'description': f'{extra[1].title()} {category.lower()} from {brand} built for {extra[0]} builds.',
+            'specifications': {key: rng.choice(values) for key, values in specs.items()},
+        }
+
+
+def sample_url_kwargs(user=None):
+    """
+    Pick real objects from the database to fill the URL parameters used by
+    pcapp/urls.py.
+    """
+    kwargs = {}
+    product = Product.objects.select_related('category', 'company').first()
+    if product is not None:
+        kwargs.update(
+            slug=product.category.slug,
+            category_slug=product.category.slug,
+            company_slug=product.company.slug,
+            product_slug=product.slug,
+            product_id=product.pk,
+        )
+    if user is not None:
+        order = Order.objects.filter(user=user).first()
+        if order is not None:
+            kwargs['order_id'] = order.id
+    return kwargs
+
+
+def iter_routes(user=None):
+    """
+    Yield (name, url) for every named route in pcapp/urls.py whose
+    parameters can be filled from the current data.
+    """
+    sample = sample_url_kwargs(user)
+    for pattern in pcapp_urls.urlpatterns:
+        params = pattern.pattern.converters.keys()
+        if not all(param in sample for param in params):
+            continue
+        yield pattern.name, reverse(pattern.name, kwargs={param: sample[param] for param in params})
+
+
+def make_client(username=None):
+    """
+    Return a test client (logged in as ``username``, or the first superuser
+    when no name is given) and the user it is logged in as.
+    """
+    client = Client(HTTP_HOST='localhost')
+    if username:
+        user = User.objects.get(username=username)
+    else:
+        user = User.objects.filter(is_superuser=True).first()
+    if user is not None:
+        client.force_login(user)
+    return client, user
+
+
+def count_queries(client, url):
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(url)
+    return response.status_code, len(ctx.captured_queries)
+
+
+def nav_suite(options):
+    """
+    Queries per request for every route with a cold navigation cache (the
+    cost before caching, when every render queried the categories) and with
+    a warm one.
+    """
+    client, user = make_client(options.get('username'))
+    results = []
+    for name, url in iter_routes(user):
+        invalidate_navigation()
+        status, cold = count_queries(client, url)
+        _, warm = count_queries(client, url)
+        results.append({
+            'route': name,
+            'url': url,
+            'status': status,
+            'queries_cold_nav': cold,
+            'queries_warm_nav': warm,
+        })
+    return results
+
+
+def routes_suite(options):
+    """
+    Latency (p50/p95/p99), queries per request and peak Python memory for
+    every route, through the test client with warm caches. Run it against
+    a dataset from ``manage.py generate_catalogue`` and save the output
+    with --json to compare commits.
+    """
+    repeat = options.get('repeat') or 20
+    client, user = make_client(options.get('username'))
+    # POST-only routes answer GETs with 405, which Django logs as warnings
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    results = []
+    for name, url in iter_routes(user):
+        # Warm the caches, then count the queries of one request
+        client.get(url)
+        status, queries = count_queries(client, url)
+
+        tracemalloc.start()
+        client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        samples = time_calls(client.get, [(url,)] * repeat)
+        results.append({
+            'route': name,
+            'url': url,
+            'status': status,
+            'queries': queries,
+            **latency_summary(samples),
+            'peak_kb': round(peak / 1024, 1),
+        })
+    return results
+
+
+SEARCH_QUERIES = [
+    'ryzen', 'rtx 40', 'ddr5 32', 'am5', 'gaming', 'corsair 850', 'lga1700', 'x670e', 'nvme 2 tb', 'rgb white',
+]
+
+
+def search_suite(options):
+    """
+    Compare the old LIKE '%q%' scan, the FTS5 index and the in-memory BM25
+    index over a synthetic catalogue (100k products by default).
+    """
+    size = options.get('size') or 100_000
+    products = list(synthetic_products(size))
+    documents = [
+        (product['id'], {
+            'name': product['name'],
+            'brand': product['brand'],
+            'category': product['category'],
+            'specs': ' '.join(flatten_specifications(product['specifications'])),
+            'description': product['description'],
+        })
+        for product in products
+    ]
+    results = []
+
+    db = sqlite3.connect(':memory:')
+    start = time.perf_counter()
+    db.execute('CREATE TABLE product (id INTEGER PRIMARY KEY, name, brand, category, description)')
+    db.executemany(
+        'INSERT INTO product VALUES (?, ?, ?, ?, ?)',
+        [(p['id'], p['name'], p['brand'], p['category'], p['description']) for p in products],
+    )
+    build = time.perf_counter() - start
+
+    def like_search(query):
+        pattern = f'%{query}%'
+        return db.execute(
+            'SELECT id FROM product WHERE name LIKE ? OR description LIKE ? OR category LIKE ? OR brand LIKE ?',
+            [pattern] * 4,
+        ).fetchall()
+
+    results.append(run_search_backend('like_scan', size, build, like_search))
+
+    start = time.perf_counter()
+    db.execute(
+        f'CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5({", ".join(FIELDS)}, '
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    db.executemany(
+        f'INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)',
+        [(pk, *(document[field] for field in FIELDS)) for pk, document in documents],
+    )
+    build = time.perf_counter() - start
+    sql = FTS5Backend.search_sql(placeholder='?')
+
+    def fts_search(query):
+        return db.execute(sql, [FTS5Backend.match_expression(query), 1000]).fetchall()
+
+    results.append(run_search_backend('fts5', size, build, fts_search))
+
+    memory = MemoryBackend()
+    start = time.perf_counter()
+    memory.load_documents(documents)
+    build = time.perf_counter() - start
+    results.append(run_search_backend('memory_bm25', size, build, memory.search))
+    return results
+
+
+def run_search_backend(name, size, build_seconds, search):
+    hits = [len(search(query)) for query in SEARCH_QUERIES]
+    samples = time_calls(search, [(query,) for query in SEARCH_QUERIES], repeat=5)
+    return {
+        'backend': name,
+        'products': size,
+        'build_s': round(build_seconds, 2),
+        **latency_summary(samples),
+        'avg_hits': round(sum(hits) / len(hits)),
+    }
+
+
+SUGGEST_PREFIXES = [
+    'r', 'ry', 'ryz', 'ryzen 7', 'geforce rtx 40', 'rtx 4070', 'cor', 'corsair', 'ddr', 'vengeance',
+    'b65', 'x670e', '990', 'seas', 'gaming', 'zotac geforce', 'radeon rx 79', 'sn850x', 'mwe gold', 'q',
+]
+
+
+def suggest_suite(options):
+    """
+    Build the typeahead index over a synthetic catalogue (100k products by
+    default) and time prefix lookups.
+    """
+    from .suggest import SuggestionIndex
+
+    size = options.get('size') or 100_000
+    index = SuggestionIndex()
+    start = time.perf_counter()
+    for product in synthetic_products(size):
+        index.add(('product', product['id']), 'product', product['name'], '', sort=False)
+    index.finish_loading()
+    build = time.perf_counter() - start
+
+    samples = time_calls(index.lookup, [(prefix,) for prefix in SUGGEST_PREFIXES], repeat=50)
+    return [{
+        'products': size,
+        'keys': len(index.keys),
+        'build_s': round(build, 2),
+        **latency_summary(samples),
+    }]
+
+
+def compatibility_suite(options):
+    """
+    Load a synthetic catalogue (100k products by default) into the
+    compatibility engine, then time full build checks and compatible part
+    lookups against a scan that checks every candidate in turn.
+    """
+    from .compatibility import RULES_BY_ROLE, Catalogue, role_for_category
+
+    size = options.get('size') or 100_000
+    rng = random.Random(1)
+    start = time.perf_counter()
+    catalogue = Catalogue(
+        (product['id'], role_for_category(product['category']), product['name'], product['specifications'].items())
+        for product in synthetic_products(size)
+    )
+    build = time.perf_counter() - start
+
+    builds = [
+        ({role: rng.choice(sorted(ids)) for role, ids in catalogue.by_role.items()},)
+        for _ in range(200)
+    ]
+    check_samples = time_calls(catalogue.check, builds)
+
+    lookups = [('motherboard', {'processor': selection['processor'], 'memory': selection['memory']})
+               for (selection,) in builds[:50]]
+    lookup_samples = time_calls(catalogue.compatible_parts, lookups)
+
+    def scan(role, selection):
+        matches = []
+        for pk in catalogue.by_role[role]:
+            profile = catalogue.parts[pk][2]
+            if all(
+                rule.check(profile, catalogue.parts[selection[rule.role_b]][2]) is not False
+                if rule.role_a == role else
+                rule.check(catalogue.parts[selection[rule.role_a]][2], profile) is not False
+                for rule in RULES_BY_ROLE[role]
+                if (rule.role_b if rule.role_a == role else rule.role_a) in selection
+            ):
+                matches.append(pk)
+        return matches
+
+    scan_samples = time_calls(scan, lookups)
+    return [
+        {
+            'operation': operation,
+            'products': size,
+            'load_s': round(build, 2),
+            'ops_per_s': round(1000 * len(samples) / sum(samples)),
+            **latency_summary(samples),
+        }
+        for operation, samples in (
+            ('check', check_samples),
+            ('compatible (indexed)', lookup_samples),
+            ('compatible (scan)', scan_samples),
+        )
+    ]
+
+
+CHECKOUT_CART_SIZES = (1, 10, 50, 100, 200)
+
+
+def per_item_checkout(cart, order):
+    """
+    The checkout this pipeline replaced: totals from the cart properties and
+    one INSERT (plus a product load) per line.
+    """
+    cart_items = cart.items.all()
+    order.total_price = cart.total_price
+    order.save()
+    for cart_item in cart_items:
+        OrderItem.objects.create(
+            order=order,
+            product=cart_item.product,
+            price=cart_item.product.discounted_price,
+            quantity=cart_item.quantity
+        )
+    cart_items.delete()
+
+
+def checkout_suite(options):
+    """
+    Checkout latency and queries against cart size, for place_order() and
+    the per-item loop it replaced. Runs in a transaction that is rolled back,
+    so the configured database is left untouched.
+    """
+    from .orders import place_order
+
+    repeat = 20
+    results = []
+    with transaction.atomic():
+        user = User.objects.create_user('checkout-benchmark')
+        cart = Cart.objects.create(user=user)
+        category = Category.objects.create(name='Checkout Benchmark')
+        company = Company.objects.create(name='Checkout Benchmark')
+        products = Product.objects.bulk_create(
+            Product(
+                name=f'Benchmark Part {i}', slug=f'checkout-benchmark-{i}', category=category, company=company,
+                description='', price=Decimal('1234.50'), discount_percentage=Decimal('7.5'), stock=10 ** 9,
+            )
+            for i in range(max(CHECKOUT_CART_SIZES))
+        )
+
+        for size in CHECKOUT_CART_SIZES:
+            for name, checkout in (('bulk', place_order), ('per-item', per_item_checkout)):
+                samples = []
+                for _ in range(repeat):
+                    CartItem.objects.bulk_create(
+                        CartItem(cart=cart, product=product, quantity=2) for product in products[:size]
+                    )
+                    order = Order(user=user, full_name='Benchmark', payment_method='cod')
+                    fresh_cart = Cart.objects.get(pk=cart.pk)
+                    # The query log is capped, so empty it before counting
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        checkout(fresh_cart, order)
+                        samples.append((time.perf_counter() - start) * 1000)
+                results.append({
+                    'checkout': name,
+                    'cart_lines': size,
+                    'queries': len(ctx.captured_queries),
+                    **latency_summary(samples),
+                })
+        transaction.set_rollback(True)
+    return results
+
+
+CART_SIZES = (1, 10, 50, 100, 200)
+
+
+def per_item_cart_totals(cart):
+    """
+    The cart totals this replaced: two walks over the lines, loading each
+    line's product.
+    """
+    total_price = sum(item.product.discounted_price * item.quantity for item in cart.items.all())
+    total_items = sum(item.quantity for item in cart.items.all())
+    return total_items, total_price
+
+
+def cart_suite(options):
+    """
+    Cart total latency and queries against cart size: the aggregate summary
+    versus walking the lines. Runs in a transaction that is rolled back.
+    """
+    repeat = 50
+    results = []
+    with transaction.atomic():
+        user = User.objects.create_user('cart-benchmark')
+        cart = Cart.objects.create(user=user)
+        category = Category.objects.create(name='Cart Benchmark')
+        company = Company.objects.create(name='Cart Benchmark')
+        products = Product.objects.bulk_create(
+            Product(
+                name=f'Benchmark Part {i}', slug=f'cart-benchmark-{i}', category=category, company=company,
+                description='', price=Decimal('1234.50'), discount_percentage=Decimal('7.5'), stock=100,
+            )
+            for i in range(max(CART_SIZES))
+        )
+
+        for size in CART_SIZES:
+            CartItem.objects.filter(cart=cart).delete()
+            CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=2) for product in products[:size])
+            for name, totals in (('aggregate', lambda: cart.summary()), ('per-item', lambda: per_item_cart_totals(cart))):
+                reset_queries()
+                with CaptureQueriesContext(connection) as ctx:
+                    totals()
+                samples = time_calls(totals, [()] * repeat)
+                results.append({
+                    'totals': name,
+                    'cart_lines': size,
+                    'queries': len(ctx.captured_queries),
+                    **latency_summary(samples),
+                })
+        transaction.set_rollback(True)
+    return results
+
+
+def product_page_suite(options):
+    """
+    Product detail latency and queries with the page cache cold (every
+    request assembling the page, as before caching) and warm, for the page
+    data alone and for the whole request.
+    """
+    repeat = 50
+    client, _ = make_client(options.get('username'))
+    products = list(Product.objects.select_related('category', 'company').order_by('pk')[:repeat])
+    if not products:
+        return []
+    pages = [(product, (product.category.slug, product.company.slug, product.slug)) for product in products]
+
+    def fetch_page(product, slugs, cold):
+        if cold:
+            invalidate_product(product.pk, product.category_id)
+        return get_product_page(*slugs)
+
+    def fetch_request(product, slugs, cold):
+        if cold:
+            invalidate_product(product.pk, product.category_id)
+        return client.get(reverse('product_detail', args=slugs))
+
+    results = []
+    for target, fetch in (('page data', fetch_page), ('request', fetch_request)):
+        for cache_state in ('cold', 'warm'):
+            args_list = [(product, slugs, cache_state == 'cold') for product, slugs in pages]
+            fetch(*args_list[0])
+            reset_queries()
+            with CaptureQueriesContext(connection) as ctx:
+                fetch(*args_list[0])
+            samples = time_calls(fetch, args_list, repeat=max(1, repeat // len(pages)))
+            results.append({
+                'target': target,
+                'cache': cache_state,
+                'queries': len(ctx.captured_queries),
+                **latency_summary(samples),
+            })
+    return results
+
+
+REVIEW_COUNT = 20000
+REVIEW_DEPTHS = (0, 1000, 10000, 19000)
+
+
+def reviews_suite(options):
+    """
+    Review page latency against scroll depth for a product with
+    REVIEW_COUNT reviews: keyset pages versus the OFFSET pages they
+    replaced. Runs in a transaction that is rolled back.
+    """
+    count = options.get('size') or REVIEW_COUNT
+    repeat = 20
+    results = []
+    with transaction.atomic():
+        category = Category.objects.create(name='Review Benchmark')
+        company = Company.objects.create(name='Review Benchmark')
+        product = Product.objects.create(
+            name='Review Benchmark', slug='review-benchmark', category=category, company=company,
+            description='', price=Decimal('100.00'),
+        )
+        users = User.objects.bulk_create(User(username=f'review-benchmark-{i}') for i in range(count))
+        rng = random.Random(0)
+        Review.objects.bulk_create(
+            Review(product=product, user=user, rating=rng.randint(1, 5), comment='Benchmark review')
+            for user in users
+        )
+
+        for sort, ordering in REVIEW_SORTS.items():
+            queryset = review_queryset(product.pk).order_by(*ordering)
+            for depth in REVIEW_DEPTHS:
+                if depth >= count:
+                    continue
+                cursor = encode_cursor(queryset, ordering, queryset[depth - 1]) if depth else None
+                pages = (
+                    ('keyset', lambda: review_page(product.pk, sort, cursor)),
+                    ('offset', lambda: list(queryset[depth:depth + REVIEWS_PER_PAGE])),
+                )
+                for name, fetch in pages:
+                    samples = time_calls(fetch, [()] * repeat)
+                    results.append({'sort': sort, 'depth': depth, 'paging': name, **latency_summary(samples)})
+        transaction.set_rollback(True)
+    return results
+
+
+LISTING_SIZE = 20000
+LISTING_PAGES = (1, 100, 1000, 1600)
+
+
+def listing_suite(options):
+    """
+    company_products page latency against page number for a category with
+    LISTING_SIZE products: keyset pages versus Paginator pages (a COUNT
+    plus an OFFSET query). Runs in a transaction that is rolled back.
+    """
+    size = options.get('size') or LISTING_SIZE
+    repeat = 10
+    rng = random.Random(0)
+    results = []
+    with transaction.atomic():
+        category = Category.objects.create(name='Listing Benchmark')
+        company = Company.objects.create(name='Listing Benchmark')
+        Product.objects.bulk_create(
+            Product(
+                name=row['name'], slug=f'listing-benchmark-{row["id"]}', category=category, company=company,
+                description=row['description'], specifications=row['specifications'],
+                price=Decimal(rng.randrange(1000, 200000)) / 100,
+            )
+            for row in synthetic_products(size)
+        )
+        listing = Product.objects.for_listing().filter(category=category, company=company)
+
+        for sort_by, ordering in PRODUCT_SORTS.items():
+            products = listing.order_by(*ordering)
+            for number in LISTING_PAGES:
+                depth = (number - 1) * PRODUCTS_PER_PAGE
+                if depth >= size:
+                    continue
+                cursor = encode_cursor(products, ordering, products[depth - 1]) if depth else None
+                pages = (
+                    ('keyset', lambda: paginate(products, ordering, cursor, PRODUCTS_PER_PAGE).items),
+                    ('paginator', lambda: list(Paginator(products, PRODUCTS_PER_PAGE).page(number))),
+                )
+                for name, fetch in pages:
+                    samples = time_calls(fetch, [()] * repeat)
+                    results.append({'sort': sort_by, 'page': number, 'paging': name, **latency_summary(samples)})
+        transaction.set_rollback(True)
+    return results
+
+
+HANDLER_ROUTES = ('home', 'category_detail', 'company_products', 'product_detail', 'search_products')
+
+
+def run_wsgi(url, concurrency, per_client):
+    """
+    ``concurrency`` threads, each its own client sending ``per_client``
+    requests, as under a threaded WSGI server. Returns the latencies, the
+    responses that were errors and the seconds taken.
+    """
+    def client_loop(_):
+        client = Client(HTTP_HOST='localhost')
+        samples, errors = [], 0
+        try:
+            for _ in range(per_client):
+                start = time.perf_counter()
+                errors += client.get(url).status_code >= 400
+                samples.append((time.perf_counter() - start) * 1000)
+        finally:
+            connections.close_all()
+        return samples, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        chunks = list(pool.map(client_loop, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return [sample for samples, _ in chunks for sample in samples], sum(errors for _, errors in chunks), elapsed
+
+
+def run_asgi(url, concurrency, per_client):
+    """
+    ``concurrency`` clients as tasks on one event loop, each sending
+    ``per_client`` requests. Returns what run_wsgi() does.
+    """
+    async def client_loop():
+        client = AsyncClient()
+        samples, errors = [], 0
+        for _ in range(per_client):
+            start = time.perf_counter()
+            errors += (await client.get(url)).status_code >= 400
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples, errors
+
+    async def main():
+        start = time.perf_counter()
+        chunks = await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await sync_to_async(connections.close_all)()
+        return [sample for samples, _ in chunks for sample in samples], sum(errors for _, errors in chunks), elapsed
+
+    # AsyncClient always sends Host: testserver
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        return asyncio.run(main())
+
+
+def handlers_suite(options):
+    """
+    Throughput of the catalogue pages through Django's WSGI handler (a
+    thread per client) and its ASGI handler (every client a task on one
+    event loop), with warm caches. Both run in process, so this compares
+    the request handling, not a particular server. --repeat sets the
+    requests per client.
+    """
+    concurrency = options.get('concurrency') or 16
+    per_client = options.get('repeat') or 20
+    client = Client(HTTP_HOST='localhost')
+    results = []
+    for name, url in iter_routes():
+        if name not in HANDLER_ROUTES:
+            continue
+        if name == 'search_products':
+            url += f'?q={SEARCH_QUERIES[0]}'
+        # Warm the caches
+        client.get(url)
+        for handler, run in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+            samples, errors, elapsed = run(url, concurrency, per_client)
+            results.append({
+                'route': name,
+                'handler': handler,
+                'concurrency': concurrency,
+                'requests': len(samples),
+                'errors': errors,
+                'rps': round(len(samples) / elapsed, 1),
+                **latency_summary(samples),
+            })
+    return results
+
+
+CARD_PAGE_SIZE = 48
+CARD_GRID = Template(
+    "{% for product in products %}"
+    "{% include 'pcapp/includes/product_card.html' with card_class='card product-card' button_class='btn-primary' %}"
+    "{% endfor %}"
+)
+
+
+def cards_suite(options):
+    """
+    Render time of a grid of CARD_PAGE_SIZE product cards, in total and per
+    card: with the fragment cache disabled (every card rendered from
+    scratch, as before the cards were cached), cold (rendered and stored)
+    and warm.
+    """
+    repeat = options.get('repeat') or 20
+    products = list(Product.objects.for_listing().order_by('pk')[:CARD_PAGE_SIZE])
+    if not products:
+        return []
+    context = Context({'products': products})
+
+    results = []
+    for state, backend in (
+        ('disabled', 'django.core.cache.backends.dummy.DummyCache'),
+        ('cold', 'django.core.cache.backends.locmem.LocMemCache'),
+        ('warm', 'django.core.cache.backends.locmem.LocMemCache'),
+    ):
+        # {% cache %} uses the template_fragments cache when there is one
+        fragment_caches = {**settings.CACHES, 'template_fragments': {'BACKEND': backend, 'LOCATION': 'card-benchmark'}}
+        with override_settings(CACHES=fragment_caches):
+            fragments = caches['template_fragments']
+
+            def render():
+                if state == 'cold':
+                    fragments.clear()
+                return CARD_GRID.render(context)
+
+            render()
+            samples = time_calls(render, [()], repeat=repeat)
+        summary = latency_summary(samples)
+        results.append({
+            'fragments': state,
+            'cards': len(products),
+            **summary,
+            'per_card_us': round(summary['p50_ms'] * 1000 / len(products), 1),
+        })
+    return results
+
+
+SUITES = {
+    'nav': nav_suite,
+    'routes': routes_suite,
+    'search': search_suite,
+    'suggest': suggest_suite,
+    'compatibility': compatibility_suite,
+    'checkout': checkout_suite,
+    'cart': cart_suite,
+    'product_page': product_page_suite,
+    'reviews': reviews_suite,
+    'listing': listing_suite,
+    'handlers': handlers_suite,
+    'cards': cards_suite,
+}
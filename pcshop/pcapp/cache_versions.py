@@ -0,0 +1,66 @@
+"""
+Version counters kept in the shared cache.
+
+In-process caches (navigation tree, suggestion index, compatibility
+tables) tag their data with the version they were built for and rebuild
+when it changes, so bumping a version invalidates them in every worker.
+
+Caches that can apply a change in place use record_change() instead of
+bump_version(): the change is kept under the new version for a while, and
+changes_since() hands other workers the changes they missed, so they
+catch up without a rebuild.
+"""
+import time
+
+from django.core.cache import cache
+
+CHANGE_KEY = '{key}:change:{version}'
+CHANGE_TIMEOUT = 60 * 60
+# Further behind than this, a rebuild is cheaper than replaying changes
+MAX_REPLAY = 500
+
+
+def current_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Seed with a timestamp so a lost key never reuses an old version
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """
+    Increment the version and return the new value.
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, None)
+        return version
+
+
+def record_change(key, change, timeout=CHANGE_TIMEOUT):
+    """
+    Bump the version and record ``change`` under the new one. Returns the
+    new version.
+    """
+    version = bump_version(key)
+    cache.set(CHANGE_KEY.format(key=key, version=version), change, timeout)
+    return version
+
+
+def changes_since(key, version, current):
+    """
+    The changes recorded after ``version`` up to ``current``, oldest first,
+    or None when they cannot all be replayed (too many, expired, or the
+    version was reset) and the caller has to rebuild.
+    """
+    if not isinstance(version, int) or not 0 <= current - version <= MAX_REPLAY:
+        return None
+    keys = [CHANGE_KEY.format(key=key, version=number) for number in range(version + 1, current + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+    return [changes[change_key] for change_key in keys]
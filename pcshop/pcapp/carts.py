@@ -0,0 +1,302 @@
+"""
+Shopping carts with pluggable storage.
+
+get_cart() returns a CookieCart for anonymous visitors and a DatabaseCart
+for signed-in users. Both expose the same operations and return their
+lines as CartItem instances (unsaved ones for cookie carts), so views and
+templates do not care where a cart lives.
+
+Anonymous carts are kept in a signed cookie, so window-shoppers never
+write to the database and do not hold stock; the units are only checked
+against what is in stock. CartCookieMiddleware writes the cookie back
+when the cart changed. When a visitor signs in, merge_cookie_cart() folds
+the cookie cart into their Cart with a single bulk upsert.
+
+Async views use aget_cart() and the a-prefixed cart methods, which run the
+synchronous ones in a thread like the ORM's async API does.
+"""
+import json
+from decimal import Decimal
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core import signing
+from django.db import transaction
+
+from .inventory import release, reserve_with_cleanup
+from .models import Cart, CartItem, CartSummary, Product
+
+COOKIE_NAME = 'pcapp_cart'
+COOKIE_SALT = 'pcapp.carts'
+COOKIE_MAX_AGE = 30 * 24 * 60 * 60
+# Keeps the cookie well under the 4 KB browsers accept
+MAX_COOKIE_LINES = 100
+
+
+def load_cookie_quantities(request):
+    """
+    Read ``{product_id: quantity}`` from the signed cart cookie, ignoring a
+    missing, tampered or malformed one.
+    """
+    try:
+        data = request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+        quantities = {int(pk): int(quantity) for pk, quantity in json.loads(data).items()} if data else {}
+    except (signing.BadSignature, ValueError, TypeError, AttributeError):
+        return {}
+    return {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+
+
+class BaseCart:
+    _lines = None
+    _summary = None
+
+    def lines(self):
+        raise NotImplementedError
+
+    def changed(self):
+        self._lines = None
+        self._summary = None
+
+    def summary(self):
+        """
+        The cart's CartSummary (item count and price total), computed once
+        per change: from the lines when they are loaded anyway.
+        """
+        if self._summary is None:
+            lines = self.lines()
+            self._summary = CartSummary(
+                sum(item.quantity for item in lines),
+                sum((item.total_price for item in lines), Decimal('0.00')),
+            )
+        return self._summary
+
+    async def aset(self, product, quantity):
+        return await sync_to_async(self.set)(product, quantity)
+
+    async def aquantity(self, product_id):
+        return await sync_to_async(self.quantity)(product_id)
+
+    async def aremove(self, product_id):
+        return await sync_to_async(self.remove)(product_id)
+
+    async def asummary(self):
+        return await sync_to_async(self.summary)()
+
+    @property
+    def total_items(self):
+        return self.summary().total_items
+
+    @property
+    def total_price(self):
+        return self.summary().total_price
+
+
+class CookieCart(BaseCart):
+
+    def __init__(self, request):
+        self.quantities = load_cookie_quantities(request)
+        self.modified = False
+
+    def lines(self):
+        if self._lines is None:
+            products = (
+                Product.objects.filter(is_available=True).select_related('category', 'company')
+                .in_bulk(list(self.quantities))
+            )
+            self._lines = [
+                CartItem(product=products[pk], quantity=quantity)
+                for pk, quantity in self.quantities.items() if pk in products
+            ]
+        return self._lines
+
+    def set(self, product, quantity):
+        """
+        Set the units of a product, capped at its stock. Returns the units
+        now in the cart.
+        """
+        quantity = min(quantity, product.stock)
+        if quantity > 0 and (product.pk in self.quantities or len(self.quantities) < MAX_COOKIE_LINES):
+            self.quantities[product.pk] = quantity
+        else:
+            quantity = 0
+            self.quantities.pop(product.pk, None)
+        self.modified = True
+        self.changed()
+        return quantity
+
+    def quantity(self, product_id):
+        return self.quantities.get(product_id, 0)
+
+    def add(self, product, quantity):
+        return self.set(product, self.quantity(product.pk) + quantity)
+
+    def remove(self, product_id):
+        if self.quantities.pop(product_id, None) is not None:
+            self.modified = True
+            self.changed()
+
+    def save(self, response):
+        if self.quantities:
+            value = json.dumps({str(pk): quantity for pk, quantity in self.quantities.items()}, separators=(',', ':'))
+            response.set_signed_cookie(
+                COOKIE_NAME, value, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+            )
+        else:
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+
+
+class DatabaseCart(BaseCart):
+    """
+    A signed-in user's Cart. Reading never creates the Cart row; the first
+    change does. Changes hold the units with stock reservations.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._cart = None
+
+    @property
+    def cart(self):
+        if self._cart is None:
+            self._cart, _ = Cart.objects.get_or_create(user=self.user)
+        return self._cart
+
+    def lines(self):
+        if self._lines is None:
+            self._lines = list(
+                CartItem.objects.filter(cart__user=self.user)
+                .select_related('product', 'product__category', 'product__company')
+                .order_by('created_at')
+            )
+        return self._lines
+
+    def summary(self):
+        # Without loaded lines, let the database add them up
+        if self._summary is None and self._lines is None:
+            self._summary = CartItem.objects.filter(cart__user=self.user).summary()
+        return super().summary()
+
+    def quantity(self, product_id):
+        if self._lines is not None:
+            return next((item.quantity for item in self._lines if item.product_id == product_id), 0)
+        return CartItem.objects.filter(
+            cart__user=self.user, product_id=product_id,
+        ).values_list('quantity', flat=True).first() or 0
+
+    def set(self, product, quantity):
+        """
+        Set the units of a product, holding them with a reservation capped at
+        what is left in stock. Returns the units now in the cart.
+        """
+        cart = self.cart
+        with transaction.atomic():
+            if quantity > 0:
+                quantity = reserve_with_cleanup(cart, product.pk, quantity, partial=True)
+            else:
+                release(cart, product.pk)
+            if quantity > 0:
+                CartItem.objects.update_or_create(cart=cart, product=product, defaults={'quantity': quantity})
+            else:
+                CartItem.objects.filter(cart=cart, product=product).delete()
+        self.changed()
+        return quantity
+
+    def add(self, product, quantity):
+        return self.set(product, self.quantity(product.pk) + quantity)
+
+    def remove(self, product_id):
+        cart = Cart.objects.filter(user=self.user).first()
+        if cart is None:
+            return
+        with transaction.atomic():
+            release(cart, product_id)
+            CartItem.objects.filter(cart=cart, product_id=product_id).delete()
+        self.changed()
+
+
+def get_cart(request):
+    """
+    The cart for this request, created once per request.
+    """
+    if not hasattr(request, '_cart'):
+        if request.user.is_authenticated:
+            request._cart = DatabaseCart(request.user)
+        else:
+            request._cart = CookieCart(request)
+    return request._cart
+
+
+async def aget_cart(request):
+    """
+    get_cart() for async views, which must not load request.user lazily.
+    """
+    if not hasattr(request, '_cart'):
+        user = await request.auser()
+        if user.is_authenticated:
+            request._cart = DatabaseCart(user)
+        else:
+            request._cart = CookieCart(request)
+    return request._cart
+
+
+def merge_cookie_cart(request, user):
+    """
+    Fold the anonymous cookie cart into ``user``'s Cart.
+
+    Each line keeps the larger of the two quantities, so a merge that runs
+    twice (the cookie outliving a logout, say) does not double the cart.
+    Quantities are capped at stock but not reserved; checkout claims any
+    units the cart does not hold yet. Costs a fixed handful of queries.
+    """
+    quantities = load_cookie_quantities(request)
+    request._cart_merged = True
+    # The request switches to the user's cart from here on
+    request.__dict__.pop('_cart', None)
+    if not quantities:
+        return
+    stock = dict(Product.objects.filter(pk__in=quantities, is_available=True).values_list('pk', 'stock'))
+    if not stock:
+        return
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        existing = dict(
+            CartItem.objects.filter(cart=cart, product_id__in=stock).values_list('product_id', 'quantity')
+        )
+        lines = []
+        for pk, available in stock.items():
+            quantity = max(existing.get(pk, 0), min(quantities[pk], available))
+            if quantity > 0 and quantity != existing.get(pk):
+                lines.append(CartItem(cart=cart, product_id=pk, quantity=quantity))
+        CartItem.objects.bulk_create(
+            lines, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity', 'updated_at'],
+        )
+
+
+class CartCookieMiddleware:
+    """
+    Write changed cookie carts to the response, and drop the cookie once it
+    has been merged into a signed-in user's cart.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        cart = getattr(request, '_cart', None)
+        if getattr(request, '_cart_merged', False):
+            response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        elif isinstance(cart, CookieCart) and cart.modified:
+            cart.save(response)
+        return response
@@ -0,0 +1,40 @@
+import re
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Bytes of CSS a template may still carry inline
+INLINE_STYLE_LIMIT = 1024
+
+STYLE_BLOCK = re.compile(r'<style\b[^>]*>(.*?)</style>', re.S | re.I)
+
+
+def template_dirs():
+    dirs = [Path(apps.get_app_config('pcapp').path) / 'templates']
+    for backend in settings.TEMPLATES:
+        dirs.extend(Path(directory) for directory in backend.get('DIRS', []))
+    return dirs
+
+
+@register(Tags.templates)
+def check_inline_styles(app_configs, **kwargs):
+    """
+    Inline <style> blocks are sent again with every page; styles belong in
+    the cached stylesheets under pcapp/static/pcapp/css (see pcapp.assets).
+    """
+    limit = getattr(settings, 'PCAPP_INLINE_STYLE_LIMIT', INLINE_STYLE_LIMIT)
+    errors = []
+    for directory in template_dirs():
+        for path in sorted(directory.rglob('*.html')):
+            for block in STYLE_BLOCK.finditer(path.read_text(encoding='utf-8')):
+                size = len(block.group(1).encode())
+                if size > limit:
+                    errors.append(Error(
+                        f'{path} has a {size}-byte inline <style> block (the limit is {limit}).',
+                        hint="Move the rules to a stylesheet under pcapp/static/pcapp/css and link it with {% static %}.",
+                        obj=str(path),
+                        id='pcapp.E001',
+                    ))
+    return errors
@@ -0,0 +1,435 @@
+"""
+PC build compatibility engine.
+
+Parts are classified into build roles by category name, and their
+specifications (read from the extracted ProductSpec rows, see
+pcapp.facets) are normalized into profiles: sockets, memory types, form
+factors, power draw, lengths. Rules relate one attribute of one role to
+an attribute of another. They are compiled once into per-role tables,
+and the catalogue keeps inverted indexes per (role, attribute, value), so
+checking a build costs O(parts) and "which motherboards fit this CPU" is
+answered with index lookups instead of a catalogue scan.
+"""
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from .cache_versions import bump_version, current_version
+from .facets import parse_number
+from .models import Category, Product, ProductSpec
+from .search import tokenize
+
+COMPATIBILITY_VERSION_KEY = 'pcapp:compatibility:version'
+
+# Build roles: label and the category name keywords that identify them
+ROLES = {
+    'processor': ('Processor', ('processor', 'processors', 'cpu', 'cpus')),
+    'motherboard': ('Motherboard', ('motherboard', 'motherboards', 'mainboard')),
+    'memory': ('Memory', ('memory', 'ram')),
+    'graphics_card': ('Graphics Card', ('graphics', 'gpu', 'gpus', 'video card')),
+    'storage': ('Storage', ('storage', 'ssd', 'hdd', 'hard drive', 'nvme')),
+    'power_supply': ('Power Supply', ('power supply', 'power supplies', 'psu', 'smps')),
+    'case': ('Case', ('case', 'cases', 'cabinet', 'cabinets', 'chassis')),
+}
+
+# Normalized spec keys (lowercase, alphanumerics only) for each profile attribute
+ATTRIBUTE_ALIASES = {
+    'socket': ('socket', 'cpusocket', 'sockettype', 'processorsocket'),
+    'chipset': ('chipset',),
+    'supported_chipsets': ('supportedchipsets', 'compatiblechipsets', 'chipsetsupport'),
+    'memory_type': ('memorytype', 'ramtype', 'memorysupporttype', 'memorystandard'),
+    'form_factor': ('formfactor',),
+    'supported_form_factors': (
+        'supportedformfactors', 'motherboardsupport', 'motherboardformfactors',
+        'motherboardcompatibility', 'moboformfactor',
+    ),
+    'power_draw': ('tdp', 'tbp', 'totalboardpower', 'powerdraw', 'powerconsumption'),
+    'wattage': ('wattage', 'watts', 'outputwattage', 'ratedpower', 'continuouspower'),
+    'length': ('length', 'cardlength', 'gpulength'),
+    'max_gpu_length': ('maxgpulength', 'gpuclearance', 'maxvgalength', 'maxgraphicscardlength'),
+}
+ALIASES = {alias: attribute for attribute, aliases in ATTRIBUTE_ALIASES.items() for alias in aliases}
+NUMERIC_ATTRIBUTES = {'power_draw', 'wattage', 'length', 'max_gpu_length'}
+
+# Motherboard form factors a case of each form factor accepts
+FORM_FACTOR_FITS = {
+    'EATX': {'EATX', 'ATX', 'MATX', 'MINIITX'},
+    'ATX': {'ATX', 'MATX', 'MINIITX'},
+    'MATX': {'MATX', 'MINIITX'},
+    'MINIITX': {'MINIITX'},
+}
+FORM_FACTOR_NAMES = {
+    'EATX': 'EATX', 'EXTENDEDATX': 'EATX', 'ATX': 'ATX',
+    'MATX': 'MATX', 'MICROATX': 'MATX', 'UATX': 'MATX',
+    'ITX': 'MINIITX', 'MINIITX': 'MINIITX',
+}
+
+# Power for the motherboard, memory, storage and fans on top of CPU and GPU
+BASE_POWER = 75
+# Recommended PSU headroom over the estimated load
+PSU_HEADROOM = 1.3
+
+
+def role_for_category(name):
+    text = ' '.join(tokenize(name))
+    words = set(text.split())
+    for role, (_, keywords) in ROLES.items():
+        if any(keyword in words or (' ' in keyword and keyword in text) for keyword in keywords):
+            return role
+    return None
+
+
+def normalize_key(key):
+    """
+    Map a spec key ("memorySupport.type") to a profile attribute.
+    """
+    full = re.sub(r'[^a-z0-9]', '', key.lower())
+    last = re.sub(r'[^a-z0-9]', '', key.rsplit('.', 1)[-1].lower())
+    return ALIASES.get(full) or ALIASES.get(last)
+
+
+def normalize_value(attribute, value):
+    """
+    Return the normalized values of a spec value for an attribute.
+    """
+    text = str(value).upper()
+    if attribute in NUMERIC_ATTRIBUTES:
+        number = parse_number(text)
+        # Zero or negative watts and lengths mean the spec is missing
+        if number is None or number <= 0:
+            return []
+        if attribute in ('length', 'max_gpu_length') and 'CM' in text:
+            number *= 10
+        return [float(number)]
+    if attribute == 'memory_type':
+        return re.findall(r'DDR\d', text)
+    compact = re.sub(r'[^A-Z0-9]', '', text)
+    if attribute == 'socket':
+        return [compact.removeprefix('SOCKET')] if compact else []
+    if attribute in ('chipset', 'supported_chipsets'):
+        return [compact.removeprefix('AMD').removeprefix('INTEL')] if compact else []
+    if attribute in ('form_factor', 'supported_form_factors'):
+        return [FORM_FACTOR_NAMES[compact]] if compact in FORM_FACTOR_NAMES else []
+    return [compact] if compact else []
+
+
+def build_profile(spec_pairs):
+    """
+    Turn (key, value) spec pairs into a profile: a set of values per string
+    attribute and the largest number per numeric attribute.
+    """
+    profile = defaultdict(set)
+    for key, value in spec_pairs:
+        attribute = normalize_key(key)
+        if attribute:
+            profile[attribute].update(normalize_value(attribute, value))
+    result = {}
+    for attribute, values in profile.items():
+        if values:
+            result[attribute] = max(values) if attribute in NUMERIC_ATTRIBUTES else frozenset(values)
+    # A case without an explicit list supports what fits its own form factor
+    if 'supported_form_factors' not in result and 'form_factor' in result:
+        supported = set()
+        for form_factor in result['form_factor']:
+            supported |= FORM_FACTOR_FITS.get(form_factor, set())
+        if supported:
+            result['supported_form_factors'] = frozenset(supported)
+    return result
+
+
+class SharedValue:
+    """
+    Two parts are compatible when the attribute value sets intersect, e.g.
+    the CPU socket and the motherboard socket.
+    """
+
+    def __init__(self, role_a, attribute_a, role_b, attribute_b, message, required=True):
+        self.role_a, self.attribute_a = role_a, attribute_a
+        self.role_b, self.attribute_b = role_b, attribute_b
+        self.message = message
+        # Whether missing specifications are reported as unverified
+        self.required = required
+
+    def check(self, profile_a, profile_b):
+        a, b = profile_a.get(self.attribute_a), profile_b.get(self.attribute_b)
+        if not a or not b:
+            return None
+        if a & b:
+            return True
+        return self.message.format(a='/'.join(sorted(a)), b='/'.join(sorted(b)))
+
+    def candidates(self, catalogue, target_role, known_profile):
+        if target_role == self.role_b:
+            values, role, attribute = known_profile.get(self.attribute_a), self.role_b, self.attribute_b
+        else:
+            values, role, attribute = known_profile.get(self.attribute_b), self.role_a, self.attribute_a
+        if not values:
+            return None
+        # Parts that do not list the attribute cannot be ruled out
+        ids = set(catalogue.unknown.get((role, attribute), ()))
+        for value in values:
+            ids |= catalogue.index.get((role, attribute, value), set())
+        return ids
+
+
+class FitsWithin:
+    """
+    The numeric attribute of part A must not exceed that of part B, e.g.
+    the GPU length and the case's GPU clearance.
+    """
+
+    def __init__(self, role_a, attribute_a, role_b, attribute_b, message, required=True):
+        self.role_a, self.attribute_a = role_a, attribute_a
+        self.role_b, self.attribute_b = role_b, attribute_b
+        self.message = message
+        # Whether missing specifications are reported as unverified
+        self.required = required
+
+    def check(self, profile_a, profile_b):
+        a, b = profile_a.get(self.attribute_a), profile_b.get(self.attribute_b)
+        if a is None or b is None:
+            return None
+        if a <= b:
+            return True
+        return self.message.format(a=f'{a:g}', b=f'{b:g}')
+
+    def candidates(self, catalogue, target_role, known_profile):
+        if target_role == self.role_b:
+            limit = known_profile.get(self.attribute_a)
+            if limit is None:
+                return None
+            ranked = catalogue.sorted_values.get((self.role_b, self.attribute_b), [])
+            matches = {pk for _, pk in ranked[bisect.bisect_left(ranked, (limit, -1)):]}
+            return matches | catalogue.unknown.get((self.role_b, self.attribute_b), set())
+        limit = known_profile.get(self.attribute_b)
+        if limit is None:
+            return None
+        ranked = catalogue.sorted_values.get((self.role_a, self.attribute_a), [])
+        matches = {pk for _, pk in ranked[:bisect.bisect_right(ranked, (limit, float('inf')))]}
+        return matches | catalogue.unknown.get((self.role_a, self.attribute_a), set())
+
+
+RULES = [
+    SharedValue('processor', 'socket', 'motherboard', 'socket',
+                'The processor socket ({a}) does not match the motherboard socket ({b}).'),
+    SharedValue('processor', 'supported_chipsets', 'motherboard', 'chipset',
+                'The processor supports {a} chipsets, but the motherboard uses {b}.', required=False),
+    SharedValue('memory', 'memory_type', 'motherboard', 'memory_type',
+                'The memory ({a}) is not supported by the motherboard ({b}).'),
+    SharedValue('memory', 'memory_type', 'processor', 'memory_type',
+                'The memory ({a}) is not supported by the processor ({b}).', required=False),
+    SharedValue('motherboard', 'form_factor', 'case', 'supported_form_factors',
+                'The {a} motherboard does not fit a case that supports {b}.'),
+    FitsWithin('graphics_card', 'length', 'case', 'max_gpu_length',
+               'The graphics card is {a} mm long but the case only fits {b} mm.'),
+]
+
+# Rules compiled per role, so a check only visits rules between selected parts
+RULES_BY_ROLE = defaultdict(list)
+for _rule in RULES:
+    RULES_BY_ROLE[_rule.role_a].append(_rule)
+    RULES_BY_ROLE[_rule.role_b].append(_rule)
+
+
+RULE_ATTRIBUTES = {(rule.role_a, rule.attribute_a) for rule in RULES}
+RULE_ATTRIBUTES |= {(rule.role_b, rule.attribute_b) for rule in RULES}
+RULE_ATTRIBUTES.add(('power_supply', 'wattage'))
+
+
+def estimate_power(profiles):
+    draw = sum(profiles[role].get('power_draw', 0) for role in ('processor', 'graphics_card') if role in profiles)
+    return int(BASE_POWER + draw)
+
+
+class Catalogue:
+    """
+    Profiles of every part plus the lookup tables used to find compatible
+    parts: sets of product ids per (role, attribute, value), sorted
+    (value, id) lists per numeric (role, attribute), and the parts of each
+    role that do not list an attribute used by a rule.
+    """
+
+    def __init__(self, parts, role_categories=None):
+        # parts: iterable of (product_id, role, name, spec_pairs)
+        self.parts = {}
+        self.role_categories = role_categories or {}
+        self.by_role = defaultdict(set)
+        self.index = defaultdict(set)
+        sorted_values = defaultdict(list)
+        for product_id, role, name, spec_pairs in parts:
+            profile = build_profile(spec_pairs)
+            self.parts[product_id] = (role, name, profile)
+            self.by_role[role].add(product_id)
+            for attribute, value in profile.items():
+                if attribute in NUMERIC_ATTRIBUTES:
+                    sorted_values[role, attribute].append((value, product_id))
+                else:
+                    for item in value:
+                        self.index[role, attribute, item].add(product_id)
+        self.sorted_values = {key: sorted(values) for key, values in sorted_values.items()}
+        self.unknown = {}
+        for role, attribute in RULE_ATTRIBUTES:
+            self.unknown[role, attribute] = {
+                pk for pk in self.by_role.get(role, ()) if attribute not in self.parts[pk][2]
+            }
+        self.version = None
+
+    def check(self, selection):
+        """
+        Check a build given as {role: product_id}.
+        """
+        issues, warnings, recommendations = [], [], []
+        profiles, results = {}, {}
+        for role, product_id in selection.items():
+            part = self.parts.get(product_id)
+            if part is None or part[0] != role:
+                issues.append(f'The selected {ROLES[role][0].lower()} is not a known {ROLES[role][0].lower()}.')
+                continue
+            profiles[role] = part[2]
+            results[role] = {'id': product_id, 'name': part[1], 'compatible': True}
+
+        for role in profiles:
+            for rule in RULES_BY_ROLE[role]:
+                # Visit each pair once, from its first role
+                if rule.role_a != role or rule.role_b not in profiles:
+                    continue
+                outcome = rule.check(profiles[rule.role_a], profiles[rule.role_b])
+                if outcome is None:
+                    if rule.required:
+                        warnings.append(
+                            f'Could not verify {ROLES[rule.role_a][0].lower()} and '
+                            f'{ROLES[rule.role_b][0].lower()} compatibility from the listed specifications.'
+                        )
+                elif outcome is not True:
+                    issues.append(outcome)
+                    results[rule.role_a]['compatible'] = False
+                    results[rule.role_b]['compatible'] = False
+
+        power = estimate_power(profiles)
+        power_percentage = None
+        if 'power_supply' in profiles:
+            wattage = profiles['power_supply'].get('wattage')
+            if wattage is None or wattage <= 0:
+                warnings.append('Could not verify the power supply wattage.')
+            else:
+                power_percentage = min(100, round(power * 100 / wattage))
+                if wattage < power:
+                    issues.append(f'The power supply ({wattage:g} W) is below the estimated load of {power} W.')
+                    results['power_supply']['compatible'] = False
+                    recommendations.append(f'Choose a power supply of at least {round(power * PSU_HEADROOM)} W.')
+                elif wattage < power * PSU_HEADROOM:
+                    recommendations.append(
+                        f'Consider a power supply of at least {round(power * PSU_HEADROOM)} W for headroom.'
+                    )
+
+        if issues:
+            recommendations.insert(0, 'Use "compatible parts" to find alternatives for the parts marked with an issue.')
+        return {
+            'is_compatible': not issues,
+            'issues': issues,
+            'warnings': warnings,
+            'recommendations': recommendations,
+            'results': results,
+            'power_consumption': power,
+            'power_percentage': power_percentage,
+        }
+
+    def compatible_parts(self, role, selection):
+        """
+        Ids of the parts of ``role`` compatible with every selected part,
+        found through the lookup tables.
+        """
+        candidates = None
+        profiles = {
+            other: self.parts[pk][2] for other, pk in selection.items()
+            if other != role and pk in self.parts
+        }
+        for rule in RULES_BY_ROLE[role]:
+            other = rule.role_b if rule.role_a == role else rule.role_a
+            if other not in profiles:
+                continue
+            matches = rule.candidates(self, role, profiles[other])
+            if matches is not None:
+                candidates = matches if candidates is None else candidates & matches
+        if role == 'power_supply':
+            ranked = self.sorted_values.get(('power_supply', 'wattage'), [])
+            power = estimate_power(profiles)
+            matches = {pk for _, pk in ranked[bisect.bisect_left(ranked, (power, -1)):]}
+            matches |= self.unknown.get(('power_supply', 'wattage'), set())
+            candidates = matches if candidates is None else candidates & matches
+        if candidates is None:
+            candidates = self.by_role[role]
+        return candidates
+
+
+def load_catalogue():
+    role_categories = defaultdict(list)
+    category_roles = {}
+    for category_id, name in Category.objects.values_list('id', 'name'):
+        role = role_for_category(name)
+        if role:
+            role_categories[role].append(category_id)
+            category_roles[category_id] = role
+
+    specs = defaultdict(list)
+    for product_id, key, value in (
+        ProductSpec.objects.filter(category_id__in=category_roles)
+        .order_by().values_list('product_id', 'key', 'value')
+    ):
+        specs[product_id].append((key, value))
+
+    products = Product.objects.filter(category_id__in=category_roles).order_by().values_list('id', 'name', 'category_id')
+    return Catalogue(
+        ((pk, category_roles[category_id], name, specs.get(pk, [])) for pk, name, category_id in products),
+        role_categories=dict(role_categories),
+    )
+
+
+_catalogue = None
+_lock = threading.Lock()
+
+
+def get_catalogue():
+    global _catalogue
+    version = current_version(COMPATIBILITY_VERSION_KEY)
+    catalogue = _catalogue
+    if catalogue is None or catalogue.version != version:
+        with _lock:
+            catalogue = _catalogue
+            if catalogue is None or catalogue.version != version:
+                catalogue = load_catalogue()
+                catalogue.version = version
+                _catalogue = catalogue
+    return catalogue
+
+
+def invalidate():
+    bump_version(COMPATIBILITY_VERSION_KEY)
+
+
+def product_changed(category_ids):
+    """
+    Invalidate the catalogue after a product in one of ``category_ids``
+    (its old and new category) changed, if either is a build role.
+    """
+    names = Category.objects.filter(pk__in=category_ids).values_list('name', flat=True)
+    if any(role_for_category(name) for name in names):
+        invalidate()
+
+
+def category_changed(old_name, new_name):
+    """
+    Invalidate the catalogue when a category gained, lost or changed its
+    build role; ``old_name`` is None when unknown.
+    """
+    if old_name is None or role_for_category(old_name) != role_for_category(new_name):
+        invalidate()
+
+
+def role_queryset(role):
+    """
+    Products that can be picked for a build role.
+    """
+    category_ids = get_catalogue().role_categories.get(role, [])
+    return Product.objects.filter(category_id__in=category_ids).select_related('company')
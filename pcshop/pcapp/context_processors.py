@@ -1,9 +1,12 @@
-from .models import Category
+from .navigation import get_navigation
 
 def categories_processor(request):
     """
     Context processor to make categories available in all templates.
+    The navigation tree is cached, so warm requests run no queries.
     """
+    navigation = get_navigation()
     return {
-        'categories': Category.objects.all()
-    } 
\ No newline at end of file
+        'categories': navigation['categories'],
+        'nav_companies': navigation['companies'],
+    }
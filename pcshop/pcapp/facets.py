@@ -0,0 +1,220 @@
+"""
+Faceted filtering on Product.specifications.
+
+Specifications are flattened into ProductSpec rows (one per key/value,
+with the leading number parsed for range filters). Listings filter on
+them with indexed subqueries, and facet counts come from a single
+GROUP BY over the matching products' rows.
+
+Query parameters:
+    spec_<key>=<value>        exact value; repeat the parameter to OR values
+    spec_<key>_min=<number>   numeric lower bound, e.g. spec_vram_min=12
+    spec_<key>_max=<number>   numeric upper bound
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Product, ProductSpec
+
+PARAM_PREFIX = 'spec_'
+
+# Keys with more distinct values than this (serial numbers, prose) are not facets
+MAX_FACET_VALUES = 25
+MAX_LENGTH = 100
+
+NUMBER_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)')
+# ProductSpec.numeric_value has 9 integer digits and 3 decimal places;
+# anything that rounds to 10**9 does not fit (barcodes, part numbers)
+NUMBER_LIMIT = Decimal('999999999.9995')
+
+
+def parse_number(value):
+    """
+    Leading number of a spec value: "125W" -> 125, "16 GB" -> 16. None when
+    there is no number or it is too large for ProductSpec.numeric_value.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = Decimal(str(value))
+    else:
+        match = NUMBER_RE.match(str(value))
+        if not match:
+            return None
+        try:
+            number = Decimal(match.group(1))
+        except InvalidOperation:
+            return None
+    if not number.is_finite() or abs(number) >= NUMBER_LIMIT:
+        return None
+    return number
+
+
+def split_value(value):
+    # "DDR4, DDR5" is a list of short values; longer text stays whole
+    parts = [part.strip() for part in value.split(',')]
+    if len(parts) > 1 and all(0 < len(part) <= 24 for part in parts):
+        return parts
+    return [value]
+
+
+def extract_specifications(specifications, key=''):
+    """
+    Yield (key, value) pairs from a specifications JSON object. Nested
+    objects produce dotted keys ("memorySupport.type") and lists produce
+    one pair per item.
+    """
+    if isinstance(specifications, dict):
+        for name, value in specifications.items():
+            yield from extract_specifications(value, f'{key}.{name}' if key else str(name))
+    elif isinstance(specifications, (list, tuple)):
+        for item in specifications:
+            yield from extract_specifications(item, key)
+    elif specifications is not None and key:
+        if isinstance(specifications, str):
+            values = split_value(specifications)
+        else:
+            values = [str(specifications)]
+        for value in values:
+            yield key[:MAX_LENGTH], value[:MAX_LENGTH]
+
+
+def spec_rows(product):
+    rows = {}
+    for key, value in extract_specifications(product.specifications or {}):
+        if value and (key, value) not in rows:
+            rows[key, value] = ProductSpec(
+                product_id=product.pk,
+                category_id=product.category_id,
+                key=key,
+                value=value,
+                numeric_value=parse_number(value),
+            )
+    return list(rows.values())
+
+
+def index_product_specs(product):
+    """
+    Replace the extracted spec rows of a single product.
+    """
+    with transaction.atomic():
+        ProductSpec.objects.filter(product_id=product.pk).delete()
+        ProductSpec.objects.bulk_create(spec_rows(product))
+
+
+def rebuild_spec_index(batch_size=2000):
+    """
+    Re-extract the spec rows of every product; returns the number of rows.
+    """
+    total = 0
+    with transaction.atomic():
+        ProductSpec.objects.all().delete()
+        batch = []
+        for product in Product.objects.only('id', 'category_id', 'specifications').order_by().iterator(chunk_size=batch_size):
+            batch.extend(spec_rows(product))
+            if len(batch) >= batch_size:
+                ProductSpec.objects.bulk_create(batch, batch_size=batch_size)
+                total += len(batch)
+                batch = []
+        ProductSpec.objects.bulk_create(batch, batch_size=batch_size)
+        total += len(batch)
+    return total
+
+
+def parse_filters(params):
+    """
+    Read the spec_* query parameters into {key: {'values': [...], 'min': ..., 'max': ...}}.
+    """
+    filters = {}
+    for name in params:
+        if not name.startswith(PARAM_PREFIX):
+            continue
+        key = name[len(PARAM_PREFIX):]
+        bound = None
+        if key.endswith(('_min', '_max')):
+            key, bound = key[:-4], key[-3:]
+        if not key:
+            continue
+        if bound is None:
+            values = [value for value in params.getlist(name) if value]
+            if values:
+                filters.setdefault(key, {'values': [], 'min': None, 'max': None})['values'] = values
+        else:
+            number = parse_number(params.get(name, ''))
+            if number is not None:
+                filters.setdefault(key, {'values': [], 'min': None, 'max': None})[bound] = number
+    return filters
+
+
+def apply_filters(products, filters, exclude_key=None):
+    """
+    Restrict a Product queryset to the products matching every filter.
+    """
+    for key, spec_filter in filters.items():
+        if key == exclude_key:
+            continue
+        specs = ProductSpec.objects.filter(key=key)
+        if spec_filter['values']:
+            specs = specs.filter(value__in=spec_filter['values'])
+        if spec_filter['min'] is not None:
+            specs = specs.filter(numeric_value__gte=spec_filter['min'])
+        if spec_filter['max'] is not None:
+            specs = specs.filter(numeric_value__lte=spec_filter['max'])
+        products = products.filter(pk__in=specs.values('product_id'))
+    return products
+
+
+def facet_label(key):
+    words = re.sub(r'([a-z])([A-Z])', r'\1 \2', key).replace('.', ' ').replace('_', ' ')
+    return words[:1].upper() + words[1:]
+
+
+def _count_values(products, category, keys=None):
+    rows = ProductSpec.objects.filter(
+        category=category, product__in=products.order_by().values('pk')
+    )
+    if keys is not None:
+        rows = rows.filter(key__in=keys)
+    return rows.order_by().values_list('key', 'value').annotate(count=Count('product_id', distinct=True))
+
+
+def facet_counts(products, filters, category):
+    """
+    Facets for the listing, each with the number of matching products per
+    value. Keys with an active filter are counted with every other filter
+    applied but not their own, so alternative values keep their counts.
+    """
+    counts = {}
+    for key, value, count in _count_values(apply_filters(products, filters), category):
+        if key not in filters:
+            counts.setdefault(key, {})[value] = count
+    for key in filters:
+        for _, value, count in _count_values(apply_filters(products, filters, exclude_key=key), category, [key]):
+            counts.setdefault(key, {})[value] = count
+
+    facets = []
+    for key in sorted(counts):
+        values = counts[key]
+        active = filters.get(key)
+        if not active and not 1 < len(values) <= MAX_FACET_VALUES:
+            continue
+        selected = set(active['values']) if active else set()
+        numeric = all(parse_number(value) is not None for value in values)
+        facets.append({
+            'key': key,
+            'param': PARAM_PREFIX + key,
+            'label': facet_label(key),
+            'numeric': numeric,
+            'min': active['min'] if active else None,
+            'values': [
+                {'value': value, 'count': count, 'selected': value in selected}
+                for value, count in sorted(
+                    values.items(),
+                    key=lambda item: (parse_number(item[0]) or 0, item[0]) if numeric else item[0],
+                )
+            ][:MAX_FACET_VALUES],
+        })
+    return facets
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
 from .models import UserProfile, Review, ContactMessage, Newsletter, Order
+from .compatibility import ROLES, role_queryset
 
 class UserRegistrationForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -82,4 +83,31 @@ class OrderForm(forms.ModelForm):
             'state': forms.TextInput(attrs={'class': 'form-control'}),
             'pincode': forms.TextInput(attrs={'class': 'form-control'}),
             'payment_method': forms.Select(attrs={'class': 'form-control'}),
-        } 
\ No newline at end of file
+        }
+
+class CompatibilityForm(forms.Form):
+    processor = forms.ModelChoiceField(queryset=None, required=False)
+    motherboard = forms.ModelChoiceField(queryset=None, required=False)
+    memory = forms.ModelChoiceField(queryset=None, required=False)
+    graphics_card = forms.ModelChoiceField(queryset=None, required=False)
+    storage = forms.ModelChoiceField(queryset=None, required=False)
+    power_supply = forms.ModelChoiceField(queryset=None, required=False)
+    case = forms.ModelChoiceField(queryset=None, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for role in ROLES:
+            self.fields[role].queryset = role_queryset(role)
+            self.fields[role].widget.attrs['class'] = 'form-select'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if len(self.selection()) < 2:
+            raise forms.ValidationError('Select at least two components to check.')
+        return cleaned_data
+
+    def selection(self):
+        return {
+            role: product.pk for role, product in self.cleaned_data.items()
+            if role in ROLES and product is not None
+        }
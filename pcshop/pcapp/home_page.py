@@ -0,0 +1,114 @@
+"""
+The home page payload: the featured and discounted product cards.
+
+build_home() first reads the ids of both lists with two narrow queries
+(served by the featured and discount indexes), then loads the card data
+for their union with one IN query through load_cards(). A product on both
+lists is fetched once and the two lists share the instance.
+
+The payload is cached as one unit. A second, shorter-lived key marks it
+fresh; once that expires (after HOME_REFRESH seconds, or earlier when
+mark_stale() is called for a catalogue change), the next request starts a
+rebuild in a background thread and is answered from the cached copy like
+every other request. Only a cold cache makes a request wait for the build.
+"""
+import logging
+import threading
+
+from django.core.cache import cache
+from django.db import connection
+
+from .cache_versions import bump_version
+from .models import Product
+from .product_cache import single_flight
+
+logger = logging.getLogger(__name__)
+
+HOME_KEY = 'pcapp:home:payload'
+HOME_FRESH_KEY = 'pcapp:home:fresh'
+# Bumped with every rebuild, for caches of the rendered page
+HOME_VERSION_KEY = 'pcapp:home:version'
+# Held while a background rebuild runs, so only one worker rebuilds
+REFRESH_LOCK_KEY = 'pcapp:home:refreshing'
+
+HOME_REFRESH = 5 * 60
+HOME_TIMEOUT = 60 * 60 * 24
+REFRESH_LOCK_TIMEOUT = 60
+
+HOME_LIST_SIZE = 8
+
+
+def load_cards(*id_lists):
+    """
+    The product cards for each list of ids, in list order, loaded with a
+    single query over the union of the lists.
+    """
+    ids = list(dict.fromkeys(pk for id_list in id_lists for pk in id_list))
+    products = Product.objects.for_listing().in_bulk(ids) if ids else {}
+    return [[products[pk] for pk in id_list if pk in products] for id_list in id_lists]
+
+
+def build_home():
+    featured = Product.objects.filter(is_featured=True).values_list('pk', flat=True)[:HOME_LIST_SIZE]
+    discounted = (
+        Product.objects.filter(discount_percentage__gt=0).order_by('-discount_percentage')
+        .values_list('pk', flat=True)[:HOME_LIST_SIZE]
+    )
+    featured_products, discounted_products = load_cards(list(featured), list(discounted))
+    return {
+        'featured_products': featured_products,
+        'discounted_products': discounted_products,
+    }
+
+
+def refresh_home():
+    payload = build_home()
+    cache.set(HOME_KEY, payload, HOME_TIMEOUT)
+    cache.set(HOME_FRESH_KEY, True, HOME_REFRESH)
+    bump_version(HOME_VERSION_KEY)
+    return payload
+
+
+def _refresh_worker():
+    try:
+        refresh_home()
+    except Exception:
+        logger.exception('Rebuilding the home page payload failed')
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+        # The thread opened its own connection
+        connection.close()
+
+
+def refresh_in_background():
+    """
+    Start a background rebuild unless one is already running somewhere.
+    Returns the thread started, or None.
+    """
+    if not cache.add(REFRESH_LOCK_KEY, True, REFRESH_LOCK_TIMEOUT):
+        return None
+    thread = threading.Thread(target=_refresh_worker, name='pcapp-home-refresh', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_home():
+    """
+    The home page payload, possibly up to a refresh behind. Costs one cache
+    round trip when warm.
+    """
+    cached = cache.get_many([HOME_KEY, HOME_FRESH_KEY])
+    payload = cached.get(HOME_KEY)
+    if payload is None:
+        payload = single_flight(HOME_KEY, build_home, HOME_TIMEOUT)
+        cache.set(HOME_FRESH_KEY, True, HOME_REFRESH)
+    elif HOME_FRESH_KEY not in cached:
+        refresh_in_background()
+    return payload
+
+
+def mark_stale():
+    """
+    Have the next request refresh the payload in the background.
+    """
+    cache.delete(HOME_FRESH_KEY)
@@ -0,0 +1,207 @@
+"""
+Responsive image derivatives.
+
+Every uploaded product image, category image and company logo gets a
+resized copy per VARIANTS entry, each encoded twice: as WebP and as a
+fallback (JPEG, or PNG when the image has transparency). The copies live
+under DERIVATIVE_DIR in a directory named after the original's full path
+(extension included, so i.png and i.webp do not share copies), and are
+described by a JSON field next to the image field (see SOURCES):
+
+    {'source': 'products/i.webp', 'width': 1600, 'height': 1200,
+     'variants': {'card': {'width': 480, 'height': 360,
+                           'webp': 'derivatives/products/i.webp/card.webp',
+                           'fallback': 'derivatives/products/i.webp/card.jpg'}, ...}}
+
+The widths and heights let templates reserve the image's space before it
+loads, and the responsive_image template tag turns the variants into
+srcset lists.
+
+generate() only touches files, never the database, so the
+build_image_derivatives command can run it in a process pool over the
+whole media tree. Uploads go through schedule(), which runs it on a small
+thread pool after the transaction commits (PCAPP_IMAGE_WORKERS threads;
+0 generates in the request instead) so saving in the admin does not wait
+for the encoding.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from . import home_page, product_cache
+from .models import Category, Company, Product, ProductImage
+from .navigation import invalidate_navigation
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = 'derivatives'
+
+# Maximum width in pixels; smaller images are never scaled up
+VARIANTS = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 1200,
+}
+
+WEBP_OPTIONS = {'quality': 80, 'method': 4}
+FALLBACK_FORMATS = {
+    # format, extension, save options
+    False: ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    True: ('PNG', 'png', {'optimize': True}),
+}
+
+# Model, image field, derivatives field
+SOURCES = (
+    (ProductImage, 'image', 'derivatives'),
+    (Category, 'image', 'image_derivatives'),
+    (Company, 'logo', 'logo_derivatives'),
+)
+
+DEFAULT_WORKERS = 2
+
+_executor = None
+
+
+def derivative_name(name, variant, extension):
+    return f'{DERIVATIVE_DIR}/{name}/{variant}.{extension}'
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _save(image, name, format, options, storage):
+    buffer = BytesIO()
+    image.save(buffer, format, **options)
+    # Storages pick another name rather than overwrite
+    if storage.exists(name):
+        storage.delete(name)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate(name, storage=default_storage):
+    """
+    Write the derivatives of the image stored as ``name`` and return their
+    description (see the module docstring).
+    """
+    with storage.open(name) as file:
+        image = Image.open(file)
+        image.load()
+    # Phones store the rotation in EXIF; the copies are written upright
+    image = ImageOps.exif_transpose(image)
+    alpha = _has_alpha(image)
+    image = image.convert('RGBA' if alpha else 'RGB')
+    fallback_format, fallback_extension, fallback_options = FALLBACK_FORMATS[alpha]
+
+    variants = {}
+    previous = None
+    for variant, max_width in sorted(VARIANTS.items(), key=lambda item: item[1]):
+        width = min(image.width, max_width)
+        if previous is not None and previous['width'] == width:
+            # The image is narrower than this variant too, so reuse the files
+            variants[variant] = previous
+            continue
+        resized = image
+        if width < image.width:
+            height = max(round(image.height * width / image.width), 1)
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        previous = variants[variant] = {
+            'width': resized.width,
+            'height': resized.height,
+            'webp': _save(resized, derivative_name(name, variant, 'webp'), 'WEBP', WEBP_OPTIONS, storage),
+            'fallback': _save(
+                resized, derivative_name(name, variant, fallback_extension),
+                fallback_format, fallback_options, storage,
+            ),
+        }
+    return {'source': name, 'width': image.width, 'height': image.height, 'variants': variants}
+
+
+def store(model, pk, field, derivatives_field, name, derivatives):
+    """
+    Save the derivatives of ``name`` on the row, unless its image has been
+    replaced meanwhile, and drop the cached pages showing it. Returns
+    whether the row was updated.
+    """
+    # update() does not send post_save, so this does not schedule itself again
+    updated = model.objects.filter(pk=pk, **{field: name}).update(**{derivatives_field: derivatives})
+    if updated:
+        if model is ProductImage:
+            # Products carry a copy of their primary image's derivatives
+            Product.objects.filter(images=pk).sync_primary_image()
+        invalidate(model, pk)
+    return bool(updated)
+
+
+def invalidate(model=None, pk=None):
+    """
+    Drop the cached pages showing the derivatives of the given product
+    image, or of any image.
+    """
+    if model is ProductImage and pk is not None:
+        product_id = ProductImage.objects.filter(pk=pk).values_list('product_id', flat=True).first()
+        if product_id is not None:
+            product_cache.invalidate_product(product_id)
+    else:
+        # Category images and company logos are part of the navigation tree
+        invalidate_navigation()
+        product_cache.invalidate_catalogue()
+    home_page.mark_stale()
+
+
+def build(model, pk, field, derivatives_field, name):
+    try:
+        store(model, pk, field, derivatives_field, name, generate(name))
+    except Exception:
+        logger.exception('Generating the derivatives of %s failed', name)
+
+
+def _build_in_worker(*args):
+    try:
+        build(*args)
+    finally:
+        # The worker thread opened its own connection
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        workers = getattr(settings, 'PCAPP_IMAGE_WORKERS', DEFAULT_WORKERS)
+        _executor = ThreadPoolExecutor(workers, thread_name_prefix='pcapp-images')
+    return _executor
+
+
+def _submit(*args):
+    if getattr(settings, 'PCAPP_IMAGE_WORKERS', DEFAULT_WORKERS):
+        _get_executor().submit(_build_in_worker, *args)
+    else:
+        build(*args)
+
+
+def schedule(instance, field, derivatives_field):
+    """
+    Generate the derivatives of the instance's image after the transaction
+    commits, if the image changed since they were last generated.
+    """
+    name = getattr(instance, field).name or ''
+    derivatives = getattr(instance, derivatives_field) or {}
+    if derivatives.get('source', '') == name:
+        return
+    model = type(instance)
+    if not name:
+        # The image was removed
+        model.objects.filter(pk=instance.pk).update(**{derivatives_field: {}})
+        transaction.on_commit(partial(invalidate, model, instance.pk))
+        return
+    # Rows pointing at files that are not there (fixtures, generated
+    # catalogues) are left alone
+    if default_storage.exists(name):
+        transaction.on_commit(partial(_submit, model, instance.pk, field, derivatives_field, name))
@@ -0,0 +1,282 @@
+"""
+Per-request cost instrumentation.
+
+RequestMetricsMiddleware measures a sample of requests: database queries
+(count, time, and statements repeated often enough to suggest an N+1
+loop), template rendering time and the time left for the view code. Each
+sampled response gets a Server-Timing header, which browser dev tools
+show next to the request, and a JSON line on the ``pcapp.instrumentation``
+logger. The numbers are also added to a per-URL-name histogram in process
+memory, served to staff by request_stats().
+
+PCAPP_METRICS_SAMPLE_RATE (0 to 1, default 0) sets the share of requests
+measured. Unsampled requests cost one random() call; with the rate at 0
+the middleware does not even do that.
+"""
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import base as template_base
+
+logger = logging.getLogger(__name__)
+
+# The same statement this many times in one request is reported as N+1
+DEFAULT_DUPLICATE_THRESHOLD = 5
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_current = contextvars.ContextVar('pcapp_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_ms', 'statements', 'template_ms', 'rendering', 'duplicate_threshold')
+
+    def __init__(self, duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD):
+        self.duplicate_threshold = duplicate_threshold
+        self.queries = 0
+        self.db_ms = 0.0
+        self.statements = Counter()
+        self.template_ms = 0.0
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # Called by _record_query(), or installed with connection.execute_wrapper()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - start) * 1000
+            self.queries += 1
+            # Parameters differ between the iterations of an N+1 loop, the SQL does not
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.statements.items() if count >= self.duplicate_threshold}
+
+
+_original_render = template_base.Template.render
+
+
+def _timed_render(self, context):
+    metrics = _current.get()
+    # Included and extended templates render inside the outermost one
+    if metrics is None or metrics.rendering:
+        return _original_render(self, context)
+    metrics.rendering = True
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        metrics.template_ms += (time.perf_counter() - start) * 1000
+        metrics.rendering = False
+
+
+def install_template_timer():
+    template_base.Template.render = _timed_render
+
+
+def _record_query(execute, sql, params, many, context):
+    # Async views run their ORM calls in sync_to_async threads, each with its
+    # own connection; the context variable follows the request into them
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        # First, so execute_wrapper() blocks can still pop their own wrapper
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+def _install_on_thread_connections():
+    for connection in connections.all():
+        _install_query_recorder(connection)
+
+
+def install_query_recorder():
+    """
+    Put _record_query on every connection: those of this thread now, and
+    each thread's as it connects. Connections a thread opened before that
+    are covered by RequestMetricsMiddleware.__acall__.
+    """
+    connection_created.connect(_install_query_recorder, dispatch_uid='pcapp.instrumentation.query_recorder')
+    _install_on_thread_connections()
+
+
+class RouteStats:
+    """
+    Running totals and a latency histogram for one URL name.
+    """
+    __slots__ = ('count', 'total_ms', 'db_ms', 'template_ms', 'queries', 'max_queries', 'n_plus_one', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = self.db_ms = self.template_ms = 0.0
+        self.queries = self.max_queries = self.n_plus_one = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, total_ms, metrics):
+        self.count += 1
+        self.total_ms += total_ms
+        self.db_ms += metrics.db_ms
+        self.template_ms += metrics.template_ms
+        self.queries += metrics.queries
+        self.max_queries = max(self.max_queries, metrics.queries)
+        self.n_plus_one += bool(metrics.duplicates())
+        self.buckets[bisect_left(BUCKETS_MS, total_ms)] += 1
+
+    def percentile(self, pct):
+        """
+        The upper bound of the bucket holding the pct-th percentile, or
+        None when it falls in the open-ended last bucket.
+        """
+        rank = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        count = self.count or 1
+        return {
+            'requests': self.count,
+            'mean_ms': round(self.total_ms / count, 2),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'mean_db_ms': round(self.db_ms / count, 2),
+            'mean_template_ms': round(self.template_ms / count, 2),
+            'mean_queries': round(self.queries / count, 2),
+            'max_queries': self.max_queries,
+            'n_plus_one_requests': self.n_plus_one,
+            'histogram': {
+                **{f'<={bound}ms': count for bound, count in zip(BUCKETS_MS, self.buckets)},
+                f'>{BUCKETS_MS[-1]}ms': self.buckets[-1],
+            },
+        }
+
+
+class StatsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, total_ms, metrics):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+            stats.add(total_ms, metrics)
+
+    def snapshot(self):
+        with self._lock:
+            return {route: stats.as_dict() for route, stats in sorted(self._routes.items())}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = StatsRegistry()
+
+
+def server_timing(metrics, total_ms, view_ms):
+    parts = [
+        f'db;dur={metrics.db_ms:.1f};desc="{metrics.queries} queries"',
+        f'tpl;dur={metrics.template_ms:.1f};desc="templates"',
+        f'view;dur={view_ms:.1f};desc="view code"',
+        f'total;dur={total_ms:.1f}',
+    ]
+    duplicates = metrics.duplicates()
+    if duplicates:
+        parts.append(f'nplus1;desc="{len(duplicates)} repeated statements"')
+    return ', '.join(parts)
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure a sample of requests; see the module docstring. Put it first
+    in MIDDLEWARE so the other middleware's queries are counted too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PCAPP_METRICS_SAMPLE_RATE', 0)
+        self.duplicate_threshold = getattr(settings, 'PCAPP_METRICS_DUPLICATE_THRESHOLD', DEFAULT_DUPLICATE_THRESHOLD)
+        if self.sample_rate:
+            install_template_timer()
+            install_query_recorder()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Under ASGI this hands back get_response's coroutine untouched
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return self.get_response(request)
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics(self.duplicate_threshold)
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        # The request's thread-sensitive sync_to_async calls, and so its ORM
+        # work, all run in one thread, which may have connected already
+        await sync_to_async(_install_on_thread_connections)()
+        metrics = RequestMetrics(self.duplicate_threshold)
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics, start)
+
+    def report(self, request, response, metrics, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        view_ms = max(total_ms - metrics.db_ms - metrics.template_ms, 0.0)
+
+        match = request.resolver_match
+        route = match.view_name if match else 'unresolved'
+        registry.record(route, total_ms, metrics)
+        response['Server-Timing'] = server_timing(metrics, total_ms, view_ms)
+        duplicates = metrics.duplicates()
+        logger.info(json.dumps({
+            'route': route,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 2),
+            'view_ms': round(view_ms, 2),
+            'db_ms': round(metrics.db_ms, 2),
+            'template_ms': round(metrics.template_ms, 2),
+            'queries': metrics.queries,
+            'duplicate_queries': [
+                {'sql': sql[:200], 'count': count}
+                for sql, count in sorted(duplicates.items(), key=lambda item: -item[1])
+            ],
+        }))
+        return response
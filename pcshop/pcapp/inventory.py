@@ -0,0 +1,196 @@
+"""
+Stock reservations.
+
+Product.stock counts the units that can still be sold. Putting a product
+in a cart moves units out of stock into a StockReservation held by that
+cart; every move is a conditional UPDATE (``stock >= quantity``) run in
+the database, so concurrent buyers can never take stock below zero and no
+row has to be read and written back. Reservations expire after
+RESERVATION_SECONDS; release_expired() returns their units to stock.
+Checkout turns the cart's reservations into sold units in one transaction.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+# How long a cart holds its units without activity
+RESERVATION_SECONDS = getattr(settings, 'PCAPP_RESERVATION_SECONDS', 15 * 60)
+
+# Attempts at a reservation while concurrent requests keep changing the stock
+MAX_RETRIES = 5
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f'Not enough stock for products {self.product_ids}')
+
+
+def reservation_expiry():
+    return timezone.now() + timedelta(seconds=RESERVATION_SECONDS)
+
+
+def _per_product(quantities):
+    return Case(
+        *(When(pk=product_id, then=quantity) for product_id, quantity in quantities.items()),
+        default=0,
+    )
+
+
+def take_stock(quantities):
+    """
+    Remove ``{product_id: quantity}`` units from stock in a single UPDATE.
+
+    Either every product has enough stock and all are decremented, or
+    InsufficientStock is raised naming the products that were short. Call
+    inside transaction.atomic() so a failure undoes the caller's other
+    writes too.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    wanted = _per_product(quantities)
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(pk__in=quantities, stock__gte=wanted).update(stock=F('stock') - wanted)
+            if updated != len(quantities):
+                # Leaving the block with an exception undoes the partial decrement
+                raise InsufficientStock(())
+    except InsufficientStock:
+        stock = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock'))
+        raise InsufficientStock(
+            pk for pk, quantity in quantities.items() if stock.get(pk, 0) < quantity
+        ) from None
+
+
+def return_stock(quantities):
+    """
+    Put ``{product_id: quantity}`` units back into stock in a single UPDATE.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(stock=F('stock') + _per_product(quantities))
+
+
+def reserve(cart, product_id, quantity, partial=False):
+    """
+    Make the cart hold exactly ``quantity`` units of a product, taking or
+    returning only the difference, and return the quantity now held.
+
+    With ``partial`` the reservation is capped at what is available instead
+    of raising InsufficientStock.
+    """
+    for _ in range(MAX_RETRIES):
+        try:
+            with transaction.atomic():
+                reservation = (
+                    StockReservation.objects.select_for_update()
+                    .filter(cart=cart, product_id=product_id).first()
+                )
+                held = reservation.quantity if reservation else 0
+                target = quantity
+                if partial and quantity > held:
+                    available = Product.objects.filter(pk=product_id).values_list('stock', flat=True).first() or 0
+                    target = min(quantity, held + available)
+                try:
+                    if target > held:
+                        take_stock({product_id: target - held})
+                    else:
+                        return_stock({product_id: held - target})
+                except InsufficientStock:
+                    if partial:
+                        # Someone else took the stock after we read it; look again
+                        continue
+                    raise
+
+                if target == 0:
+                    if reservation:
+                        reservation.delete()
+                elif reservation:
+                    StockReservation.objects.filter(pk=reservation.pk).update(
+                        quantity=target, expires_at=reservation_expiry(),
+                    )
+                else:
+                    StockReservation.objects.create(
+                        cart=cart, product_id=product_id, quantity=target, expires_at=reservation_expiry(),
+                    )
+                # Activity on the cart keeps all of its units held
+                cart.reservations.exclude(product_id=product_id).update(expires_at=reservation_expiry())
+                return target
+        except IntegrityError:
+            # A concurrent request created the reservation first; start over
+            continue
+    raise InsufficientStock([product_id])
+
+
+def reserve_with_cleanup(cart, product_id, quantity, partial=False):
+    """
+    reserve(), releasing expired reservations first when stock runs out.
+    """
+    try:
+        return reserve(cart, product_id, quantity)
+    except InsufficientStock:
+        if release_expired():
+            try:
+                return reserve(cart, product_id, quantity)
+            except InsufficientStock:
+                pass
+        if not partial:
+            raise
+        return reserve(cart, product_id, quantity, partial=True)
+
+
+def release(cart, product_id):
+    return reserve(cart, product_id, 0)
+
+
+def release_expired(now=None):
+    """
+    Return the units of expired reservations to stock and delete them.
+    Returns the number of reservations released.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired = list(
+            StockReservation.objects.select_for_update(skip_locked=True)
+            .filter(expires_at__lte=now)
+            .values_list('pk', 'product_id', 'quantity')
+        )
+        if not expired:
+            return 0
+        quantities = Counter()
+        for _, product_id, quantity in expired:
+            quantities[product_id] += quantity
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in expired]).delete()
+        return_stock(quantities)
+    return len(expired)
+
+
+def claim_cart_stock(cart, quantities):
+    """
+    Convert the cart's reservations into sold units for checkout.
+
+    ``quantities`` maps product ids to the units being bought. Units the
+    cart already holds are used as they are; any shortfall (reservations
+    that expired and were released, or quantities raised since) is taken
+    from stock, surplus is returned, and the reservations are deleted.
+    Must run inside the checkout transaction: on InsufficientStock the
+    caller rolls back and the cart keeps its reservations.
+    """
+    held = Counter()
+    reservations = list(
+        StockReservation.objects.select_for_update().filter(cart=cart).values_list('pk', 'product_id', 'quantity')
+    )
+    for _, product_id, quantity in reservations:
+        held[product_id] += quantity
+
+    take_stock({pk: quantity - held[pk] for pk, quantity in quantities.items() if quantity > held[pk]})
+    return_stock({pk: quantity - quantities.get(pk, 0) for pk, quantity in held.items() if quantity > quantities.get(pk, 0)})
+    if reservations:
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in reservations]).delete()
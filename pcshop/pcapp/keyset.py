@@ -0,0 +1,157 @@
+"""
+Keyset (cursor) pagination.
+
+OFFSET pagination makes the database step over every row before the page,
+so deep pages get slower the further a visitor scrolls. A keyset page
+starts right after the last row already shown instead: the cursor carries
+that row's sort key and the next query asks for rows past it with a
+row-value comparison such as ``(created_at, id) < (%s, %s)``. With an
+index on the sort key the database seeks straight to the cursor, so every
+page costs the same however deep it is.
+
+Cursors are signed, so clients cannot hand in arbitrary filter values.
+
+Keyset pages need no COUNT. Where a listing still shows a total,
+cached_count() keeps it in the shared cache until the model's rows change.
+"""
+import hashlib
+from collections import namedtuple
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import BooleanField, F, Func, Value
+from django.utils.functional import cached_property
+
+from .cache_versions import bump_version, current_version
+
+DEFAULT_PER_PAGE = 20
+
+COUNT_VERSION_KEY = 'pcapp:count:{model}:version'
+COUNT_KEY = 'pcapp:count:{model}:{version}:{digest}'
+COUNT_TIMEOUT = 15 * 60
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class RowValueAfter(Func):
+    """
+    ``(field, ...) > (value, ...)``, or ``<`` when descending: the rows that
+    come after the given sort key.
+    """
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, fields, values, descending=False):
+        self.width = len(fields)
+        self.operator = '<' if descending else '>'
+        super().__init__(*(F(field) for field in fields), *(Value(value) for value in values))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        parts, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            parts.append(sql)
+            params.extend(expression_params)
+        lhs, rhs = ', '.join(parts[:self.width]), ', '.join(parts[self.width:])
+        return f'({lhs}) {self.operator} ({rhs})', params
+
+
+def _parse_ordering(ordering):
+    fields = [name.lstrip('-') for name in ordering]
+    descending = {name.startswith('-') for name in ordering}
+    if len(descending) != 1:
+        raise ValueError('Keyset ordering must sort every field in the same direction')
+    return fields, descending.pop()
+
+
+def _salt(queryset, ordering):
+    # A cursor is only valid for the listing and ordering it came from
+    return f'pcapp.keyset:{queryset.model._meta.label_lower}:{",".join(ordering)}'
+
+
+def encode_cursor(queryset, ordering, item):
+    fields, _ = _parse_ordering(ordering)
+    opts = queryset.model._meta
+    values = [opts.get_field(name).value_to_string(item) for name in fields]
+    return signing.dumps(values, salt=_salt(queryset, ordering), compress=True)
+
+
+def decode_cursor(queryset, ordering, cursor):
+    """
+    The sort key carried by ``cursor``. Raises InvalidCursor for cursors
+    that are malformed, tampered with or issued for another ordering.
+    """
+    fields, _ = _parse_ordering(ordering)
+    opts = queryset.model._meta
+    try:
+        values = signing.loads(cursor, salt=_salt(queryset, ordering))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise InvalidCursor(cursor)
+        return [opts.get_field(name).to_python(value) for name, value in zip(fields, values)]
+    except (signing.BadSignature, ValueError, TypeError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+def paginate(queryset, ordering, cursor=None, per_page=DEFAULT_PER_PAGE):
+    """
+    One page of ``queryset`` sorted by ``ordering`` (field names, all
+    ascending or all ``-`` descending, ending in a unique field), starting
+    after ``cursor``. Returns a KeysetPage whose next_cursor is None on the
+    last page. Costs a single query.
+    """
+    fields, descending = _parse_ordering(ordering)
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(queryset, ordering, cursor)
+        queryset = queryset.filter(RowValueAfter(fields, values, descending))
+    # One row more than the page tells whether there is a next page
+    items = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(queryset, ordering, items[-1])
+    return KeysetPage(items, next_cursor)
+
+
+def _count_version_key(model):
+    return COUNT_VERSION_KEY.format(model=model._meta.label_lower)
+
+
+def cached_count(queryset, timeout=COUNT_TIMEOUT):
+    """
+    queryset.count(), cached per query until invalidate_counts() is called
+    for its model (or the timeout passes, which bounds how far off a count
+    can be if an invalidation is missed).
+    """
+    model = queryset.model
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(repr((sql, params)).encode(), usedforsecurity=False).hexdigest()
+    key = COUNT_KEY.format(
+        model=model._meta.label_lower, version=current_version(_count_version_key(model)), digest=digest,
+    )
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def invalidate_counts(model):
+    bump_version(_count_version_key(model))
+
+
+class CachedCountPaginator(Paginator):
+    """
+    A Paginator whose COUNT comes from cached_count().
+    """
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return cached_count(self.object_list)
+        return len(self.object_list)
@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand
+from pcapp.benchmarks import SUITES
+
+
+def row_key(row):
+    # Rows are identified by their text columns (route, url, backend, ...)
+    return tuple((column, value) for column, value in row.items() if isinstance(value, str))
+
+
+def with_change(value, before):
+    if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or value == before:
+        return value
+    if before == 0:
+        return f'{value} (was 0)'
+    return f'{value} ({(value - before) / before:+.0%})'
+
+
+class Command(BaseCommand):
+    help = 'Runs a benchmark suite against the configured database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=sorted(SUITES), help='Benchmark suite to run')
+        parser.add_argument('--username', help='User to log in as for login-only pages')
+        parser.add_argument('--size', type=int, help='Dataset size for suites that generate their own data')
+        parser.add_argument('--repeat', type=int, help='Timed runs per measurement, for suites that take it')
+        parser.add_argument('--concurrency', type=int, help='Concurrent clients, for the handlers suite')
+        parser.add_argument('--json', dest='json_path', help='Write the results to this JSON file')
+        parser.add_argument('--compare', dest='compare_path',
+                            help='JSON file from an earlier run; numbers are shown with their change from it')
+
+    def handle(self, *args, **options):
+        results = SUITES[options['suite']](options)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as fh:
+                json.dump({'suite': options['suite'], 'results': results}, fh, indent=2, default=str)
+                fh.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['json_path']}"))
+            return
+
+        if not results:
+            self.stdout.write(self.style.WARNING('No results'))
+            return
+
+        if options['compare_path']:
+            with open(options['compare_path']) as fh:
+                before = {row_key(row): row for row in json.load(fh)['results']}
+            results = [
+                {column: with_change(value, before.get(row_key(row), {}).get(column)) for column, value in row.items()}
+                for row in results
+            ]
+
+        columns = list(results[0])
+        widths = {
+            column: max(len(column), *(len(str(row.get(column, ''))) for row in results))
+            for column in columns
+        }
+        self.stdout.write('  '.join(column.ljust(widths[column]) for column in columns))
+        for row in results:
+            self.stdout.write('  '.join(str(row.get(column, '')).ljust(widths[column]) for column in columns))
@@ -0,0 +1,64 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from pcapp import images
+from pcapp.models import Product, ProductImage
+
+
+def generate(name):
+    # Runs in the worker processes; one unreadable file must not stop the rest
+    try:
+        return images.generate(name), None
+    except Exception as exc:
+        return None, f'{type(exc).__name__}: {exc}'
+
+
+class Command(BaseCommand):
+    help = 'Generates the resized WebP and fallback copies of the uploaded images, in parallel processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes (default: one per CPU)')
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that are already up to date')
+
+    def handle(self, *args, **options):
+        # File name -> the rows using it, so a file shared by rows is encoded once
+        pending = defaultdict(list)
+        missing = 0
+        for model, field, derivatives_field in images.SOURCES:
+            rows = model.objects.exclude(**{field: ''}).values_list('pk', field, derivatives_field)
+            for pk, name, derivatives in rows.iterator():
+                if not options['force'] and (derivatives or {}).get('source') == name:
+                    continue
+                pending[name].append((model, pk, field, derivatives_field))
+        for name in list(pending):
+            if not default_storage.exists(name):
+                missing += 1
+                del pending[name]
+
+        names = list(pending)
+        done = failed = 0
+        if names:
+            # The workers only touch files; the rows are updated from here.
+            # django.setup covers platforms that spawn rather than fork them
+            with ProcessPoolExecutor(max(options['workers'] or 1, 1), initializer=django.setup) as pool:
+                for name, (derivatives, error) in zip(names, pool.map(generate, names, chunksize=4)):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'{name}: {error}')
+                        continue
+                    for model, pk, field, derivatives_field in pending[name]:
+                        model.objects.filter(pk=pk, **{field: name}).update(**{derivatives_field: derivatives})
+                    done += 1
+            if any(model is ProductImage for rows in pending.values() for model, *_ in rows):
+                Product.objects.sync_primary_image()
+
+        # One purge for everything instead of one per row
+        images.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {done} images ({failed} failed, {missing} missing files)'
+        ))
@@ -0,0 +1,231 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from pcapp import compatibility, home_page, product_cache, suggest
+from pcapp.benchmarks import SYNTHETIC_CATALOGUE, synthetic_products
+from pcapp.facets import rebuild_spec_index
+from pcapp.keyset import invalidate_counts
+from pcapp.models import Cart, CartItem, Category, Company, Order, OrderItem, Product, ProductImage, Review
+from pcapp.navigation import invalidate_navigation
+from pcapp.search import get_backend
+
+# Price range in rupees per category
+PRICE_RANGES = {
+    'Processors': (8000, 60000),
+    'Graphics Cards': (25000, 180000),
+    'Motherboards': (9000, 50000),
+    'Memory': (3000, 25000),
+    'Storage': (4000, 35000),
+    'Power Supplies': (4500, 25000),
+    'Cases': (4000, 20000),
+}
+
+REVIEW_COMMENTS = [
+    'Works exactly as described.', 'Runs cool and quiet.', 'Great value for the price.',
+    'Arrived well packed, installation was easy.', 'Performance is better than expected.',
+    'Had to update the BIOS first, fine since.', 'Build quality could be better.',
+    'Stopped working after a month, replacement was quick.',
+]
+
+# Everyone generated can log in with this password
+PASSWORD = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic catalogue with users, reviews, carts and orders using bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=len(SYNTHETIC_CATALOGUE),
+                            help=f'Number of categories (at most {len(SYNTHETIC_CATALOGUE)})')
+        parser.add_argument('--companies', type=int, help='Number of brands (default: all of them)')
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--images', type=int, default=2, help='Images per product')
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--reviews', type=int, default=10000)
+        parser.add_argument('--carts', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not 1 <= options['categories'] <= len(SYNTHETIC_CATALOGUE):
+            raise CommandError(f'--categories must be between 1 and {len(SYNTHETIC_CATALOGUE)}')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        with transaction.atomic():
+            catalogue, categories, companies = self.create_catalogue(options['categories'], options['companies'])
+            products = self.create_products(catalogue, categories, companies, options['products'], options['seed'])
+            self.create_images(products, options['images'])
+            users = self.create_users(options['users'])
+            reviews = self.create_reviews(products, users, options['reviews'])
+            carts = self.create_carts(products, users, options['carts'])
+            orders = self.create_orders(products, users, options['orders'])
+
+        # Bulk inserts skip the signal handlers, so rebuild what they maintain
+        call_command('rebuild_rating_stats', stdout=self.stdout)
+        rebuild_spec_index()
+        get_backend().rebuild()
+        invalidate_navigation()
+        suggest.invalidate()
+        compatibility.invalidate()
+        product_cache.invalidate_catalogue()
+        home_page.mark_stale()
+        invalidate_counts(Product)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(categories)} categories, {len(companies)} companies, {len(products)} products, '
+            f'{len(users)} users, {reviews} reviews, {carts} carts and {orders} orders'
+        ))
+
+    def create_catalogue(self, category_count, company_count):
+        """
+        Create (or reuse) the categories and brands, and return the
+        synthetic vocabulary restricted to them.
+        """
+        names = list(SYNTHETIC_CATALOGUE)[:category_count]
+        brands = list(dict.fromkeys(brand for name in names for brand in SYNTHETIC_CATALOGUE[name][0]))
+        brands = brands[:company_count or len(brands)]
+
+        categories = {name: Category.objects.get_or_create(name=name, defaults={'slug': slugify(name)})[0] for name in names}
+        companies = {brand: Company.objects.get_or_create(name=brand, defaults={'slug': slugify(brand)})[0] for brand in brands}
+
+        catalogue = {}
+        links = []
+        for name in names:
+            category_brands, models, specs = SYNTHETIC_CATALOGUE[name]
+            # Every category keeps at least one brand
+            category_brands = [brand for brand in category_brands if brand in companies] or brands[:1]
+            catalogue[name] = (category_brands, models, specs)
+            links.extend(
+                Company.categories.through(company_id=companies[brand].pk, category_id=categories[name].pk)
+                for brand in category_brands
+            )
+        Company.categories.through.objects.bulk_create(links, ignore_conflicts=True)
+        return catalogue, categories, companies
+
+    def created_at(self, days=365):
+        return self.now - timedelta(seconds=self.rng.randrange(days * 24 * 60 * 60))
+
+    def create_products(self, catalogue, categories, companies, count, seed):
+        rng = self.rng
+        start = (Product.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        products = []
+        for row in synthetic_products(count, seed=seed, start=start, catalogue=catalogue):
+            low, high = PRICE_RANGES.get(row['category'], (1000, 50000))
+            products.append(Product(
+                name=row['name'],
+                slug=slugify(row['name']),
+                category=categories[row['category']],
+                company=companies[row['brand']],
+                description=row['description'],
+                specifications=row['specifications'],
+                price=Decimal(rng.randrange(low, high) // 100 * 100 - 1),
+                stock=rng.choice([0, 2, 5, 10, 25, 50]),
+                is_featured=rng.random() < 0.05,
+                discount_percentage=Decimal(rng.choice([5, 10, 15, 20, 25])) if rng.random() < 0.3 else Decimal(0),
+            ))
+        products = Product.objects.bulk_create(products, batch_size=self.batch_size)
+
+        # auto_now_add overwrites created_at on insert, so spread it out afterwards
+        for product in products:
+            product.created_at = self.created_at()
+        Product.objects.bulk_update(products, ['created_at'], batch_size=self.batch_size)
+        return products
+
+    def create_images(self, products, per_product):
+        ProductImage.objects.bulk_create(
+            (
+                ProductImage(product=product, image=f'products/{product.slug}-{n}.webp', is_primary=n == 0)
+                for product in products for n in range(per_product)
+            ),
+            batch_size=self.batch_size,
+        )
+        # bulk_create skips the signal handler that copies the primary image
+        if products:
+            Product.objects.filter(pk__gte=products[0].pk).sync_primary_image()
+
+    def create_users(self, count):
+        start = User.objects.count()
+        # One hash for everyone; hashing each password would dominate the run
+        password = make_password(PASSWORD)
+        return User.objects.bulk_create(
+            (User(username=f'shopper{start + n}', email=f'shopper{start + n}@example.com', password=password)
+             for n in range(count)),
+            batch_size=self.batch_size,
+        )
+
+    def create_reviews(self, products, users, count):
+        if not products or not users:
+            return 0
+        rng = self.rng
+        # A few popular products get most of the reviews (Zipf-like weights)
+        weights = [1 / rank for rank in range(1, len(products) + 1)]
+        target = min(count, len(products) * len(users))
+        pairs = set()
+        for _ in range(target * 3):
+            if len(pairs) == target:
+                break
+            product = rng.choices(products, weights)[0]
+            pairs.add((product.pk, rng.choice(users).pk))
+        reviews = Review.objects.bulk_create(
+            (
+                Review(product_id=product_id, user_id=user_id, rating=rng.choices(range(1, 6), [1, 1, 2, 4, 6])[0],
+                       comment=rng.choice(REVIEW_COMMENTS))
+                for product_id, user_id in pairs
+            ),
+            batch_size=self.batch_size,
+        )
+        for review in reviews:
+            review.created_at = self.created_at()
+        Review.objects.bulk_update(reviews, ['created_at'], batch_size=self.batch_size)
+        return len(reviews)
+
+    def create_carts(self, products, users, count):
+        rng = self.rng
+        carts = Cart.objects.bulk_create(Cart(user=user) for user in users[:count])
+        CartItem.objects.bulk_create(
+            (
+                CartItem(cart=cart, product=product, quantity=rng.randint(1, 2))
+                for cart in carts for product in rng.sample(products, min(len(products), rng.randint(1, 4)))
+            ),
+            batch_size=self.batch_size,
+        )
+        return len(carts)
+
+    def create_orders(self, products, users, count):
+        if not products or not users:
+            return 0
+        rng = self.rng
+        orders, lines = [], []
+        for _ in range(count):
+            user = rng.choice(users)
+            items = [
+                OrderItem(product=product, price=product.unit_price, quantity=rng.randint(1, 2))
+                for product in rng.sample(products, min(len(products), rng.randint(1, 5)))
+            ]
+            orders.append(Order(
+                user=user, full_name=user.username.title(), email=user.email, phone='9876543210',
+                address=f'{rng.randint(1, 200)} MG Road', city=rng.choice(['Mumbai', 'Pune', 'Bengaluru', 'Delhi']),
+                state='MH', pincode='400001', payment_method=rng.choice([c for c, _ in Order.PAYMENT_CHOICES]),
+                payment_status=True, order_status=rng.choice([c for c, _ in Order.STATUS_CHOICES]),
+                total_price=sum((item.price * item.quantity for item in items), Decimal('0.00')),
+            ))
+            lines.append(items)
+        orders = Order.objects.bulk_create(orders, batch_size=self.batch_size)
+        for order, items in zip(orders, lines):
+            order.created_at = self.created_at()
+            for item in items:
+                item.order = order
+        Order.objects.bulk_update(orders, ['created_at'], batch_size=self.batch_size)
+        OrderItem.objects.bulk_create((item for items in lines for item in items), batch_size=self.batch_size)
+        return len(orders)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from pcapp.models import Product, Review
+
+STAR_FIELDS = [f'rating_{star}_count' for star in range(1, 6)]
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized rating statistics of all products from their reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of products written per UPDATE batch',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # One grouped query for every product that has reviews
+        stats = {
+            row['product_id']: row
+            for row in Review.objects.order_by().values('product_id').annotate(
+                count=Count('id'),
+                total=Sum('rating'),
+                **{
+                    field: Count('id', filter=Q(rating=star))
+                    for star, field in enumerate(STAR_FIELDS, start=1)
+                }
+            )
+        }
+
+        products = []
+        for product in Product.objects.only('id', 'rating_count', 'rating_sum', *STAR_FIELDS).iterator():
+            row = stats.get(product.id, {})
+            product.rating_count = row.get('count', 0)
+            product.rating_sum = row.get('total') or 0
+            for field in STAR_FIELDS:
+                setattr(product, field, row.get(field, 0))
+            products.append(product)
+
+        with transaction.atomic():
+            Product.objects.bulk_update(
+                products, ['rating_count', 'rating_sum', *STAR_FIELDS], batch_size=batch_size
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rating statistics for {len(products)} products '
+            f'({len(stats)} with reviews)'
+        ))
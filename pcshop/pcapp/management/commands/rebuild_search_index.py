@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from pcapp.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from the database'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index ({type(backend).__name__})'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from pcapp import compatibility
+from pcapp.facets import rebuild_spec_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the extracted specification rows used for faceted filtering'
+
+    def handle(self, *args, **options):
+        total = rebuild_spec_index()
+        # The compatibility profiles are read from the spec rows
+        compatibility.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} specification values'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from pcapp.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Returns the stock held by expired cart reservations (run periodically, e.g. from cron)'
+
+    def handle(self, *args, **options):
+        total = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'Released {total} expired reservations'))
@@ -0,0 +1,65 @@
+# Generated by Django 5.1 on 2026-10-18 04:49
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Product = apps.get_model('pcapp', 'Product')
+    Review = apps.get_model('pcapp', 'Review')
+    rows = Review.objects.order_by().values('product_id', 'rating').annotate(n=Count('id'))
+    stats = {}
+    for row in rows:
+        stats.setdefault(row['product_id'], {})[row['rating']] = row['n']
+    for product_id, counts in stats.items():
+        Product.objects.filter(pk=product_id).update(
+            rating_count=sum(counts.values()),
+            rating_sum=sum(star * n for star, n in counts.items()),
+            **{f'rating_{star}_count': counts.get(star, 0) for star in range(1, 6)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+SEARCH_TABLE = 'pcapp_product_search'
+FIELDS = ('name', 'brand', 'category', 'specs', 'description')
+
+
+def flatten_specifications(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from flatten_specifications(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from flatten_specifications(item)
+    elif value is not None:
+        yield str(value)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+            # Without FTS5 pcapp.search falls back to the in-memory index
+            return
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+            f'{", ".join(FIELDS)}, '
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+        Product = apps.get_model('pcapp', 'Product')
+        for product in Product.objects.select_related('category', 'company').iterator():
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(FIELDS)}) VALUES (%s, %s, %s, %s, %s, %s)',
+                [
+                    product.pk,
+                    product.name,
+                    product.company.name,
+                    product.category.name,
+                    ' '.join(flatten_specifications(product.specifications or {})),
+                    product.description,
+                ],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcapp', '0002_product_rating_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
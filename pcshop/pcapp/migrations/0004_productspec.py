@@ -0,0 +1,75 @@
+# Generated by Django 5.1 on 2026-10-18 04:58
+
+import re
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+NUMBER_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)')
+# Values that round to 10**9 do not fit numeric_value (max_digits=12, decimal_places=3)
+NUMBER_LIMIT = Decimal('999999999.9995')
+
+
+def extract(specifications, key=''):
+    # Mirrors pcapp.facets.extract_specifications at the time of this migration
+    if isinstance(specifications, dict):
+        for name, value in specifications.items():
+            yield from extract(value, f'{key}.{name}' if key else str(name))
+    elif isinstance(specifications, (list, tuple)):
+        for item in specifications:
+            yield from extract(item, key)
+    elif specifications is not None and key:
+        values = [str(specifications)]
+        if isinstance(specifications, str):
+            parts = [part.strip() for part in specifications.split(',')]
+            if len(parts) > 1 and all(0 < len(part) <= 24 for part in parts):
+                values = parts
+        for value in values:
+            yield key[:100], value[:100]
+
+
+def backfill_product_specs(apps, schema_editor):
+    Product = apps.get_model('pcapp', 'Product')
+    ProductSpec = apps.get_model('pcapp', 'ProductSpec')
+    rows = []
+    for product in Product.objects.only('id', 'category_id', 'specifications').iterator():
+        seen = set()
+        for key, value in extract(product.specifications or {}):
+            if not value or (key, value) in seen:
+                continue
+            seen.add((key, value))
+            match = NUMBER_RE.match(value)
+            number = Decimal(match.group(1)) if match else None
+            if number is not None and abs(number) >= NUMBER_LIMIT:
+                number = None
+            rows.append(ProductSpec(
+                product_id=product.pk, category_id=product.category_id,
+                key=key, value=value, numeric_value=number,
+            ))
+    ProductSpec.objects.bulk_create(rows, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcapp', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSpec',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('value', models.CharField(max_length=100)),
+                ('numeric_value', models.DecimalField(blank=True, decimal_places=3, max_digits=12, null=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pcapp.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spec_values', to='pcapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'key', 'value'], name='pcapp_spec_cat_key_value'), models.Index(fields=['key', 'value', 'product'], name='pcapp_spec_key_value_prod'), models.Index(fields=['key', 'numeric_value', 'product'], name='pcapp_spec_key_num_prod')],
+            },
+        ),
+        migrations.RunPython(backfill_product_specs, migrations.RunPython.noop),
+    ]
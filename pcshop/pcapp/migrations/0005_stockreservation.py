@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-18 05:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcapp', '0004_productspec'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('cart', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='pcapp.cart')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='pcapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='pcapp_reservation_expiry')],
+                'unique_together': {('cart', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1 on 2026-10-18 05:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcapp', '0006_review_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'company', 'name', 'id'], name='pcapp_product_list_name'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'company', 'price', 'id'], name='pcapp_product_list_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'company', 'created_at', 'id'], name='pcapp_product_list_newest'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1 on 2026-10-18 05:51
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_primary_images(apps, schema_editor):
+    Product = apps.get_model('pcapp', 'Product')
+    ProductImage = apps.get_model('pcapp', 'ProductImage')
+    # Keep one primary image per product: the flagged one, else the oldest
+    primary = {}
+    rows = ProductImage.objects.order_by('product_id', '-is_primary', 'id').values_list('product_id', 'pk')
+    for product_id, pk in rows.iterator():
+        primary.setdefault(product_id, pk)
+    ids = list(primary.values())
+    ProductImage.objects.filter(is_primary=True).update(is_primary=False)
+    for start in range(0, len(ids), 500):
+        ProductImage.objects.filter(pk__in=ids[start:start + 500]).update(is_primary=True)
+
+    images = ProductImage.objects.filter(product=OuterRef('pk'), is_primary=True)
+    Product.objects.update(
+        primary_image_name=Coalesce(Subquery(images.values('image')[:1]), Value('')),
+        primary_image_derivatives=Coalesce(
+            Subquery(images.values('derivatives')[:1]), Value({}, output_field=models.JSONField()),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pcapp', '0009_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_name',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(backfill_primary_images, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_primary', True)), fields=('product',), name='pcapp_image_one_primary'),
+        ),
+    ]
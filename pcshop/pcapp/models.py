@@ -1,13 +1,42 @@
-from django.db import models
+import json
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Now, Round
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 
+CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+    # Aggregates come back as floats on SQLite, so go through str()
+    return Decimal(str(amount or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def sale_price(prefix=''):
+    """
+    The discounted price of the product at ``prefix`` (e.g. 'product__') as a
+    query expression.
+    """
+    price = F(f'{prefix}price')
+    return Case(
+        When(**{f'{prefix}discount_percentage__gt': 0},
+             then=price - price * F(f'{prefix}discount_percentage') / 100),
+        default=price,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+
 # Create your models here.
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True)
+    # Resized copies of the image; see pcapp.images
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -15,6 +44,14 @@ class Category(models.Model):
         verbose_name_plural = 'Categories'
         ordering = ('name',)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored name; pcapp.compatibility derives build roles from it
+        if 'name' in field_names:
+            instance._stored_name = instance.name
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -28,6 +65,7 @@ class Company(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(max_length=100, unique=True)
     logo = models.ImageField(upload_to='companies/', blank=True)
+    logo_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(blank=True)
     website = models.URLField(blank=True)
     categories = models.ManyToManyField(Category, related_name='companies')
@@ -47,6 +85,38 @@ class Company(models.Model):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def sync_primary_image(self):
+        """
+        Copy the file name and the derivatives of each product's primary
+        image onto the product, with one UPDATE. Also moves updated_at, which
+        keys the cached product cards, so products whose copies are already
+        current are left alone.
+        """
+        images = ProductImage.objects.filter(product=OuterRef('pk'), is_primary=True)
+        name = Coalesce(Subquery(images.values('image')[:1]), Value(''))
+        derivatives = Coalesce(
+            Subquery(images.values('derivatives')[:1]), Value({}, output_field=models.JSONField()),
+        )
+        return self.exclude(primary_image_name=name, primary_image_derivatives=derivatives).update(
+            updated_at=Now(), primary_image_name=name, primary_image_derivatives=derivatives,
+        )
+
+    def with_sale_price(self):
+        """
+        Annotate the discounted price so listings can filter and sort on it.
+        """
+        return self.annotate(sale_price=sale_price())
+
+    def for_listing(self):
+        """
+        Everything a product card renders, fetched in a single query: category,
+        company and sale price. Rating statistics and the primary image are
+        plain columns on Product so they come for free.
+        """
+        return self.select_related('category', 'company').with_sale_price()
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
@@ -59,37 +129,199 @@ class Product(models.Model):
     is_available = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    # Denormalized review statistics, maintained by the Review signal handlers
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    # Denormalized primary image (file name and pcapp.images derivatives),
+    # maintained by the ProductImage signal handlers
+    primary_image_name = models.CharField(max_length=100, blank=True, editable=False)
+    primary_image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    # Kept up to date by UPDATEs from the Review and ProductImage handlers
+    # (see sync_primary_image), so saving a product loaded earlier must not
+    # write its copies of them back
+    MAINTAINED_FIELDS = frozenset({
+        'rating_count', 'rating_sum', *(f'rating_{star}_count' for star in range(1, 6)),
+        'primary_image_name', 'primary_image_derivatives',
+    })
+
     class Meta:
         ordering = ('name',)
+        indexes = [
+            # Keyset pages of a company's products in a category, per sort
+            models.Index(fields=['category', 'company', 'name', 'id'], name='pcapp_product_list_name'),
+            models.Index(fields=['category', 'company', 'price', 'id'], name='pcapp_product_list_price'),
+            models.Index(fields=['category', 'company', 'created_at', 'id'], name='pcapp_product_list_newest'),
+            # Home page rows: featured products in name order, best discounts first
+            models.Index(fields=['name'], condition=Q(is_featured=True), name='pcapp_product_featured'),
+            models.Index(fields=['discount_percentage'], name='pcapp_product_discount'),
+            # The newest change, for the home page's Last-Modified
+            models.Index(fields=['updated_at'], name='pcapp_product_updated'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the compatibility catalogue reads, so the signal
+        # handlers can tell whether a save changed it
+        if {'category_id', 'name', 'specifications'} <= set(field_names):
+            instance._compatibility_snapshot = instance.compatibility_fields()
+        # ...and which category's related products listed it
+        if 'category_id' in field_names:
+            instance._stored_category_id = instance.category_id
+        return instance
+
+    def compatibility_fields(self):
+        # The specifications as JSON, since they may be changed in place
+        return self.category_id, self.name, json.dumps(self.specifications, sort_keys=True, default=str)
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+    @property
+    def primary_image_url(self):
+        if self.primary_image_name:
+            return ProductImage._meta.get_field('image').storage.url(self.primary_image_name)
+        return ''
+
     @property
     def discounted_price(self):
         if self.discount_percentage > 0:
             return self.price - (self.price * self.discount_percentage / 100)
         return self.price
 
+    @property
+    def unit_price(self):
+        """
+        The discounted price rounded to what carts total and orders charge.
+        """
+        return self.discounted_price.quantize(CENT, rounding=ROUND_HALF_UP)
+
+    @property
+    def rating_avg(self):
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
+        return 0
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+
+    @staticmethod
+    def refresh_primary_image(product_id):
+        """
+        Flag the oldest image as primary if none is, and copy the primary
+        image onto the product.
+        """
+        first = (
+            ProductImage.objects.filter(product_id=product_id).order_by('-is_primary', 'id')
+            .values_list('pk', 'is_primary').first()
+        )
+        if first is not None and not first[1]:
+            ProductImage.objects.filter(pk=first[0]).update(is_primary=True)
+        Product.objects.filter(pk=product_id).sync_primary_image()
+
+    @staticmethod
+    def adjust_rating_stats(product_id, rating, delta):
+        """
+        Add (delta=1) or remove (delta=-1) a single rating from a product's
+        denormalized statistics using an atomic UPDATE.
+        """
+        Product.objects.filter(pk=product_id).update(**{
+            'rating_count': F('rating_count') + delta,
+            'rating_sum': F('rating_sum') + rating * delta,
+            f'rating_{rating}_count': F(f'rating_{rating}_count') + delta,
+        })
+
+    def refresh_rating_stats(self):
+        """
+        Recompute the rating statistics of this product from its reviews.
+        """
+        counts = dict(
+            self.reviews.values_list('rating').annotate(n=models.Count('id')).order_by()
+        )
+        for star in range(1, 6):
+            setattr(self, f'rating_{star}_count', counts.get(star, 0))
+        self.rating_count = sum(counts.values())
+        self.rating_sum = sum(star * n for star, n in counts.items())
+        Product.objects.filter(pk=self.pk).update(
+            rating_count=self.rating_count,
+            rating_sum=self.rating_sum,
+            **{f'rating_{star}_count': counts.get(star, 0) for star in range(1, 6)}
+        )
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products/')
     is_primary = models.BooleanField(default=False)
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # The primary image, else the oldest (Product.refresh_primary_image)
+            models.Index(fields=['product', '-is_primary', 'id'], name='pcapp_image_primary'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['product'], condition=Q(is_primary=True), name='pcapp_image_one_primary'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self.is_primary:
+                # Flagging an image primary takes the flag from the others
+                ProductImage.objects.filter(product_id=self.product_id, is_primary=True).exclude(pk=self.pk).update(
+                    is_primary=False,
+                )
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Image for {self.product.name}"
 
 
+class ProductSpec(models.Model):
+    """
+    One key/value pair extracted from Product.specifications, kept in sync by
+    the Product signal handlers so facets can be filtered and counted with
+    indexed queries instead of decoding every product's JSON.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='spec_values')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=100)
+    value = models.CharField(max_length=100)
+    numeric_value = models.DecimalField(max_digits=12, decimal_places=3, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'key', 'value'], name='pcapp_spec_cat_key_value'),
+            models.Index(fields=['key', 'value', 'product'], name='pcapp_spec_key_value_prod'),
+            models.Index(fields=['key', 'numeric_value', 'product'], name='pcapp_spec_key_num_prod'),
+        ]
+
+    def __str__(self):
+        return f"{self.key}={self.value} for product {self.product_id}"
+
+
 class Review(models.Model):
     RATING_CHOICES = (
         (1, '1 Star'),
@@ -107,26 +339,96 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ('product', 'user')  # One review per product per user
+        indexes = [
+            # Keyset pages of a product's reviews by date and by rating (pcapp.reviews)
+            models.Index(fields=['product', 'created_at', 'id'], name='pcapp_review_recent'),
+            models.Index(fields=['product', 'rating', 'created_at', 'id'], name='pcapp_review_rating'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s review on {self.product.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rating so the signal handlers can apply a delta
+        if 'product_id' in field_names and 'rating' in field_names:
+            instance._rating_snapshot = (instance.product_id, instance.rating)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Keep the review row and the product's rating statistics in sync
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+CartSummary = namedtuple('CartSummary', ['total_items', 'total_price'])
+
+
+def line_total(prefix=''):
+    """
+    Units times the rounded unit price of the cart line at ``prefix``.
+    """
+    return Round(sale_price(f'{prefix}product__'), 2) * F(f'{prefix}quantity')
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate each cart's item count and price total, computed by the
+        database in the same query.
+        """
+        return self.annotate(
+            summary_items=Coalesce(Sum('items__quantity'), 0),
+            summary_price=Sum(line_total('items__'), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+
+class CartItemQuerySet(models.QuerySet):
+    def summary(self):
+        """
+        Item count and price total of these cart lines in one aggregate query.
+        """
+        totals = self.aggregate(
+            items=Coalesce(Sum('quantity'), 0),
+            price=Coalesce(
+                Sum(line_total(), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+                Value(Decimal('0')),
+            ),
+        )
+        return CartSummary(totals['items'], to_cents(totals['price']))
+
 
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.username}'s cart"
 
+    def summary(self):
+        """
+        The cart's totals: from with_totals() annotations when present,
+        otherwise from a single aggregate query.
+        """
+        if hasattr(self, 'summary_items'):
+            return CartSummary(self.summary_items, to_cents(self.summary_price))
+        return self.items.summary()
+
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.summary().total_price
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.summary().total_items
 
 
 class CartItem(models.Model):
@@ -136,6 +438,8 @@ class CartItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'product')
 
@@ -144,7 +448,48 @@ class CartItem(models.Model):
 
     @property
     def total_price(self):
-        return self.product.discounted_price * self.quantity
+        return self.product.unit_price * self.quantity
+
+
+class StockReservation(models.Model):
+    """
+    Units taken out of Product.stock and held for a cart until checkout or
+    until they expire. The cart link is nulled rather than cascaded on
+    delete, so orphaned reservations still expire and return their units.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.SET_NULL, null=True, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('cart', 'product')
+        indexes = [
+            models.Index(fields=['expires_at'], name='pcapp_reservation_expiry'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} reserved until {self.expires_at}"
+
+
+class OrderQuerySet(models.QuerySet):
+    def for_history(self):
+        """
+        Annotate each order's line and unit counts and the primary image of
+        its first product that has one (thumbnail_name and
+        thumbnail_derivatives), with correlated subqueries over the order's
+        lines so the orders are still read in index order.
+        """
+        lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        pictured = OrderItem.objects.filter(order=OuterRef('pk')).exclude(product__primary_image_name='').order_by('id')
+        return self.annotate(
+            line_count=Coalesce(Subquery(lines.annotate(count=Count('id')).values('count')), 0),
+            item_count=Coalesce(Subquery(lines.annotate(units=Sum('quantity')).values('units')), 0),
+            thumbnail_name=Subquery(pictured.values('product__primary_image_name')[:1]),
+            thumbnail_derivatives=Subquery(
+                pictured.values('product__primary_image_derivatives')[:1], output_field=models.JSONField(),
+            ),
+        )
 
 
 class Order(models.Model):
@@ -176,8 +521,14 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            # A customer's order history, newest first
+            models.Index(fields=['user', '-created_at'], name='pcapp_order_user_recent'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
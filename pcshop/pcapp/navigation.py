@@ -0,0 +1,86 @@
+import threading
+
+from django.core.cache import cache
+from django.db.models import Count, Prefetch
+
+from .cache_versions import bump_version, current_version
+from .models import Category, Company, Product
+
+NAV_VERSION_KEY = 'pcapp:nav:version'
+NAV_TREE_KEY = 'pcapp:nav:tree:{version}'
+NAV_TIMEOUT = 60 * 60 * 24
+
+# Per-process copy of the tree, tagged with the shared version it was built for
+_local = {'version': None, 'tree': None}
+_local_lock = threading.Lock()
+
+
+def build_navigation():
+    """
+    Build the navigation tree from the database: every category with its
+    companies and product counts, plus the flat list of brands used by the
+    header dropdown.
+    """
+    product_counts = {}
+    for category_id, company_id, count in (
+        Product.objects
+        .order_by()
+        .values_list('category_id', 'company_id')
+        .annotate(count=Count('id'))
+    ):
+        product_counts[(category_id, company_id)] = count
+
+    categories = list(
+        Category.objects.annotate(product_count=Count('products', distinct=True))
+        .prefetch_related(Prefetch('companies', queryset=Company.objects.order_by('name')))
+    )
+
+    companies = {}
+    for category in categories:
+        category.nav_companies = list(category.companies.all())
+        for company in category.nav_companies:
+            company.product_count = product_counts.get((category.id, company.id), 0)
+            # The header links each brand to the first category it belongs to
+            companies.setdefault(company.id, (company, category.slug))
+        # Drop the prefetch cache so only the plain lists get pickled
+        category._prefetched_objects_cache = {}
+
+    nav_companies = []
+    for company, category_slug in sorted(companies.values(), key=lambda entry: entry[0].name):
+        company.nav_category_slug = category_slug
+        nav_companies.append(company)
+
+    return {'categories': categories, 'companies': nav_companies}
+
+
+def get_navigation():
+    """
+    Return the navigation tree, served from the process-local copy while the
+    shared version is unchanged, then from the shared cache, and only built
+    from the database when both miss.
+    """
+    version = current_version(NAV_VERSION_KEY)
+    with _local_lock:
+        if version is not None and _local['version'] == version:
+            return _local['tree']
+
+    key = NAV_TREE_KEY.format(version=version)
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_navigation()
+        cache.set(key, tree, NAV_TIMEOUT)
+
+    with _local_lock:
+        _local['version'] = version
+        _local['tree'] = tree
+    return tree
+
+
+def invalidate_navigation():
+    """
+    Bump the shared version so every process rebuilds its tree on next use.
+    """
+    bump_version(NAV_VERSION_KEY)
+    with _local_lock:
+        _local['version'] = None
+        _local['tree'] = None
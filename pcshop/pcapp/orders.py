@@ -0,0 +1,53 @@
+"""
+Checkout pipeline.
+
+place_order() turns a cart into an order inside one transaction with a
+fixed number of queries, whatever the size of the cart: one read of the
+cart lines with their products, the stock claim (see pcapp.inventory),
+one INSERT for the order, one bulk INSERT for its items and one DELETE
+clearing the cart.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from .inventory import claim_cart_stock
+from .models import CartItem, OrderItem
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def place_order(cart, order):
+    """
+    Save ``order`` (an unsaved Order with its address and payment fields
+    set) for the contents of ``cart`` and return its OrderItems.
+
+    The items carry the prices charged, and order.total_price is computed
+    once from them, so callers can show the confirmation without asking
+    the products again. Raises EmptyCart, or InsufficientStock with every
+    write rolled back.
+    """
+    with transaction.atomic():
+        cart_items = list(
+            CartItem.objects.filter(cart=cart).select_related('product')
+            .only('quantity', 'product__name', 'product__price', 'product__discount_percentage')
+        )
+        if not cart_items:
+            raise EmptyCart()
+
+        order_items = [
+            OrderItem(product=item.product, price=item.product.unit_price, quantity=item.quantity)
+            for item in cart_items
+        ]
+        claim_cart_stock(cart, {item.product_id: item.quantity for item in cart_items})
+
+        order.total_price = sum((item.price * item.quantity for item in order_items), Decimal('0.00'))
+        order.save()
+        for item in order_items:
+            item.order = order
+        OrderItem.objects.bulk_create(order_items)
+
+        CartItem.objects.filter(cart=cart).delete()
+    return order_items
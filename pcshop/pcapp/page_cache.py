@@ -0,0 +1,235 @@
+"""
+Full-page cache for anonymous catalogue pages.
+
+cache_anonymous_page() stores the whole rendered response of a catalogue
+view for visitors who are not signed in and serves it without running the
+view. A page is only cached for GET/HEAD requests with no query
+parameters besides CACHED_PARAMS (normalized, so ``?page=1`` and no page
+share an entry) and with no flash messages pending before or after the
+view.
+
+The cache key carries a "scope": the cache versions of the catalogue
+objects the page shows (see product_cache and home_page), so the signal
+handlers that bump those versions purge exactly the affected pages. The
+key doubles as the page's ETag. Last-Modified comes from the updated_at
+columns of the objects shown, and both validators answer conditional
+requests with 304.
+
+CSRF tokens are per visitor: the cached copy keeps a placeholder in place
+of the token, and every response gets the current visitor's token.
+"""
+import hashlib
+import re
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .cache_versions import current_version
+from .home_page import HOME_VERSION_KEY
+from .models import Category, Company, Product
+from .navigation import get_navigation
+from .product_cache import CATALOGUE_VERSION_KEY, PRODUCT_VERSION_KEY, RELATED_VERSION_KEY, lookup_product_id
+
+PAGE_KEY = 'pcapp:page:{digest}'
+PAGE_TIMEOUT = 60 * 60
+
+CACHED_PARAMS = ('min_price', 'max_price', 'sort_by', 'page')
+# Values that mean the same page as leaving the parameter out
+PARAM_DEFAULTS = {'sort_by': 'name', 'page': '1'}
+
+CSRF_PLACEHOLDER = 'pcapp-csrf-token-placeholder'
+CSRF_INPUT = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def normalized_params(request):
+    """
+    The cacheable query parameters as a sorted tuple, or None when the
+    request has any other parameter (or repeats one).
+    """
+    params = []
+    for name, values in request.GET.lists():
+        if name not in CACHED_PARAMS or len(values) > 1:
+            return None
+        value = values[0].strip()
+        if value and value != PARAM_DEFAULTS.get(name):
+            params.append((name, value))
+    return tuple(sorted(params))
+
+
+def _latest(*values):
+    return max((value for value in values if value is not None), default=None)
+
+
+def _category_id(slug):
+    return next((category.id for category in get_navigation()['categories'] if category.slug == slug), None)
+
+
+# Scopes return the versions (and any other values) a page depends on, or
+# None for pages that should not be cached; last-modified functions
+# return the newest updated_at among the objects shown
+
+def home_scope(request):
+    return current_version(CATALOGUE_VERSION_KEY), current_version(HOME_VERSION_KEY)
+
+
+def _newest_change(queryset):
+    # An index walk to the newest row, where Max() would scan the table
+    return queryset.order_by('-updated_at').values_list('updated_at', flat=True).first()
+
+
+def home_last_modified(request):
+    return _latest(*(_newest_change(model.objects.all()) for model in (Product, Category, Company)))
+
+
+def category_scope(request, slug):
+    return (current_version(CATALOGUE_VERSION_KEY),)
+
+
+def category_last_modified(request, slug):
+    latest = Company.objects.filter(categories__slug=slug).aggregate(
+        company=Max('updated_at'), category=Max('categories__updated_at'),
+    )
+    return _latest(*latest.values())
+
+
+def listing_scope(request, category_slug, company_slug):
+    category_id = _category_id(category_slug)
+    if category_id is None:
+        return None
+    return (
+        current_version(CATALOGUE_VERSION_KEY),
+        current_version(RELATED_VERSION_KEY.format(category_id=category_id)),
+    )
+
+
+def listing_last_modified(request, category_slug, company_slug):
+    latest = Product.objects.filter(category__slug=category_slug, company__slug=company_slug).aggregate(
+        product=Max('updated_at'), category=Max('category__updated_at'), company=Max('company__updated_at'),
+    )
+    return _latest(*latest.values())
+
+
+def product_scope(request, category_slug, company_slug, product_slug):
+    pk = lookup_product_id(category_slug, company_slug, product_slug)
+    category_id = _category_id(category_slug)
+    if pk is None or category_id is None:
+        return None
+    # The page shows the exact stock, which changes with every cart, so it
+    # is part of the key rather than a reason to purge
+    stock = Product.objects.filter(pk=pk).values_list('stock', flat=True).first()
+    return (
+        current_version(CATALOGUE_VERSION_KEY),
+        current_version(PRODUCT_VERSION_KEY.format(pk=pk)),
+        current_version(RELATED_VERSION_KEY.format(category_id=category_id)),
+        stock,
+    )
+
+
+def product_last_modified(request, category_slug, company_slug, product_slug):
+    pk = lookup_product_id(category_slug, company_slug, product_slug)
+    latest = Product.objects.filter(pk=pk).aggregate(
+        product=Max('updated_at'), category=Max('category__updated_at'), company=Max('company__updated_at'),
+        review=Max('reviews__updated_at'),
+    )
+    return _latest(*latest.values())
+
+
+def _cacheable(request):
+    # len() does not mark the messages as shown
+    return not request.user.is_authenticated and not len(get_messages(request))
+
+
+def _finish(request, response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # The HTML carries the visitor's CSRF token, so shared caches must not
+    # keep it, and browsers revalidate with the validators above
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+
+
+def lookup(request, scope, kwargs):
+    """
+    Returns (response, key, etag): a cached (or 304) response, or None and
+    the key and ETag to store the rendered page under, or None, None, None
+    when the page must not be cached.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None, None, None
+    params = normalized_params(request)
+    if params is None or not _cacheable(request):
+        return None, None, None
+    parts = scope(request, **kwargs)
+    if parts is None:
+        return None, None, None
+
+    digest = hashlib.md5(repr((request.path, params, parts)).encode(), usedforsecurity=False).hexdigest()
+    key = PAGE_KEY.format(digest=digest)
+    etag = f'"{digest}"'
+    entry = cache.get(key)
+    if entry is None:
+        return None, key, etag
+
+    content = entry['content']
+    if entry['csrf']:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+    response = HttpResponse(content, content_type=entry['content_type'])
+    return _finish(request, response, etag, entry['last_modified']), None, None
+
+
+def store(request, response, key, etag, last_modified, kwargs, timeout):
+    # Pages that set cookies or queued messages (errors) are not cached
+    if response.status_code != 200 or response.streaming or response.cookies or not _cacheable(request):
+        return response
+    modified = last_modified(request, **kwargs)
+    modified = modified and int(modified.timestamp())
+    content, tokens = CSRF_INPUT.subn(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+    cache.set(key, {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'csrf': bool(tokens),
+        'last_modified': modified,
+    }, timeout)
+    return _finish(request, response, etag, modified)
+
+
+def cache_anonymous_page(scope, last_modified, timeout=PAGE_TIMEOUT):
+    """
+    Cache a catalogue view's pages for anonymous visitors; see the module
+    docstring. ``scope`` and ``last_modified`` take the request and the
+    view's URL keyword arguments.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, **kwargs):
+                # Looking at the user and the messages may hit the database
+                response, key, etag = await sync_to_async(lookup)(request, scope, kwargs)
+                if response is not None:
+                    return response
+                response = await view(request, **kwargs)
+                if key is not None:
+                    response = await sync_to_async(store)(
+                        request, response, key, etag, last_modified, kwargs, timeout,
+                    )
+                return response
+        else:
+            @wraps(view)
+            def wrapper(request, **kwargs):
+                response, key, etag = lookup(request, scope, kwargs)
+                if response is not None:
+                    return response
+                response = view(request, **kwargs)
+                if key is not None:
+                    response = store(request, response, key, etag, last_modified, kwargs, timeout)
+                return response
+        return wrapper
+    return decorator
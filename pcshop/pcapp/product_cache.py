@@ -0,0 +1,151 @@
+"""
+Cache-aside store for product detail pages.
+
+The data a product page shows (product with its category and company,
+images, review statistics and the first page of reviews) is assembled
+once and kept in the shared cache under a key carrying the product's
+version. Related products are cached per category. Signal handlers bump
+the versions when a product, its images or its reviews change, so stale
+entries are never read again and simply expire.
+
+Stock is not cached: it changes with every cart reservation, so the page
+reads it live by primary key.
+
+Rebuilds are single-flight: the first request to miss takes a short lock
+in the shared cache and rebuilds, and concurrent requests for the same
+page wait for its result instead of all running the same queries.
+"""
+import time
+from functools import partial
+
+from django.core.cache import cache
+
+from .cache_versions import bump_version, current_version
+from .models import Product
+from .reviews import review_page
+
+PRODUCT_VERSION_KEY = 'pcapp:product:{pk}:version'
+RELATED_VERSION_KEY = 'pcapp:product:related:{category_id}:version'
+# Bumped when a category or company changes, since every page shows their names
+CATALOGUE_VERSION_KEY = 'pcapp:product:catalogue:version'
+
+PAGE_KEY = 'pcapp:product:{pk}:page:{version}:{catalogue}'
+RELATED_KEY = 'pcapp:product:related:{category_id}:{version}:{catalogue}'
+SLUG_KEY = 'pcapp:product:slug:{category}:{company}:{product}'
+
+PAGE_TIMEOUT = 60 * 60
+# How long a rebuild may hold the lock before other requests build themselves
+LOCK_TIMEOUT = 10
+WAIT_INTERVAL = 0.02
+
+RELATED_COUNT = 4
+
+
+def single_flight(key, build, timeout=PAGE_TIMEOUT):
+    """
+    Return the cached value for ``key``, building it with ``build()`` on a
+    miss. Only one caller builds at a time; the others poll for its result
+    and only build themselves if the lock outlives LOCK_TIMEOUT.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        if cache.add(lock_key, True, LOCK_TIMEOUT):
+            try:
+                value = build()
+                cache.set(key, value, timeout)
+            finally:
+                cache.delete(lock_key)
+            return value
+        time.sleep(WAIT_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if time.monotonic() > deadline:
+            return build()
+
+
+def build_page(pk):
+    product = Product.objects.select_related('category', 'company').get(pk=pk)
+    reviews = review_page(pk)
+    return {
+        'product': product,
+        # The primary image first, as the gallery's main image
+        'images': list(product.images.order_by('-is_primary', 'id')),
+        'reviews': reviews.items,
+        'reviews_cursor': reviews.next_cursor,
+        'avg_rating': product.rating_avg,
+        'review_count': product.rating_count,
+    }
+
+
+def build_related(category_id):
+    # One extra, so a page can drop itself and still show RELATED_COUNT
+    return list(Product.objects.for_listing().filter(category_id=category_id)[:RELATED_COUNT + 1])
+
+
+def lookup_product_id(category_slug, company_slug, product_slug, use_cache=True):
+    key = SLUG_KEY.format(category=category_slug, company=company_slug, product=product_slug)
+    pk = cache.get(key) if use_cache else None
+    if pk is None:
+        pk = Product.objects.filter(
+            slug=product_slug, category__slug=category_slug, company__slug=company_slug,
+        ).values_list('pk', flat=True).first()
+        if pk is not None:
+            cache.set(key, pk, PAGE_TIMEOUT)
+    return pk
+
+
+def get_product_page(category_slug, company_slug, product_slug):
+    """
+    The cached page data for a product, or None if no product has these
+    slugs. The returned dict is the caller's own copy.
+    """
+    catalogue = current_version(CATALOGUE_VERSION_KEY)
+    for use_cache in (True, False):
+        pk = lookup_product_id(category_slug, company_slug, product_slug, use_cache)
+        if pk is None:
+            return None
+        version = current_version(PRODUCT_VERSION_KEY.format(pk=pk))
+        try:
+            page = single_flight(PAGE_KEY.format(pk=pk, version=version, catalogue=catalogue), partial(build_page, pk))
+        except Product.DoesNotExist:
+            page = None
+        product = page and page['product']
+        # A cached slug may point at a product that was renamed or deleted since
+        if product and (product.slug, product.category.slug, product.company.slug) == (
+            product_slug, category_slug, company_slug,
+        ):
+            break
+    else:
+        return None
+
+    category_id = product.category_id
+    related_version = current_version(RELATED_VERSION_KEY.format(category_id=category_id))
+    related = single_flight(
+        RELATED_KEY.format(category_id=category_id, version=related_version, catalogue=catalogue),
+        partial(build_related, category_id),
+    )
+    page['related_products'] = [item for item in related if item.pk != product.pk][:RELATED_COUNT]
+    return page
+
+
+def invalidate_product(pk, category_id=None, previous_category_id=None):
+    """
+    Drop the cached page of a product and the related products of its
+    category (whose cards show its name, price, image and rating), and of
+    the category it moved from, if any.
+    """
+    bump_version(PRODUCT_VERSION_KEY.format(pk=pk))
+    if category_id is None:
+        category_id = Product.objects.filter(pk=pk).values_list('category_id', flat=True).first()
+    for related_category_id in {category_id, previous_category_id} - {None}:
+        bump_version(RELATED_VERSION_KEY.format(category_id=related_category_id))
+
+
+def invalidate_catalogue():
+    bump_version(CATALOGUE_VERSION_KEY)
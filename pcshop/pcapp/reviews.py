@@ -0,0 +1,47 @@
+"""
+Review listings for product pages, paged by keyset (see pcapp.keyset).
+
+Each sort is backed by one of the Review indexes, which lead with the
+product and end with the sort key, so any page is an index seek plus
+REVIEWS_PER_PAGE rows.
+"""
+from .keyset import paginate
+from .models import Review
+
+REVIEWS_PER_PAGE = 10
+
+REVIEW_SORTS = {
+    'newest': ('-created_at', '-id'),
+    'oldest': ('created_at', 'id'),
+    # Rating sorts break ties by date in the same direction, so the
+    # (product, rating, created_at, id) index serves both
+    'highest': ('-rating', '-created_at', '-id'),
+    'lowest': ('rating', 'created_at', 'id'),
+}
+DEFAULT_SORT = 'newest'
+
+
+def review_queryset(product_id):
+    # Only what the page shows; the cached page must not carry user passwords
+    return (
+        Review.objects.filter(product_id=product_id).select_related('user')
+        .only('product_id', 'rating', 'comment', 'created_at', 'user__username')
+    )
+
+
+def review_page(product_id, sort=DEFAULT_SORT, cursor=None, per_page=REVIEWS_PER_PAGE):
+    """
+    A KeysetPage of the product's reviews. Raises KeyError for an unknown
+    sort and InvalidCursor for a bad cursor.
+    """
+    return paginate(review_queryset(product_id), REVIEW_SORTS[sort], cursor, per_page)
+
+
+def review_data(review):
+    return {
+        'id': review.id,
+        'user': review.user.username,
+        'rating': review.rating,
+        'comment': review.comment,
+        'created_at': review.created_at.isoformat(),
+    }
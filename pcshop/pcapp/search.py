@@ -0,0 +1,362 @@
+"""
+Product search.
+
+Products are indexed as documents built from their name, brand, category,
+flattened specifications and description. On SQLite the index is an FTS5
+table ranked with bm25(); on other databases (or SQLite builds without
+FTS5) a pure-Python inverted index with BM25 ranking is used instead.
+Both support prefix matching on every query term, so "ryz 78" finds
+"Ryzen 7 7800X3D", and both are updated incrementally by the Product,
+Category and Company signal handlers.
+
+Ranked results stop at MAX_RESULTS, but count() reports every match and
+filter() narrows a queryset to all of them in the database, for listings
+sorted by something other than relevance.
+"""
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+from functools import partial
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .cache_versions import changes_since, current_version, record_change
+from .models import Product
+
+SEARCH_TABLE = 'pcapp_product_search'
+SEARCH_VERSION_KEY = 'pcapp:search:version'
+
+# Document fields and their ranking weights
+FIELDS = ('name', 'brand', 'category', 'specs', 'description')
+FIELD_WEIGHTS = {'name': 10.0, 'brand': 5.0, 'category': 3.0, 'specs': 2.0, 'description': 1.0}
+
+# Ranked searches stop after this many matches
+MAX_RESULTS = 1000
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold())
+
+
+def flatten_specifications(value):
+    """
+    Yield the scalar values of a (possibly nested) specifications JSON object.
+    """
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from flatten_specifications(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from flatten_specifications(item)
+    elif value is not None:
+        yield str(value)
+
+
+def product_document(product):
+    """
+    Build the searchable text of a product; category and company should be
+    select_related by the caller.
+    """
+    return {
+        'name': product.name,
+        'brand': product.company.name,
+        'category': product.category.name,
+        'specs': ' '.join(flatten_specifications(product.specifications or {})),
+        'description': product.description,
+    }
+
+
+def indexable_products():
+    return Product.objects.select_related('category', 'company').order_by()
+
+
+class FTS5Backend:
+    """
+    SQLite FTS5 index stored in the pcapp_product_search virtual table,
+    keyed by product id.
+    """
+
+    @staticmethod
+    def is_available():
+        return (
+            connection.vendor == 'sqlite'
+            and SEARCH_TABLE in connection.introspection.table_names()
+        )
+
+    def index(self, products):
+        rows = []
+        for product in products:
+            document = product_document(product)
+            rows.append((product.pk, *(document[field] for field in FIELDS)))
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, {", ".join(FIELDS)}) VALUES (%s, %s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        batch = []
+        for product in indexable_products().iterator(chunk_size=2000):
+            batch.append(product)
+            if len(batch) == 2000:
+                self.index(batch)
+                batch = []
+        self.index(batch)
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every token so user input can never be parsed as FTS syntax
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    @staticmethod
+    def search_sql(placeholder='%s'):
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in FIELDS)
+        return (
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH {placeholder} '
+            f'ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT {placeholder}'
+        )
+
+    def search(self, query, limit=MAX_RESULTS):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(self.search_sql(), [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+    def count(self, query):
+        match = self.match_expression(query)
+        if not match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match])
+            return cursor.fetchone()[0]
+
+    def filter(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+        matches = RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match])
+        return queryset.filter(pk__in=matches)
+
+
+class MemoryBackend:
+    """
+    Pure-Python inverted index with BM25 ranking. Postings hold field-weighted
+    term frequencies and a sorted term list serves prefix lookups. The index
+    is loaded from the database on first use in each process.
+
+    Unlike the FTS5 table it is not part of the database transaction, so
+    changes are applied once they commit. They are recorded under
+    SEARCH_VERSION_KEY for other processes, which re-read the changed
+    products before their next search (or reload everything when they have
+    fallen too far behind).
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._loaded = False
+        self.version = None
+        self.postings = defaultdict(dict)   # term -> {product_id: weighted tf}
+        self.doc_terms = {}                 # product_id -> {term: weighted tf}
+        self.doc_lengths = {}
+        self.total_length = 0.0
+        self.terms = []                     # sorted, for prefix matching
+
+    def _ensure_loaded(self):
+        version = current_version(SEARCH_VERSION_KEY)
+        if self._loaded and self.version == version:
+            return
+        with self._lock:
+            if self._loaded and self.version != version:
+                changes = changes_since(SEARCH_VERSION_KEY, self.version, version)
+                if changes is None or None in changes:
+                    self._clear()
+                else:
+                    self._reindex({product_id for product_ids in changes for product_id in product_ids})
+            if not self._loaded:
+                self.load(indexable_products().iterator(chunk_size=2000))
+            # The version read before loading, so changes made meanwhile are replayed
+            self.version = version
+
+    def load(self, products):
+        self.load_documents((product.pk, product_document(product)) for product in products)
+
+    def load_documents(self, documents):
+        """
+        Bulk-load (product_id, document) pairs and sort the term list once.
+        """
+        with self._lock:
+            if self.version is None:
+                self.version = current_version(SEARCH_VERSION_KEY)
+            for product_id, document in documents:
+                self._add(product_id, document)
+            self.terms = sorted(self.postings)
+            self._loaded = True
+
+    def _add(self, product_id, document, keep_sorted=False):
+        frequencies = defaultdict(float)
+        for field in FIELDS:
+            for token in tokenize(document[field]):
+                frequencies[token] += FIELD_WEIGHTS[field]
+        self.doc_terms[product_id] = frequencies
+        length = sum(frequencies.values())
+        self.doc_lengths[product_id] = length
+        self.total_length += length
+        for term, tf in frequencies.items():
+            postings = self.postings[term]
+            if keep_sorted and not postings:
+                bisect.insort(self.terms, term)
+            postings[product_id] = tf
+
+    def _remove(self, product_id):
+        frequencies = self.doc_terms.pop(product_id, None)
+        if frequencies is None:
+            return
+        self.total_length -= self.doc_lengths.pop(product_id)
+        for term in frequencies:
+            postings = self.postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[term]
+                index = bisect.bisect_left(self.terms, term)
+                if index < len(self.terms) and self.terms[index] == term:
+                    del self.terms[index]
+
+    def _reindex(self, product_ids):
+        products = {product.pk: product for product in indexable_products().filter(pk__in=product_ids)}
+        for product_id in product_ids:
+            self._remove(product_id)
+            if product_id in products:
+                self._add(product_id, product_document(products[product_id]), keep_sorted=True)
+
+    def _changed(self, product_ids):
+        with self._lock:
+            if self._loaded:
+                self._reindex(product_ids)
+            version = record_change(SEARCH_VERSION_KEY, product_ids)
+            if self.version == version - 1:
+                # No other process changed anything in between
+                self.version = version
+
+    def index(self, products):
+        product_ids = tuple(product.pk for product in products)
+        if product_ids:
+            transaction.on_commit(partial(self._changed, product_ids))
+
+    def remove(self, product_ids):
+        transaction.on_commit(partial(self._changed, tuple(product_ids)))
+
+    def rebuild(self):
+        with self._lock:
+            self._clear()
+            # None tells the other processes to reload everything too
+            record_change(SEARCH_VERSION_KEY, None)
+        self._ensure_loaded()
+
+    def expand(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + '\uffff')
+        return self.terms[start:end]
+
+    def _scores(self, query):
+        """
+        BM25 scores of the products matching every token of ``query``.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        self._ensure_loaded()
+        with self._lock:
+            doc_count = len(self.doc_lengths)
+            if not doc_count:
+                return {}
+            avg_length = self.total_length / doc_count
+            scores = None
+            for token in tokens:
+                token_scores = defaultdict(float)
+                for term in self.expand(token):
+                    postings = self.postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for product_id, tf in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[product_id] / avg_length)
+                        token_scores[product_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                # Every query token has to match (AND semantics, like FTS5)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pk: score + token_scores[pk] for pk, score in scores.items() if pk in token_scores}
+                if not scores:
+                    return {}
+        return scores
+
+    def search(self, query, limit=MAX_RESULTS):
+        ranked = sorted(self._scores(query).items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+    def count(self, query):
+        return len(self._scores(query))
+
+    def filter(self, queryset, query):
+        return queryset.filter(pk__in=list(self._scores(query)))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = FTS5Backend() if FTS5Backend.is_available() else MemoryBackend()
+    return _backend
+
+
+def search_product_ids(query, limit=MAX_RESULTS):
+    """
+    Return the ids of the products matching ``query``, best match first.
+    """
+    return get_backend().search(query, limit)
+
+
+def search_count(query):
+    """
+    Return how many products match ``query``, without the MAX_RESULTS cap.
+    """
+    return get_backend().count(query)
+
+
+def filter_products(queryset, query):
+    """
+    Narrow ``queryset`` to every product matching ``query``, in the database.
+    """
+    return get_backend().filter(queryset, query)
+
+
+def index_products(products):
+    get_backend().index(products)
+
+
+def remove_products(product_ids):
+    get_backend().remove(product_ids)
@@ -0,0 +1,242 @@
+from functools import partial
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from .models import Category, Company, Product, ProductImage, Review
+from .carts import merge_cookie_cart
+from .facets import index_product_specs
+from .keyset import invalidate_counts
+from .navigation import invalidate_navigation
+from .search import index_products, indexable_products, remove_products
+from . import compatibility, home_page, images, product_cache, suggest
+
+
+@receiver(post_save, sender=Review)
+def update_rating_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Apply the saved review to its product's rating statistics.
+    """
+    if raw:
+        return
+
+    snapshot = getattr(instance, '_rating_snapshot', None)
+    current = (instance.product_id, instance.rating)
+
+    if created:
+        Product.adjust_rating_stats(instance.product_id, instance.rating, 1)
+    elif snapshot is None:
+        # The previous rating is unknown, so recompute from the reviews
+        Product(pk=instance.product_id).refresh_rating_stats()
+    elif snapshot != current:
+        Product.adjust_rating_stats(snapshot[0], snapshot[1], -1)
+        Product.adjust_rating_stats(instance.product_id, instance.rating, 1)
+
+    instance._rating_snapshot = current
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_stats_on_delete(sender, instance, **kwargs):
+    """
+    Remove the deleted review from its product's rating statistics.
+    """
+    product_id, rating = getattr(
+        instance, '_rating_snapshot', (instance.product_id, instance.rating)
+    )
+    Product.adjust_rating_stats(product_id, rating, -1)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def update_primary_image(sender, instance, raw=False, **kwargs):
+    """
+    Copy the product's primary image onto it, promoting another image when
+    the primary one was deleted.
+    """
+    if not raw:
+        Product.refresh_primary_image(instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_navigation_on_change(sender, **kwargs):
+    # Invalidate after commit so no request can re-cache the old tree meanwhile
+    transaction.on_commit(invalidate_navigation)
+
+
+@receiver(m2m_changed, sender=Company.categories.through)
+def invalidate_navigation_on_company_categories(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(invalidate_navigation)
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_products(indexable_products().filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def index_specs_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_product_specs(instance)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Company)
+def reindex_products_on_rename(sender, instance, created, raw=False, **kwargs):
+    # Products embed their brand and category names in the search index
+    if created or raw:
+        return
+    lookup = 'category' if sender is Category else 'company'
+    index_products(indexable_products().filter(**{lookup: instance}))
+
+
+# The suggestion index is not transactional, so it only follows committed changes
+
+@receiver(post_save, sender=Product)
+def refresh_suggestions_on_product_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(partial(suggest.refresh_product, instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def refresh_suggestions_on_product_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(suggest.remove_product, instance.pk))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def rebuild_suggestions(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(suggest.invalidate)
+
+
+@receiver(m2m_changed, sender=Company.categories.through)
+def rebuild_suggestions_on_company_categories(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(suggest.invalidate)
+
+
+# Part roles come from category names and profiles from product specs, so
+# the compatibility catalogue is only reloaded when those change
+
+@receiver(post_save, sender=Product)
+def invalidate_compatibility_on_product_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    snapshot = getattr(instance, '_compatibility_snapshot', None)
+    current = instance.compatibility_fields()
+    if snapshot != current:
+        category_ids = {current[0]} if snapshot is None else {current[0], snapshot[0]}
+        transaction.on_commit(partial(compatibility.product_changed, category_ids))
+    instance._compatibility_snapshot = current
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_compatibility_on_product_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(compatibility.product_changed, {instance.category_id}))
+
+
+@receiver(post_save, sender=Category)
+def invalidate_compatibility_on_category_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        old_name = getattr(instance, '_stored_name', None)
+        transaction.on_commit(partial(compatibility.category_changed, old_name, instance.name))
+        instance._stored_name = instance.name
+
+
+@receiver(post_delete, sender=Category)
+def invalidate_compatibility_on_category_delete(sender, instance, **kwargs):
+    if compatibility.role_for_category(instance.name):
+        transaction.on_commit(compatibility.invalidate)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_page(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # A product moved to another category leaves the old one's related products too
+        previous_category_id = getattr(instance, '_stored_category_id', None)
+        transaction.on_commit(partial(
+            product_cache.invalidate_product, instance.pk, instance.category_id, previous_category_id,
+        ))
+        instance._stored_category_id = instance.category_id
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_product_page_on_related_change(sender, instance, raw=False, **kwargs):
+    # Reviews also change the rating shown on the related product cards
+    if not raw:
+        transaction.on_commit(partial(product_cache.invalidate_product, instance.product_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidate_product_pages(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(product_cache.invalidate_catalogue)
+
+
+@receiver(m2m_changed, sender=Company.categories.through)
+def invalidate_product_pages_on_company_categories(sender, action, **kwargs):
+    # Category pages list their companies
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(product_cache.invalidate_catalogue)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_counts(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(partial(invalidate_counts, Product))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def refresh_home_page(sender, raw=False, **kwargs):
+    # Ratings on the home cards may lag by up to HOME_REFRESH instead;
+    # refreshing on every review is not worth it
+    if not raw:
+        transaction.on_commit(home_page.mark_stale)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Company)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for model, field, derivatives_field in images.SOURCES:
+        if sender is model:
+            images.schedule(instance, field, derivatives_field)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    # request is None when logging in outside a view (e.g. the test client)
+    if request is not None:
+        merge_cookie_cart(request, user)
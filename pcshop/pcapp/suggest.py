@@ -0,0 +1,282 @@
+"""
+Typeahead suggestions for the search box.
+
+Product, brand and category names are held in a compact in-memory prefix
+index: a sorted array of keys (a flattened trie) searched with bisect.
+Prefixes whose key range is too wide to scan per request get their best
+entries precomputed, so every lookup touches at most WIDE_RANGE keys and
+never the database. Product changes are applied to the local index
+incrementally and recorded under a version key in the shared cache, so
+other worker processes re-read just those products on their next lookup;
+brand and category changes (or falling too far behind) trigger a rebuild.
+The index is built when a worker starts (see warm()) and edited in place
+under _lock, which lookups take too.
+"""
+import bisect
+import heapq
+import threading
+
+from django.db import DatabaseError
+from django.urls import reverse
+
+from .cache_versions import changes_since, current_version, record_change
+from .models import Category, Company, Product
+from .search import tokenize
+
+SUGGEST_VERSION_KEY = 'pcapp:suggest:version'
+
+# Largest number of suggestions returned per lookup
+TOP_K = 10
+# Prefixes matching more keys than this are answered from the precomputed table
+WIDE_RANGE = 256
+MAX_KEY_LENGTH = 40
+MAX_CHAR = chr(0x10FFFF)
+
+# Brands and categories are boosted above individual products
+KIND_BOOST = {'category': 1_000_000, 'brand': 500_000, 'product': 0}
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self.keys = []          # sorted (key, entry_id) pairs
+        self.entries = {}       # entry_id -> {'type', 'label', 'url'}
+        self.ranks = {}         # entry_id -> (score, entry_id)
+        self.wide = {}          # prefix -> [(score, entry_id)], best first
+        self.changes = 0        # additions/removals since the wide table was built
+        self.version = None
+
+    @staticmethod
+    def keys_for(label):
+        """
+        Index the label from the start of every word, so "4070" finds
+        "GeForce RTX 4070".
+        """
+        tokens = tokenize(label)
+        return {' '.join(tokens[start:])[:MAX_KEY_LENGTH] for start in range(len(tokens))}
+
+    def add(self, entry_id, kind, label, url, score=0, sort=True):
+        self.remove(entry_id)
+        self.entries[entry_id] = {'type': kind, 'label': label, 'url': url}
+        rank = (KIND_BOOST[kind] + score, entry_id)
+        self.ranks[entry_id] = rank
+        for key in self.keys_for(label):
+            if not sort:
+                self.keys.append((key, entry_id))
+                continue
+            bisect.insort(self.keys, (key, entry_id))
+            self.changes += 1
+            for length in range(1, len(key) + 1):
+                top = self.wide.get(key[:length])
+                if top is not None:
+                    self._offer(top, rank)
+
+    def finish_loading(self):
+        """
+        Sort keys appended with sort=False and precompute the wide prefixes.
+        """
+        self.keys.sort()
+        self.wide = {}
+        self.changes = 0
+        self._top(0, len(self.keys), '')
+
+    def _top(self, lo, hi, prefix):
+        """
+        Return the best entries of keys[lo:hi], which all start with
+        ``prefix``, recording them in self.wide when the range is wide.
+        """
+        if hi - lo <= WIDE_RANGE:
+            return heapq.nlargest(TOP_K, {self.ranks[entry_id] for _, entry_id in self.keys[lo:hi]})
+        depth = len(prefix)
+        # Keys equal to the prefix sort first, then one child range per next character
+        child = bisect.bisect_left(self.keys, (prefix + '\0',), lo, hi)
+        candidates = {self.ranks[entry_id] for _, entry_id in self.keys[lo:child]}
+        while child < hi:
+            next_prefix = self.keys[child][0][:depth + 1]
+            end = bisect.bisect_left(self.keys, (next_prefix + MAX_CHAR,), child, hi)
+            candidates.update(self._top(child, end, next_prefix))
+            child = end
+        top = heapq.nlargest(TOP_K, candidates)
+        if prefix:
+            self.wide[prefix] = top
+        return top
+
+    @staticmethod
+    def _offer(top, rank):
+        if rank in top:
+            return
+        if len(top) < TOP_K or rank > top[-1]:
+            top.append(rank)
+            top.sort(reverse=True)
+            del top[TOP_K:]
+
+    def remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        del self.ranks[entry_id]
+        for key in self.keys_for(entry['label']):
+            index = bisect.bisect_left(self.keys, (key, entry_id))
+            if index < len(self.keys) and self.keys[index] == (key, entry_id):
+                del self.keys[index]
+                self.changes += 1
+
+    @property
+    def needs_compaction(self):
+        # Incremental changes leave gaps in the wide table and new wide ranges untracked
+        return self.changes > max(1000, len(self.keys) // 10)
+
+    def lookup(self, prefix, limit=TOP_K):
+        prefix = ' '.join(tokenize(prefix))[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+        top = self.wide.get(prefix)
+        if top is not None:
+            # Skip entries removed or re-ranked since the table was filled
+            ranked = [rank for rank in top if self.ranks.get(rank[1]) == rank]
+            if len(ranked) < min(limit, len(top)):
+                ranked = self.wide[prefix] = self._scan(prefix)
+        else:
+            ranked = self._scan(prefix)
+        return [self.entries[entry_id] for _, entry_id in ranked[:limit]]
+
+    def _scan(self, prefix):
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = bisect.bisect_left(self.keys, (prefix + MAX_CHAR,), start)
+        return heapq.nlargest(TOP_K, {self.ranks[entry_id] for _, entry_id in self.keys[start:end]})
+
+
+def product_entry(product):
+    """
+    Arguments for SuggestionIndex.add() for a product with category and
+    company loaded.
+    """
+    url = reverse('product_detail', args=[product.category.slug, product.company.slug, product.slug])
+    return ('product', product.pk), 'product', product.name, url, product.rating_count
+
+
+def build_index():
+    index = SuggestionIndex()
+    for category in Category.objects.exclude(slug=''):
+        index.add(('category', category.pk), 'category', category.name,
+                  reverse('category_detail', args=[category.slug]), sort=False)
+
+    seen = set()
+    for company in Company.objects.exclude(slug='').prefetch_related('categories'):
+        category = next((c for c in company.categories.all() if c.slug), None)
+        if category is not None and company.pk not in seen:
+            seen.add(company.pk)
+            index.add(('brand', company.pk), 'brand', company.name,
+                      reverse('company_products', args=[category.slug, company.slug]), sort=False)
+
+    products = (
+        Product.objects.select_related('category', 'company')
+        .exclude(slug='').exclude(category__slug='').exclude(company__slug='')
+        .only('name', 'slug', 'rating_count', 'category__slug', 'company__slug')
+        .order_by()
+    )
+    for product in products.iterator(chunk_size=2000):
+        index.add(*product_entry(product), sort=False)
+    index.finish_loading()
+    return index
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _refresh_products(index, product_ids):
+    for product_id in product_ids:
+        index.remove(('product', product_id))
+    products = (
+        Product.objects.select_related('category', 'company')
+        .filter(pk__in=product_ids).exclude(slug='').exclude(category__slug='').exclude(company__slug='')
+    )
+    for product in products:
+        index.add(*product_entry(product))
+
+
+def get_index():
+    """
+    Return the local trie, catching up with the changes other processes
+    recorded since it was built, or rebuilding it when they cannot be
+    replayed or too many entries were changed.
+    """
+    global _index
+    version = current_version(SUGGEST_VERSION_KEY)
+    index = _index
+    if index is None or index.version != version or index.needs_compaction:
+        with _lock:
+            index = _index
+            if index is not None and index.version != version:
+                changes = changes_since(SUGGEST_VERSION_KEY, index.version, version)
+                if changes is None or None in changes:
+                    index = None
+                else:
+                    _refresh_products(index, {product_id for product_ids in changes for product_id in product_ids})
+            if index is None or index.needs_compaction:
+                index = build_index()
+            # The version read before catching up, so changes recorded
+            # meanwhile are replayed on the next lookup
+            index.version = version
+            _index = index
+    return index
+
+
+def warm():
+    """
+    Build the index before the first lookup. Called from the WSGI and ASGI
+    entry points rather than AppConfig.ready(), which also runs for
+    management commands such as migrate, before the tables exist; if the
+    database is not reachable yet the first lookup builds it instead.
+    """
+    try:
+        get_index()
+    except DatabaseError:
+        pass
+
+
+def suggest(prefix, limit=TOP_K):
+    if not prefix.strip():
+        return []
+    index = get_index()
+    # refresh_product and remove_product edit the trie in place from
+    # on_commit hooks, and lookups refill the wide table
+    with _lock:
+        return index.lookup(prefix, min(limit, TOP_K))
+
+
+def _record(index, change):
+    version = record_change(SUGGEST_VERSION_KEY, change)
+    if index is not None and index.version == version - 1:
+        # The local trie has every earlier change and already reflects this one
+        index.version = version
+
+
+def refresh_product(product_id):
+    """
+    Re-insert a single product into the local trie after it changed.
+    """
+    with _lock:
+        index = _index
+        if index is not None:
+            _refresh_products(index, [product_id])
+        _record(index, (product_id,))
+
+
+def remove_product(product_id):
+    with _lock:
+        index = _index
+        if index is not None:
+            index.remove(('product', product_id))
+        _record(index, (product_id,))
+
+
+def invalidate():
+    """
+    Force a full rebuild, used when brands or categories change.
+    """
+    global _index
+    with _lock:
+        _index = None
+        # None tells the other processes to rebuild too
+        _record(None, None)
@@ -0,0 +1,55 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+register = template.Library()
+
+# The width the image takes on the page, for the browser to pick a candidate
+SIZES = {
+    'thumbnail': '80px',
+    'card': '(min-width: 992px) 25vw, (min-width: 576px) 50vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+}
+
+
+def _srcset(variants, key):
+    # Variants narrower than their maximum share their files
+    candidates = {variant[key]: variant['width'] for variant in variants.values()}
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w'
+        for name, width in sorted(candidates.items(), key=lambda item: item[1])
+    )
+
+
+@register.simple_tag
+def responsive_image(image, derivatives, variant='card', **attrs):
+    """
+    A ``<picture>`` offering the WebP and fallback derivatives of ``image``
+    (a file field or a stored file name) with their dimensions, sized for
+    ``variant``; a plain ``<img>`` of the original until the derivatives
+    exist. Keyword arguments become attributes of the ``<img>``, with
+    underscores turned into dashes (``data_src`` is ``data-src``)::
+
+        {% responsive_image image image.derivatives 'detail' alt=product.name class='product-image' %}
+    """
+    name = getattr(image, 'name', image)
+    if not name:
+        return ''
+    attrs = {key.replace('_', '-'): value for key, value in attrs.items()}
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    sizes = attrs.pop('sizes', SIZES.get(variant, '100vw'))
+
+    variants = (derivatives or {}).get('variants')
+    if not variants:
+        return format_html('<img src="{}"{}>', default_storage.url(name), flatatt(attrs))
+
+    shown = variants.get(variant) or max(variants.values(), key=lambda item: item['width'])
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}"{}></picture>',
+        _srcset(variants, 'webp'), sizes,
+        default_storage.url(shown['fallback']), _srcset(variants, 'fallback'), sizes,
+        shown['width'], shown['height'], flatatt(attrs),
+    )
@@ -1,3 +1,1623 @@
-from django.test import TestCase
+import gzip
+import re
+import shutil
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.http import QueryDict
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.utils import timezone
+from PIL import Image
+from .assets import IMMUTABLE, REVALIDATE, fingerprinted_names, minify_css
+from .carts import COOKIE_NAME
+from .checks import check_inline_styles
+from .compatibility import get_catalogue, invalidate as invalidate_compatibility
+from .instrumentation import RequestMetrics, registry as request_stats_registry
+from .inventory import InsufficientStock, claim_cart_stock, release_expired, reserve, take_stock
+from .facets import extract_specifications, facet_counts, parse_filters, parse_number
+from .models import (
+    Cart, CartItem, Category, Company, Order, OrderItem, Product, ProductImage, ProductSpec, Review,
+    StockReservation,
+)
+from .orders import place_order
+from .home_page import HOME_FRESH_KEY, build_home, get_home, refresh_home
+from .page_cache import CSRF_PLACEHOLDER
+from .views import ORDERS_PER_PAGE
+from .product_cache import get_product_page, single_flight
+from .reviews import REVIEW_SORTS, review_page
+from .navigation import get_navigation, invalidate_navigation
+from .cache_versions import record_change
+from .suggest import (
+    SUGGEST_VERSION_KEY, SuggestionIndex, get_index as get_suggestion_index, invalidate as invalidate_suggestions,
+    refresh_product as refresh_suggestions, suggest, warm as warm_suggestions,
+)
+from .search import FTS5Backend, MemoryBackend, indexable_products, search_product_ids
 
-# Create your tests here.
+
+class CatalogueQueryBudgetTests(TestCase):
+    """
+    Listing pages must render in a constant number of queries regardless of
+    how many products are on the page.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Graphics Cards')
+        cls.company = Company.objects.create(name='Nvidia')
+        cls.company.categories.add(cls.category)
+        cls.user = User.objects.create_user('reviewer', password='secret')
+
+    def create_products(self, count):
+        products = []
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'GPU {i}',
+                category=self.category,
+                company=self.company,
+                description='Graphics card',
+                price=Decimal('1000.00'),
+                stock=5,
+                is_featured=True,
+                discount_percentage=Decimal('10.00'),
+            )
+            ProductImage.objects.create(product=product, image=f'products/gpu-{i}.webp')
+            ProductImage.objects.create(product=product, image=f'products/gpu-{i}-primary.webp', is_primary=True)
+            Review.objects.create(product=product, user=self.user, rating=4, comment='Good')
+            products.append(product)
+        return products
+
+    def assertQueryBudget(self, url, budget):
+        for count in (1, 7):
+            Product.objects.all().delete()
+            self.create_products(count)
+            cache.clear()
+            invalidate_navigation()
+            get_navigation()
+            with self.assertNumQueries(budget):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_home(self):
+        # Both lists' ids, their cards in one query and Last-Modified (the
+        # newest product, category and company)
+        self.assertQueryBudget(reverse('home'), 6)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('home'))
+
+    def test_company_products(self):
+        url = reverse('company_products', args=[self.category.slug, self.company.slug])
+        self.assertQueryBudget(url, 6)
+
+    def test_search_products(self):
+        self.assertQueryBudget(reverse('search_products') + '?q=gpu', 2)
+
+    def test_product_detail(self):
+        product, = self.create_products(1)
+        for i in range(3):
+            user = User.objects.create_user(f'buyer{i}', password='secret')
+            Review.objects.create(product=product, user=user, rating=5, comment='Great')
+        url = reverse('product_detail', args=[self.category.slug, self.company.slug, product.slug])
+        cache.clear()
+        get_navigation()
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # Warm, only the stock is read, for the full-page cache key
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_listing_uses_primary_image(self):
+        product, = self.create_products(1)
+        listed = Product.objects.for_listing().get(pk=product.pk)
+        self.assertEqual(listed.primary_image_name, 'products/gpu-0-primary.webp')
+        self.assertEqual(listed.sale_price, Decimal('900.00'))
+        self.assertEqual(listed.rating_count, 1)
+
+
+class RatingStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_stock_product(5)
+        cls.users = [User.objects.create_user(f'rater{i}', password='pw') for i in range(3)]
+
+    def stats(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return product.rating_count, product.rating_sum, product.rating_histogram
+
+    def test_review_changes_adjust_the_stats(self):
+        first = Review.objects.create(product=self.product, user=self.users[0], rating=4, comment='Good')
+        Review.objects.create(product=self.product, user=self.users[1], rating=2, comment='Meh')
+        self.assertEqual(self.stats(), (2, 6, {1: 0, 2: 1, 3: 0, 4: 1, 5: 0}))
+
+        first.rating = 5
+        first.save()
+        self.assertEqual(self.stats(), (2, 7, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1}))
+
+        Review.objects.update_or_create(product=self.product, user=self.users[1], defaults={'rating': 3})
+        Review.objects.update_or_create(product=self.product, user=self.users[2], defaults={'rating': 1})
+        self.assertEqual(self.stats(), (3, 9, {1: 1, 2: 0, 3: 1, 4: 0, 5: 1}))
+
+        first.delete()
+        self.assertEqual(self.stats(), (2, 4, {1: 1, 2: 0, 3: 1, 4: 0, 5: 0}))
+
+    def test_saving_a_stale_product_keeps_the_stats(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=self.users[0], rating=4, comment='Good')
+        stale.price = Decimal('900.00')
+        stale.save()
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.price, product.rating_count, product.rating_sum), (Decimal('900.00'), 1, 4))
+
+    def test_rebuild_command(self):
+        for user, rating in zip(self.users, (5, 5, 3)):
+            Review.objects.create(product=self.product, user=user, rating=rating, comment='Ok')
+        expected = self.stats()
+        Product.objects.filter(pk=self.product.pk).update(rating_count=0, rating_sum=0, rating_5_count=7)
+        call_command('rebuild_rating_stats', stdout=StringIO())
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(expected, (3, 13, {1: 0, 2: 0, 3: 1, 4: 0, 5: 2}))
+
+
+class QueryPlanTests(TestCase):
+    """
+    Every query the storefront views run must be served by an index:
+    EXPLAIN QUERY PLAN may not show a full scan of a catalogue or order
+    table. SQLite has no statistics for the test tables, so the plans are
+    the ones it picks for large tables.
+    """
+    HOT_TABLES = {
+        'pcapp_product', 'pcapp_productimage', 'pcapp_productspec', 'pcapp_review', 'pcapp_cart',
+        'pcapp_cartitem', 'pcapp_stockreservation', 'pcapp_order', 'pcapp_orderitem',
+    }
+    # Deliberate whole-table reads, each cached until the catalogue changes
+    ALLOWED_SCANS = (
+        'GROUP BY "pcapp_product"."category_id", "pcapp_product"."company_id"',  # navigation counts
+        '"pcapp_product"."rating_count", "pcapp_category"."id", "pcapp_category"."slug", "pcapp_company"."id"',  # suggestion index
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret')
+        category = Category.objects.create(name='Processors')
+        company = Company.objects.create(name='AMD')
+        company.categories.add(category)
+        cls.products = []
+        for i in range(6):
+            product = Product.objects.create(
+                name=f'Ryzen {i}', category=category, company=company, description='CPU',
+                price=Decimal(200 + i), stock=10, is_featured=i % 2 == 0, discount_percentage=Decimal(i),
+                specifications={'socket': 'AM5'},
+            )
+            ProductImage.objects.create(product=product, image=f'products/ryzen-{i}.webp', is_primary=True)
+            Review.objects.create(product=product, user=cls.user, rating=5, comment='Fast')
+            cls.products.append(product)
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cart, product=cls.products[0], quantity=1)
+        cls.order = Order.objects.create(
+            user=cls.user, full_name='Shopper', email='shopper@example.com', phone='1', address='1 Road',
+            city='Pune', state='MH', pincode='411001', total_price=Decimal('200.00'), payment_method='upi',
+        )
+        OrderItem.objects.create(order=cls.order, product=cls.products[0], price=Decimal('200.00'), quantity=1)
+
+    def routes(self):
+        product = self.products[0]
+        listing = reverse('company_products', args=[product.category.slug, product.company.slug])
+        reviews = reverse('product_reviews_api', args=[product.pk])
+        yield reverse('home')
+        yield reverse('category_detail', args=[product.category.slug])
+        for sort_by in ('name', 'price_low', 'price_high', 'newest'):
+            yield f'{listing}?sort_by={sort_by}&page=1'
+            cursor = self.client.get(listing, {'sort_by': sort_by}).context['next_cursor']
+            yield f'{listing}?sort_by={sort_by}&cursor={cursor}'
+            yield reverse('search_products') + f'?q=ryzen&sort_by={sort_by}'
+        yield f'{listing}?spec_socket=AM5&min_price=201'
+        yield reverse('product_detail', args=[product.category.slug, product.company.slug, product.slug])
+        for sort in REVIEW_SORTS:
+            yield f'{reviews}?sort={sort}'
+        yield reverse('search_products') + '?q=ryzen'
+        yield reverse('search_suggest') + '?q=ryz'
+        yield reverse('view_view')
+        yield reverse('checkout')
+        yield reverse('order_history')
+        yield reverse('order_detail', args=[self.order.pk])
+        yield reverse('order_confirmation', args=[self.order.pk])
+        yield reverse('user_profile')
+
+    def capture(self, url):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('SELECT'):
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        # Cold caches, so the queries behind them are checked too
+        cache.clear()
+        with connection.execute_wrapper(record):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return statements
+
+    def test_hot_queries_use_indexes(self):
+        self.client.force_login(self.user)
+        scans = []
+        for url in list(self.routes()):
+            for sql, params in self.capture(url):
+                if any(allowed in sql for allowed in self.ALLOWED_SCANS):
+                    continue
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                    plan = [row[-1] for row in cursor.fetchall()]
+                for step in plan:
+                    words = step.split()
+                    # "SCAN <table>" without "USING ... INDEX" reads the whole table
+                    if words[:1] == ['SCAN'] and len(words) == 2 and words[1] in self.HOT_TABLES:
+                        scans.append(f'{url}\n  {step}\n  {sql}')
+        self.assertEqual(scans, [], 'Full table scans:\n' + '\n'.join(scans))
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        request_stats_registry.reset()
+        cache.clear()
+
+    def test_off_by_default(self):
+        response = self.client.get(reverse('home'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(request_stats_registry.snapshot(), {})
+
+    @override_settings(PCAPP_METRICS_SAMPLE_RATE=1)
+    def test_sampled_request(self):
+        with self.assertLogs('pcapp.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('home'))
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertIn('"home"', logs.output[0])
+        stats = request_stats_registry.snapshot()['home']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['mean_queries'], 0)
+        self.assertEqual(sum(stats['histogram'].values()), 1)
+
+    @override_settings(PCAPP_METRICS_SAMPLE_RATE=1)
+    async def test_async_view_queries_are_counted(self):
+        # The ORM work of async views runs in sync_to_async threads
+        with self.assertLogs('pcapp.instrumentation', 'INFO'):
+            response = await self.async_client.get(reverse('search_products'), {'q': 'ryzen'})
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+        stats = request_stats_registry.snapshot()['search_products']
+        self.assertGreater(stats['mean_queries'], 0)
+
+    def test_repeated_statements_are_flagged(self):
+        Category.objects.create(name='Memory')
+        metrics = RequestMetrics(duplicate_threshold=3)
+        with connection.execute_wrapper(metrics):
+            for _ in range(3):
+                Category.objects.filter(name='Memory').first()
+            Company.objects.count()
+        self.assertEqual(metrics.queries, 4)
+        duplicates = metrics.duplicates()
+        self.assertEqual(len(duplicates), 1)
+        self.assertIn('pcapp_category', next(iter(duplicates)))
+
+    def test_stats_are_staff_only(self):
+        url = reverse('request_stats')
+        user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        user.is_staff = True
+        user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('routes', response.json())
+
+
+class HomePageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Memory')
+        cls.company = Company.objects.create(name='Corsair')
+        cls.both = cls.create_product('Vengeance 32GB', is_featured=True, discount_percentage=Decimal('10'))
+        cls.featured = cls.create_product('Dominator 64GB', is_featured=True)
+        cls.discounted = cls.create_product('Vengeance 16GB', discount_percentage=Decimal('20'))
+
+    @classmethod
+    def create_product(cls, name, **kwargs):
+        return Product.objects.create(
+            name=name, category=cls.category, company=cls.company, description='Memory',
+            price=Decimal('5000.00'), stock=5, **kwargs,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lists_share_one_card_query(self):
+        with self.assertNumQueries(3):
+            payload = build_home()
+        self.assertEqual([p.name for p in payload['featured_products']], ['Dominator 64GB', 'Vengeance 32GB'])
+        self.assertEqual([p.name for p in payload['discounted_products']], ['Vengeance 16GB', 'Vengeance 32GB'])
+        self.assertIs(payload['featured_products'][1], payload['discounted_products'][1])
+
+    def test_stale_payload_is_refreshed_in_background(self):
+        get_home()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_product('Fury 8GB', is_featured=True)
+        self.assertIsNone(cache.get(HOME_FRESH_KEY))
+
+        with mock.patch('pcapp.home_page.threading.Thread') as thread, self.assertNumQueries(0):
+            payload = get_home()
+            get_home()
+        # The request is answered from the old payload, and only one refresh starts
+        self.assertEqual(len(payload['featured_products']), 2)
+        thread.assert_called_once()
+
+        refresh_home()
+        self.assertEqual(len(get_home()['featured_products']), 3)
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Storage')
+        cls.company = Company.objects.create(name='Samsung')
+        cls.company.categories.add(cls.category)
+        cls.product = Product.objects.create(
+            name='990 Pro', category=cls.category, company=cls.company, description='NVMe drive',
+            price=Decimal('9000.00'), stock=5,
+        )
+        cls.url = reverse('company_products', args=[cls.category.slug, cls.company.slug])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url + '?page=1&sort_by=name')
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertContains(second, '990 Pro')
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': first['ETag']}).status_code, 304)
+        # Other parameters are not cached
+        self.assertNotIn('ETag', self.client.get(self.url + '?cursor=abc'))
+
+    def test_cached_page_has_a_valid_csrf_token(self):
+        self.client.get(self.url)
+        client = self.client_class(enforce_csrf_checks=True)
+        response = client.get(self.url)
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        response = client.post(reverse('subscribe_newsletter'), {'email': 'a@example.com', 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_change_purges_listing(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = '990 Evo'
+            self.product.save()
+        response = self.client.get(self.url)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, '990 Evo')
+
+    def test_signed_in_users_are_not_cached(self):
+        self.client.force_login(User.objects.create_user('shopper', password='secret'))
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertNotIn('ETag', response)
+        self.assertIsNotNone(response.context)
+
+
+@override_settings(PCAPP_IMAGE_WORKERS=0)
+class ImageDerivativeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Cases')
+        cls.company = Company.objects.create(name='Lian Li')
+        cls.product = Product.objects.create(
+            name='O11 Dynamic', category=cls.category, company=cls.company, description='Case',
+            price=Decimal('12000.00'), stock=5,
+        )
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def upload(self, name, size=(1000, 500)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'navy').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_upload_generates_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.upload('case.png'), is_primary=True)
+        image.refresh_from_db()
+        variants = image.derivatives['variants']
+        self.assertEqual(image.derivatives['source'], 'products/case.png')
+        self.assertEqual((variants['card']['width'], variants['card']['height']), (480, 240))
+        # Never scaled up
+        self.assertEqual(variants['detail']['width'], 1000)
+        self.assertTrue(variants['card']['fallback'].endswith('.jpg'))
+        for variant in variants.values():
+            self.assertTrue(default_storage.exists(variant['webp']))
+
+        response = self.client.get(reverse('company_products', args=[self.category.slug, self.company.slug]))
+        self.assertContains(response, 'derivatives/products/case.png/card.webp 480w')
+        self.assertContains(response, 'width="480" height="240"')
+
+    def test_sources_sharing_a_stem_keep_their_own_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            wide = ProductImage.objects.create(product=self.product, image=self.upload('case.png'))
+            square = ProductImage.objects.create(product=self.product, image=self.upload('case.gif', (200, 200)))
+        wide.refresh_from_db()
+        square.refresh_from_db()
+        wide_card, square_card = wide.derivatives['variants']['card'], square.derivatives['variants']['card']
+        self.assertNotEqual(wide_card['webp'], square_card['webp'])
+        for card, size in ((wide_card, (480, 240)), (square_card, (200, 200))):
+            with default_storage.open(card['webp']) as file:
+                self.assertEqual(Image.open(file).size, size)
+
+    def test_tag_falls_back_to_the_original(self):
+        template = Template('{% load responsive_images %}{% responsive_image name derivatives alt="Case" %}')
+        html = template.render(Context({'name': 'products/case.png', 'derivatives': {}}))
+        self.assertEqual(html, '<img src="/media/products/case.png" alt="Case" decoding="async" loading="lazy">')
+
+    def test_backfill_command(self):
+        self.company.logo = self.upload('lianli.png', size=(300, 300))
+        self.company.save()
+        self.assertEqual(Company.objects.get().logo_derivatives, {})
+        ProductImage.objects.create(product=self.product, image='products/missing.png')
+
+        out = StringIO()
+        call_command('build_image_derivatives', workers=2, stdout=out)
+        self.assertIn('Generated derivatives for 1 images (0 failed, 1 missing files)', out.getvalue())
+        variants = Company.objects.get().logo_derivatives['variants']
+        self.assertEqual(variants['detail']['width'], 300)
+        # Narrower than the card size, so the card and detail copies are one file
+        self.assertEqual(variants['card']['webp'], variants['detail']['webp'])
+
+
+class PrimaryImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_stock_product(5)
+
+    def primary(self):
+        product = Product.objects.get(pk=self.product.pk)
+        flagged = list(product.images.filter(is_primary=True).values_list('image', flat=True))
+        return product.primary_image_name, flagged
+
+    def test_one_primary_image_per_product(self):
+        first = ProductImage.objects.create(product=self.product, image='products/front.webp')
+        # The first image becomes primary on its own
+        self.assertEqual(self.primary(), ('products/front.webp', ['products/front.webp']))
+        ProductImage.objects.create(product=self.product, image='products/back.webp', is_primary=True)
+        self.assertEqual(self.primary(), ('products/back.webp', ['products/back.webp']))
+
+        first.is_primary = True
+        first.save()
+        self.assertEqual(self.primary(), ('products/front.webp', ['products/front.webp']))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductImage.objects.filter(product=self.product).update(is_primary=True)
+
+    def test_deleting_the_primary_image_promotes_the_next(self):
+        front = ProductImage.objects.create(product=self.product, image='products/front.webp')
+        back = ProductImage.objects.create(product=self.product, image='products/back.webp')
+        front.delete()
+        self.assertEqual(self.primary(), ('products/back.webp', ['products/back.webp']))
+        back.delete()
+        self.assertEqual(self.primary(), ('', []))
+
+    def test_saving_a_stale_product_keeps_the_primary_image(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        ProductImage.objects.create(product=self.product, image='products/front.webp')
+        stale.stock = 3
+        stale.save()
+        self.assertEqual(self.primary(), ('products/front.webp', ['products/front.webp']))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 3)
+
+    def test_sync_only_touches_changed_products(self):
+        image = ProductImage.objects.create(product=self.product, image='products/front.webp')
+        create_stock_product(2, name='RTX 4080')
+        yesterday = timezone.now() - timedelta(days=1)
+        Product.objects.update(updated_at=yesterday)
+        self.assertEqual(Product.objects.sync_primary_image(), 0)
+        self.assertEqual(set(Product.objects.values_list('updated_at', flat=True)), {yesterday})
+
+        # A queryset UPDATE skips the ProductImage handlers, as the backfill does
+        ProductImage.objects.filter(pk=image.pk).update(
+            derivatives={'source': 'products/front.webp', 'width': 800, 'height': 600, 'variants': {}},
+        )
+        self.assertEqual(Product.objects.sync_primary_image(), 1)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.primary_image_derivatives['width'], 800)
+        self.assertGreater(product.updated_at, yesterday)
+
+    def test_cart_does_not_read_product_images(self):
+        ProductImage.objects.create(product=self.product, image='products/front.webp')
+        self.client.post(reverse('add_to_cart'), {'product_id': self.product.pk, 'quantity': 1})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('view_view'))
+        self.assertContains(response, '/media/products/front.webp')
+        self.assertFalse(any('pcapp_productimage' in query['sql'] for query in ctx.captured_queries))
+
+
+class ProductCardTests(TestCase):
+    CARD = Template("{% include 'pcapp/includes/product_card.html' %}")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_stock_product(5)
+        cls.user = User.objects.create_user('carder', password='pw')
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self):
+        product = Product.objects.for_listing().get(pk=self.product.pk)
+        return self.CARD.render(Context({'product': product}))
+
+    def test_card_is_cached_until_the_product_changes(self):
+        self.assertIn('RTX 4090', self.render())
+        # A name change written behind the model's back keeps the cached card
+        Product.objects.filter(pk=self.product.pk).update(name='RTX 5090')
+        self.assertIn('RTX 4090', self.render())
+        Product.objects.filter(pk=self.product.pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        self.assertIn('RTX 5090', self.render())
+
+    def test_new_rating_is_shown(self):
+        self.assertIn('No ratings', self.render())
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=self.user, rating=4, comment='Good')
+        card = self.render()
+        self.assertNotIn('No ratings', card)
+        self.assertEqual(card.count('fas fa-star'), 4)
+
+
+class StaticAssetTests(TestCase):
+    def test_minify_css(self):
+        css = "/* Cards */\n.a > .b,\n.c:hover {\n    content: ' ; ';\n    margin: 0 auto;\n}\n"
+        self.assertEqual(minify_css(css), ".a>.b,.c:hover{content:' ; ';margin:0 auto}")
+
+    def test_collected_stylesheets_are_fingerprinted_and_precompressed(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        self.enterContext(override_settings(STATIC_ROOT=static_root))
+        call_command('collectstatic', interactive=False, verbosity=0)
+        fingerprinted_names.cache_clear()
+        self.addCleanup(fingerprinted_names.cache_clear)
+
+        url = static('pcapp/css/home.css')
+        self.assertRegex(url, r'^/static/pcapp/css/home\.[0-9a-f]{12}\.css$')
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], IMMUTABLE)
+        self.assertNotIn('\n', gzip.decompress(b''.join(response.streaming_content)).decode())
+
+        response = self.client.get('/static/pcapp/css/home.css')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], REVALIDATE)
+
+    def test_large_inline_styles_fail_the_check(self):
+        self.assertEqual(check_inline_styles(None), [])
+        template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, template_dir)
+        Path(template_dir, 'page.html').write_text('<style>' + 'a { color: red; }' * 100 + '</style>')
+        with override_settings(TEMPLATES=[{**settings.TEMPLATES[0], 'DIRS': [template_dir]}]):
+            self.assertEqual([error.id for error in check_inline_styles(None)], ['pcapp.E001'])
+
+
+class NavigationCacheTests(TestCase):
+    def setUp(self):
+        invalidate_navigation()
+        self.category = Category.objects.create(name='Processors')
+        self.company = Company.objects.create(name='AMD')
+        self.company.categories.add(self.category)
+
+    def test_warm_navigation_runs_no_queries(self):
+        get_navigation()
+        with self.assertNumQueries(0):
+            navigation = get_navigation()
+        self.assertEqual([c.name for c in navigation['categories']], ['Processors'])
+        self.assertEqual(navigation['companies'][0].nav_category_slug, 'processors')
+
+    def test_catalogue_changes_invalidate_navigation(self):
+        get_navigation()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name='Ryzen 7', category=self.category, company=self.company,
+                description='CPU', price=Decimal('300.00'),
+            )
+        category = get_navigation()['categories'][0]
+        self.assertEqual(category.product_count, 1)
+        self.assertEqual(category.nav_companies[0].product_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Category.objects.create(name='Motherboards')
+            self.company.categories.add(other)
+        navigation = get_navigation()
+        self.assertEqual([c.name for c in navigation['categories']], ['Motherboards', 'Processors'])
+        self.assertEqual(navigation['categories'][0].nav_companies[0].name, 'AMD')
+
+
+class ProductPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Memory')
+        cls.company = Company.objects.create(name='Corsair')
+        cls.user = User.objects.create_user('reviewer', password='secret')
+        cls.product = Product.objects.create(
+            name='Vengeance 32GB', category=cls.category, company=cls.company,
+            description='RAM', price=Decimal('120.00'), stock=8,
+        )
+        cls.other = Product.objects.create(
+            name='Dominator 32GB', category=cls.category, company=cls.company,
+            description='RAM', price=Decimal('150.00'), stock=3,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.slugs = (self.category.slug, self.company.slug, self.product.slug)
+
+    def test_page_is_cached(self):
+        page = get_product_page(*self.slugs)
+        self.assertEqual(page['product'], self.product)
+        self.assertEqual(page['related_products'], [self.other])
+        with self.assertNumQueries(0):
+            page = get_product_page(*self.slugs)
+        self.assertEqual(page['review_count'], 0)
+        self.assertIsNone(get_product_page(self.category.slug, self.company.slug, 'missing'))
+
+    def test_reviews_and_images_invalidate_page(self):
+        get_product_page(*self.slugs)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=self.user, rating=4, comment='Fast')
+        page = get_product_page(*self.slugs)
+        self.assertEqual(page['review_count'], 1)
+        self.assertEqual(page['reviews'][0].user.username, 'reviewer')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/ram.webp')
+        self.assertEqual(len(get_product_page(*self.slugs)['images']), 1)
+
+    def test_renamed_product_is_not_served_from_stale_slug(self):
+        get_product_page(*self.slugs)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Vengeance RGB 32GB'
+            self.product.slug = 'vengeance-rgb-32gb'
+            self.product.save()
+        self.assertIsNone(get_product_page(*self.slugs))
+        page = get_product_page(self.category.slug, self.company.slug, self.product.slug)
+        self.assertEqual(page['product'].name, 'Vengeance RGB 32GB')
+
+    def test_moved_product_leaves_old_category(self):
+        self.assertEqual(get_product_page(*self.slugs)['related_products'], [self.other])
+        storage = Category.objects.create(name='Storage')
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Product.objects.get(pk=self.other.pk)
+            other.category = storage
+            other.save()
+        self.assertEqual(get_product_page(*self.slugs)['related_products'], [])
+
+    def test_stock_is_read_live(self):
+        url = reverse('product_detail', args=self.slugs)
+        self.client.get(url)
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        response = self.client.get(url)
+        self.assertEqual(response.context['product'].stock, 0)
+
+    def test_single_flight_rebuilds_once(self):
+        calls = []
+        started = threading.Event()
+        results = []
+
+        def build():
+            calls.append(1)
+            started.set()
+            # Hold the lock while the other threads arrive
+            threading.Event().wait(0.2)
+            return 'page'
+
+        def fetch():
+            results.append(single_flight('pcapp:test:single-flight', build))
+
+        first = threading.Thread(target=fetch)
+        first.start()
+        started.wait(5)
+        others = [threading.Thread(target=fetch) for _ in range(4)]
+        for thread in others:
+            thread.start()
+        for thread in [first, *others]:
+            thread.join(10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['page'] * 5)
+
+
+class ReviewPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Storage')
+        company = Company.objects.create(name='Samsung')
+        cls.product = Product.objects.create(
+            name='990 Pro 2TB', category=category, company=company, description='SSD', price=Decimal('180.00'),
+        )
+        start = timezone.now() - timedelta(days=30)
+        for i in range(25):
+            user = User.objects.create_user(f'reviewer{i}', password='secret')
+            review = Review.objects.create(product=cls.product, user=user, rating=i % 5 + 1, comment=f'Review {i}')
+            # Pairs of reviews share a timestamp, so the id has to break ties
+            Review.objects.filter(pk=review.pk).update(created_at=start + timedelta(hours=i // 2))
+
+    def collect(self, sort):
+        reviews, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                page = review_page(self.product.pk, sort, cursor, per_page=4)
+            reviews.extend(page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                return reviews
+
+    def test_pages_cover_every_review_in_order(self):
+        reviews = list(Review.objects.filter(product=self.product))
+        expected = {
+            'newest': sorted(reviews, key=lambda r: (r.created_at, r.id), reverse=True),
+            'oldest': sorted(reviews, key=lambda r: (r.created_at, r.id)),
+            'highest': sorted(reviews, key=lambda r: (r.rating, r.created_at, r.id), reverse=True),
+            'lowest': sorted(reviews, key=lambda r: (r.rating, r.created_at, r.id)),
+        }
+        for sort in REVIEW_SORTS:
+            with self.subTest(sort=sort):
+                self.assertEqual([r.pk for r in self.collect(sort)], [r.pk for r in expected[sort]])
+
+    def test_load_more_endpoint(self):
+        url = reverse('product_reviews_api', args=[self.product.pk])
+        first = self.client.get(url, {'sort': 'highest'}).json()
+        self.assertEqual(len(first['reviews']), 10)
+        self.assertEqual(first['reviews'][0]['rating'], 5)
+        second = self.client.get(url, {'sort': 'highest', 'cursor': first['next_cursor']}).json()
+        seen = {review['id'] for review in first['reviews']}
+        self.assertFalse(seen & {review['id'] for review in second['reviews']})
+
+        # A cursor only continues the sort it was issued for
+        response = self.client.get(url, {'sort': 'newest', 'cursor': first['next_cursor']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'sort': 'random'}).status_code, 400)
+
+    def test_product_page_shows_first_page(self):
+        cache.clear()
+        url = reverse('product_detail', args=[self.product.category.slug, self.product.company.slug, self.product.slug])
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['reviews']), 10)
+        self.assertTrue(response.context['reviews_cursor'])
+
+
+class ListingPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Power Supplies')
+        cls.company = Company.objects.create(name='Seasonic')
+        cls.company.categories.add(cls.category)
+        # Repeated prices and names, so the id has to break ties
+        cls.products = [
+            Product.objects.create(
+                name=f'Focus {i % 10}', slug=f'focus-{i}', category=cls.category, company=cls.company,
+                description='PSU', price=Decimal(100 + i % 7),
+            )
+            for i in range(30)
+        ]
+        cls.url = reverse('company_products', args=[cls.category.slug, cls.company.slug])
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, params):
+        response = self.client.get(self.url, params)
+        products = list(response.context['products'])
+        cursor = response.context['next_cursor']
+        while cursor:
+            response = self.client.get(self.url, {**params, 'cursor': cursor})
+            self.assertIsNone(response.context['page_obj'])
+            products.extend(response.context['products'])
+            cursor = response.context['next_cursor']
+        return [product.pk for product in products]
+
+    def test_cursor_pages_follow_every_sort(self):
+        expected = {
+            'name': sorted(self.products, key=lambda p: (p.name, p.pk)),
+            'price_low': sorted(self.products, key=lambda p: (p.price, p.pk)),
+            'price_high': sorted(self.products, key=lambda p: (p.price, p.pk), reverse=True),
+            'newest': sorted(self.products, key=lambda p: (p.created_at, p.pk), reverse=True),
+        }
+        for sort_by, products in expected.items():
+            with self.subTest(sort_by=sort_by):
+                self.assertEqual(self.walk({'sort_by': sort_by}), [p.pk for p in products])
+
+    def test_cursor_matches_numbered_page(self):
+        first = self.client.get(self.url, {'sort_by': 'price_low'})
+        by_cursor = self.client.get(self.url, {'sort_by': 'price_low', 'cursor': first.context['next_cursor']})
+        by_number = self.client.get(self.url, {'sort_by': 'price_low', 'page': 2})
+        self.assertEqual(list(by_cursor.context['products']), list(by_number.context['products']))
+
+        # A broken cursor starts over instead of failing
+        response = self.client.get(self.url, {'sort_by': 'price_low', 'cursor': 'garbage'})
+        self.assertEqual(list(response.context['products']), list(first.context['products']))
+
+    def test_count_is_cached_until_products_change(self):
+        response = self.client.get(self.url, {'page': 1})
+        self.assertEqual(response.context['page_obj'].paginator.count, 30)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {'page': 2})
+        self.assertFalse([q for q in ctx.captured_queries if 'COUNT(*)' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name='Prime', category=self.category, company=self.company, description='PSU', price=Decimal('300'),
+            )
+        response = self.client.get(self.url, {'page': 1})
+        self.assertEqual(response.context['page_obj'].paginator.count, 31)
+
+    def test_search_sorts_by_cursor(self):
+        response = self.client.get(reverse('search_products'), {'q': 'focus', 'sort_by': 'price_high'})
+        self.assertEqual(response.context['result_count'], 30)
+        products = list(response.context['products'])
+        self.assertEqual([p.price for p in products], sorted((p.price for p in products), reverse=True))
+        self.assertTrue(response.context['next_cursor'])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cpus = Category.objects.create(name='Processors')
+        gpus = Category.objects.create(name='Graphics Cards')
+        amd = Company.objects.create(name='AMD')
+        nvidia = Company.objects.create(name='Nvidia')
+        cls.ryzen = Product.objects.create(
+            name='Ryzen 7 7800X3D', category=cpus, company=amd, price=Decimal('400.00'),
+            description='Gaming processor', specifications={'socket': 'AM5', 'memory': {'type': 'DDR5'}},
+        )
+        cls.radeon = Product.objects.create(
+            name='Radeon RX 7800 XT', category=gpus, company=amd, price=Decimal('500.00'),
+            description='Graphics card for 1440p gaming', specifications={'vram': '16 GB'},
+        )
+        cls.geforce = Product.objects.create(
+            name='GeForce RTX 4070', category=gpus, company=nvidia, price=Decimal('600.00'),
+            description='Graphics card', specifications={'vram': '12 GB'},
+        )
+        cls.headset = Product.objects.create(
+            name='Gaming Headset', category=gpus, company=nvidia, price=Decimal('50.00'),
+            description='Wireless audio',
+        )
+
+    def backends(self):
+        memory = MemoryBackend()
+        memory.load(indexable_products())
+        return [FTS5Backend(), memory]
+
+    def test_fts5_index_is_used_on_sqlite(self):
+        self.assertTrue(FTS5Backend.is_available())
+
+    def test_prefix_and_ranking(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(backend.search('ryz'), [self.ryzen.pk])
+                self.assertEqual(backend.search('am5 ddr5'), [self.ryzen.pk])
+                self.assertEqual(set(backend.search('amd')), {self.ryzen.pk, self.radeon.pk})
+                # A name match outranks description-only matches
+                self.assertEqual(backend.search('gaming')[0], self.headset.pk)
+                self.assertEqual(len(backend.search('gaming')), 3)
+                self.assertEqual(backend.search('"amd OR'), [])
+
+    def test_index_follows_product_changes(self):
+        self.geforce.name = 'GeForce RTX 4070 Super'
+        self.geforce.save()
+        self.assertEqual(search_product_ids('super'), [self.geforce.pk])
+
+        Company.objects.filter(pk=self.geforce.company_id).update(name='NVIDIA Corporation')
+        company = Company.objects.get(pk=self.geforce.company_id)
+        company.save()
+        self.assertEqual(set(search_product_ids('corporation')), {self.geforce.pk, self.headset.pk})
+
+        self.geforce.delete()
+        self.assertEqual(search_product_ids('geforce'), [])
+
+    def test_counts_and_sorts_cover_every_match(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(backend.count('gaming'), 3)
+                matches = backend.filter(Product.objects.order_by('price'), 'gaming')
+                self.assertEqual(list(matches), [self.headset, self.ryzen, self.radeon])
+                self.assertEqual(backend.count('"'), 0)
+
+        # Only the best match is ranked, but the count and sorted pages have all three
+        with mock.patch('pcapp.views.search_product_ids', lambda query: search_product_ids(query, 1)), \
+                mock.patch('pcapp.views.MAX_RESULTS', 1):
+            response = self.client.get(reverse('search_products'), {'q': 'gaming'})
+            self.assertEqual((response.context['result_count'], len(response.context['products'])), (3, 1))
+            response = self.client.get(reverse('search_products'), {'q': 'gaming', 'sort_by': 'price_high'})
+        self.assertEqual(response.context['result_count'], 3)
+        self.assertEqual(response.context['products'], [self.radeon, self.ryzen, self.headset])
+
+    def test_memory_index_follows_committed_changes(self):
+        memory, other_process = MemoryBackend(), MemoryBackend()
+        memory.search('warm up')
+        other_process.search('warm up')
+        with mock.patch('pcapp.search.get_backend', return_value=memory):
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                self.geforce.name = 'GeForce RTX 4070 Super'
+                self.geforce.save()
+                transaction.set_rollback(True)
+            self.assertEqual(memory.search('super'), [])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.radeon.name = 'Radeon RX 7800 XT Super'
+                self.radeon.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.headset.delete()
+        for backend in (memory, other_process):
+            self.assertEqual(backend.search('super'), [self.radeon.pk])
+            self.assertEqual(backend.search('headset'), [])
+
+    def test_search_view_keeps_ranking(self):
+        response = self.client.get(reverse('search_products') + '?q=graphics')
+        self.assertEqual(
+            [product.pk for product in response.context['page_obj']],
+            search_product_ids('graphics'),
+        )
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gpus = Category.objects.create(name='Graphics Cards')
+        cls.nvidia = Company.objects.create(name='Nvidia')
+        cls.nvidia.categories.add(cls.gpus)
+        cls.product = Product.objects.create(
+            name='GeForce RTX 4070', category=cls.gpus, company=cls.nvidia,
+            description='Graphics card', price=Decimal('600.00'),
+        )
+
+    def setUp(self):
+        invalidate_suggestions()
+
+    def test_suggest_endpoint(self):
+        suggest('warm up')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('search_suggest') + '?q=gra')
+        self.assertEqual(response.json()['suggestions'], [
+            {'type': 'category', 'label': 'Graphics Cards', 'url': reverse('category_detail', args=['graphics-cards'])},
+        ])
+        labels = [s['label'] for s in self.client.get(reverse('search_suggest') + '?q=4070').json()['suggestions']]
+        self.assertEqual(labels, ['GeForce RTX 4070'])
+
+    def test_warm_builds_the_index(self):
+        warm_suggestions()
+        with self.assertNumQueries(0):
+            self.assertEqual([s['label'] for s in suggest('gef')], ['GeForce RTX 4070'])
+
+    def test_product_changes_are_applied(self):
+        suggest('warm up')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'GeForce RTX 4070 Super'
+            self.product.save()
+        self.assertEqual([s['label'] for s in suggest('sup')], ['GeForce RTX 4070 Super'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(suggest('geforce'), [])
+
+    def test_changes_from_other_processes_are_replayed(self):
+        index = get_suggestion_index()
+        # Another process renames the product and records it
+        Product.objects.filter(pk=self.product.pk).update(name='GeForce RTX 4070 Ti')
+        record_change(SUGGEST_VERSION_KEY, (self.product.pk,))
+        # ...and so does this one, for a product of its own
+        other = Product.objects.create(
+            name='GeForce RTX 4060', category=self.gpus, company=self.nvidia,
+            description='Graphics card', price=Decimal('300.00'),
+        )
+        refresh_suggestions(other.pk)
+        with self.assertNumQueries(1):
+            labels = [s['label'] for s in suggest('geforce')]
+        self.assertEqual(sorted(labels), ['GeForce RTX 4060', 'GeForce RTX 4070 Ti'])
+        # Caught up in place rather than rebuilt
+        self.assertIs(get_suggestion_index(), index)
+
+    def test_ranking_and_long_prefixes(self):
+        index = SuggestionIndex()
+        index.add(1, 'product', 'Ryzen 7 7800X3D', '/a/', score=1)
+        index.add(2, 'product', 'Ryzen 7 7700X', '/b/', score=5)
+        index.add(3, 'brand', 'Ryzen Fans', '/c/')
+        self.assertEqual([e['url'] for e in index.lookup('ry')], ['/c/', '/b/', '/a/'])
+        self.assertEqual([e['url'] for e in index.lookup('ryzen 7 7')], ['/b/', '/a/'])
+        index.remove(2)
+        self.assertEqual([e['url'] for e in index.lookup('ryz')], ['/c/', '/a/'])
+        self.assertEqual([e['url'] for e in index.lookup('7700')], [])
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Motherboards')
+        cls.company = Company.objects.create(name='ASUS')
+        cls.company.categories.add(cls.category)
+        specs = [
+            {'socket': 'AM5', 'memory': {'type': 'DDR5'}, 'slots': 4},
+            {'socket': 'AM5', 'memory': {'type': 'DDR5'}, 'slots': 2},
+            {'socket': 'AM4', 'memory': {'type': 'DDR4, DDR5'}, 'slots': 4},
+            {'socket': 'LGA1700', 'memory': {'type': 'DDR4'}, 'slots': 4},
+        ]
+        cls.boards = [
+            Product.objects.create(
+                name=f'Board {i}', category=cls.category, company=cls.company,
+                description='Motherboard', price=Decimal('200.00'), specifications=spec,
+            )
+            for i, spec in enumerate(specs)
+        ]
+
+    def test_extract_specifications(self):
+        self.assertEqual(
+            list(extract_specifications({'socket': 'AM4', 'memory': {'type': 'DDR4, DDR5'}, 'tags': ['a', 'b']})),
+            [('socket', 'AM4'), ('memory.type', 'DDR4'), ('memory.type', 'DDR5'), ('tags', 'a'), ('tags', 'b')],
+        )
+
+    def test_spec_rows_follow_product_changes(self):
+        board = self.boards[0]
+        board.specifications = {'socket': 'AM4'}
+        board.save()
+        self.assertEqual(list(board.spec_values.values_list('key', 'value')), [('socket', 'AM4')])
+
+    def test_numbers_too_large_for_the_index_stay_text(self):
+        board = Product.objects.create(
+            name='Board EAN', category=self.category, company=self.company, description='Motherboard',
+            price=Decimal('200.00'), specifications={'ean': '4711081234567', 'part': '1234567890', 'slots': 999999999.5},
+        )
+        self.assertEqual(
+            set(board.spec_values.values_list('key', 'value', 'numeric_value')),
+            {('ean', '4711081234567', None), ('part', '1234567890', None), ('slots', '999999999.5', Decimal('999999999.5'))},
+        )
+        self.assertIsNone(parse_number(999999999.9999))
+
+    def test_facet_counts(self):
+        products = Product.objects.filter(category=self.category)
+        params = QueryDict('spec_socket=AM5&spec_socket=AM4&spec_slots_min=3')
+        filters = parse_filters(params)
+        with self.assertNumQueries(3):
+            facets = {facet['key']: facet for facet in facet_counts(products, filters, self.category)}
+        sockets = {option['value']: option['count'] for option in facets['socket']['values']}
+        # Socket counts ignore the socket filter but respect the slots filter
+        self.assertEqual(sockets, {'AM4': 1, 'AM5': 1, 'LGA1700': 1})
+        memory = {option['value']: option['count'] for option in facets['memory.type']['values']}
+        self.assertEqual(memory, {'DDR4': 1, 'DDR5': 2})
+        self.assertTrue(facets['slots']['numeric'])
+        self.assertEqual(facets['memory.type']['label'], 'Memory type')
+
+    def test_company_products_filters(self):
+        url = reverse('company_products', args=[self.category.slug, self.company.slug])
+        response = self.client.get(url + '?spec_memory.type=DDR5&spec_socket=AM5')
+        self.assertEqual([p.name for p in response.context['page_obj']], ['Board 0', 'Board 1'])
+        self.assertEqual(ProductSpec.objects.filter(key='socket').count(), 4)
+
+
+class CompatibilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name='Generic')
+
+        def part(category, name, specifications):
+            return Product.objects.create(
+                name=name, category=category, company=company,
+                description=name, price=Decimal('100.00'), specifications=specifications,
+            )
+
+        cpus = Category.objects.create(name='Processors')
+        boards = Category.objects.create(name='Motherboards')
+        memory = Category.objects.create(name='Memory')
+        gpus = Category.objects.create(name='Graphics Cards')
+        psus = Category.objects.create(name='Power Supplies')
+        cases = Category.objects.create(name='Cabinets')
+        cls.cpu = part(cpus, 'Ryzen 7', {'socket': 'AM5', 'tdp': '120W', 'memory_type': 'DDR5'})
+        cls.am5_board = part(boards, 'B650 ATX', {'socket': 'Socket AM5', 'memory': {'type': 'DDR5'}, 'form_factor': 'ATX'})
+        cls.am4_board = part(boards, 'B550 mATX', {'socket': 'AM4', 'memory': {'type': 'DDR4'}, 'form_factor': 'Micro-ATX'})
+        cls.unlisted_board = part(boards, 'Mystery Board', {})
+        cls.ddr5 = part(memory, 'DDR5 Kit', {'memory_type': 'DDR5'})
+        cls.gpu = part(gpus, 'RTX 4080', {'length': '33.6 cm', 'tdp': '320W'})
+        cls.small_psu = part(psus, 'PSU 450', {'wattage': '450W'})
+        cls.big_psu = part(psus, 'PSU 850', {'wattage': '850W'})
+        cls.small_case = part(cases, 'Mini Case', {'form_factor': 'Mini-ITX', 'max_gpu_length': '300 mm'})
+        cls.tower = part(cases, 'Tower', {'form_factor': 'ATX', 'max_gpu_length': '360 mm'})
+
+    def setUp(self):
+        invalidate_compatibility()
+
+    def test_compatible_build(self):
+        report = get_catalogue().check({
+            'processor': self.cpu.pk, 'motherboard': self.am5_board.pk, 'memory': self.ddr5.pk,
+            'graphics_card': self.gpu.pk, 'power_supply': self.big_psu.pk, 'case': self.tower.pk,
+        })
+        self.assertTrue(report['is_compatible'], report['issues'])
+        self.assertEqual(report['warnings'], [])
+        self.assertEqual(report['power_consumption'], 75 + 120 + 320)
+        self.assertEqual(report['power_percentage'], 61)
+
+    def test_incompatible_build(self):
+        report = get_catalogue().check({
+            'processor': self.cpu.pk, 'motherboard': self.am4_board.pk, 'memory': self.ddr5.pk,
+            'graphics_card': self.gpu.pk, 'power_supply': self.small_psu.pk, 'case': self.small_case.pk,
+        })
+        self.assertFalse(report['is_compatible'])
+        self.assertEqual(len(report['issues']), 5)
+        self.assertEqual(
+            {role for role, details in report['results'].items() if details['compatible']},
+            set(),
+        )
+
+    def test_compatible_parts(self):
+        catalogue = get_catalogue()
+        selection = {'processor': self.cpu.pk, 'graphics_card': self.gpu.pk}
+        # Parts that do not list a spec cannot be ruled out
+        self.assertEqual(
+            catalogue.compatible_parts('motherboard', selection),
+            {self.am5_board.pk, self.unlisted_board.pk},
+        )
+        self.assertEqual(catalogue.compatible_parts('case', selection), {self.tower.pk})
+        self.assertEqual(catalogue.compatible_parts('power_supply', selection), {self.big_psu.pk})
+
+    def test_catalogue_follows_product_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.am4_board.specifications = {'socket': 'AM5'}
+            self.am4_board.save()
+        self.assertIn(
+            self.am4_board.pk,
+            get_catalogue().compatible_parts('motherboard', {'processor': self.cpu.pk}),
+        )
+
+    def test_power_supply_without_wattage(self):
+        self.small_psu.specifications = {'wattage': '0 W'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.small_psu.save()
+        report = get_catalogue().check({'processor': self.cpu.pk, 'power_supply': self.small_psu.pk})
+        self.assertEqual(report['warnings'], ['Could not verify the power supply wattage.'])
+        self.assertIsNone(report['power_percentage'])
+
+    def test_unrelated_changes_keep_the_catalogue(self):
+        catalogue = get_catalogue()
+        accessory = Category.objects.create(name='Accessories')
+        with self.captureOnCommitCallbacks(execute=True):
+            board = Product.objects.get(pk=self.am5_board.pk)
+            board.price = Decimal('90.00')
+            board.save()
+            Product.objects.create(
+                name='Mouse Pad', category=accessory, company=self.cpu.company,
+                description='Pad', price=Decimal('5.00'),
+            )
+            category = Category.objects.get(pk=accessory.pk)
+            category.description = 'Small things'
+            category.save()
+        self.assertIs(get_catalogue(), catalogue)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            category.name = 'Cases'
+            category.save()
+        self.assertIsNot(get_catalogue(), catalogue)
+
+    def test_views(self):
+        response = self.client.post(reverse('compatibility_checker'), {
+            'processor': self.cpu.pk, 'motherboard': self.am4_board.pk,
+        })
+        self.assertFalse(response.context['is_compatible'])
+        self.assertEqual(response.context['results']['motherboard']['label'], 'Motherboard')
+
+        response = self.client.get(reverse('compatible_parts_api'), {
+            'role': 'motherboard', 'processor': self.cpu.pk,
+        })
+        self.assertEqual(
+            [part['name'] for part in response.json()['parts']],
+            ['B650 ATX', 'Mystery Board'],
+        )
+        response = self.client.get(reverse('compatibility_check_api'), {'processor': self.cpu.pk})
+        self.assertEqual(response.status_code, 400)
+
+
+def create_stock_product(stock, name='RTX 4090'):
+    category, _ = Category.objects.get_or_create(name='Graphics Cards')
+    company, _ = Company.objects.get_or_create(name='Nvidia')
+    return Product.objects.create(
+        name=name, category=category, company=company,
+        description='Graphics card', price=Decimal('1000.00'), stock=stock,
+    )
+
+
+CHECKOUT_FORM = {
+    'full_name': 'Buyer', 'email': 'buyer@example.com', 'phone': '9999999999', 'address': 'Street 1',
+    'city': 'Pune', 'state': 'MH', 'pincode': '411001', 'payment_method': 'cod',
+}
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_stock_product(5)
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+
+    def refresh_stock(self):
+        self.product.refresh_from_db(fields=['stock'])
+        return self.product.stock
+
+    def test_take_stock_is_all_or_nothing(self):
+        other = create_stock_product(1, name='RTX 4080')
+        with self.assertRaises(InsufficientStock) as raised:
+            take_stock({self.product.pk: 2, other.pk: 2})
+        self.assertEqual(raised.exception.product_ids, [other.pk])
+        self.assertEqual(self.refresh_stock(), 5)
+
+    def test_reserve_adjusts_by_difference(self):
+        self.assertEqual(reserve(self.cart, self.product.pk, 3), 3)
+        self.assertEqual(self.refresh_stock(), 2)
+        self.assertEqual(reserve(self.cart, self.product.pk, 1), 1)
+        self.assertEqual(self.refresh_stock(), 4)
+        self.assertEqual(reserve(self.cart, self.product.pk, 9, partial=True), 5)
+        self.assertEqual(self.refresh_stock(), 0)
+        with self.assertRaises(InsufficientStock):
+            reserve(self.cart, self.product.pk, 6)
+
+    def test_expired_reservations_return_stock(self):
+        reserve(self.cart, self.product.pk, 4)
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(release_expired(timezone.now() + timedelta(hours=1)), 1)
+        self.assertEqual(self.refresh_stock(), 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_claim_cart_stock(self):
+        reserve(self.cart, self.product.pk, 2)
+        # Two units are already held; the third comes from stock
+        claim_cart_stock(self.cart, {self.product.pk: 3})
+        self.assertEqual(self.refresh_stock(), 2)
+        self.assertFalse(self.cart.reservations.exists())
+
+    def test_cart_views_hold_stock(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_to_cart'), {'product_id': self.product.pk, 'quantity': 7})
+        self.assertIn('Only 5 units', response.json()['message'])
+        self.assertEqual(self.refresh_stock(), 0)
+
+        item = CartItem.objects.get(cart=self.cart)
+        self.client.post(reverse('update_cart'), {'item_id': item.pk, 'quantity': 2})
+        self.assertEqual(self.refresh_stock(), 3)
+
+        response = self.client.post(reverse('checkout'), CHECKOUT_FORM)
+        order = Order.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('order_confirmation', args=[order.pk]))
+        self.assertEqual(self.refresh_stock(), 3)
+        self.assertEqual(order.total_price, Decimal('2000.00'))
+        self.assertFalse(self.cart.items.exists())
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class AnonymousCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gpu = create_stock_product(5)
+        cls.cpu = create_stock_product(2, name='Ryzen 7')
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def test_anonymous_cart_lives_in_cookie(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('add_to_cart'), {'product_id': self.gpu.pk, 'quantity': 2})
+            response = self.client.post(reverse('add_to_cart'), {'product_id': self.cpu.pk, 'quantity': 3})
+        self.assertIn('Only 2 units', response.json()['message'])
+        self.assertEqual(response.json()['cart_total'], 4)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in ctx.captured_queries))
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.get(reverse('view_view'))
+        self.assertEqual([(item.product.name, item.quantity) for item in response.context['cart_items']],
+                         [('RTX 4090', 2), ('Ryzen 7', 2)])
+
+        self.client.post(reverse('remove_from_cart'), {'product_id': self.gpu.pk})
+        self.assertEqual(self.client.get(reverse('view_view')).context['cart'].total_items, 2)
+
+    def test_invalid_quantity_is_rejected(self):
+        self.client.post(reverse('add_to_cart'), {'product_id': self.gpu.pk, 'quantity': 1})
+        response = self.client.post(reverse('update_cart'), {'product_id': self.gpu.pk, 'quantity': 'lots'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'success': False, 'message': 'Invalid quantity'})
+        self.assertEqual(self.client.get(reverse('view_view')).context['cart'].total_items, 1)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies[COOKIE_NAME] = '{"1":50}'
+        response = self.client.get(reverse('view_view'))
+        self.assertEqual(response.context['cart_items'], [])
+
+    def test_merge_on_login(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.gpu, quantity=4)
+        self.client.post(reverse('add_to_cart'), {'product_id': self.gpu.pk, 'quantity': 1})
+        self.client.post(reverse('add_to_cart'), {'product_id': self.cpu.pk, 'quantity': 2})
+
+        response = self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret'})
+        self.assertEqual(response.cookies[COOKIE_NAME].value, '')
+        self.assertEqual(
+            dict(cart.items.values_list('product__name', 'quantity')),
+            {'RTX 4090': 4, 'Ryzen 7': 2},
+        )
+
+
+class AsyncViewTests(TestCase):
+    """
+    The async views under the ASGI handler, signed in, where request.user
+    must be loaded with auser().
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_stock_product(5)
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    async def test_catalogue_pages(self):
+        product = self.product
+        urls = [
+            reverse('home'),
+            reverse('category_detail', args=[product.category.slug]),
+            reverse('company_products', args=[product.category.slug, product.company.slug]),
+            reverse('product_detail', args=[product.category.slug, product.company.slug, product.slug]),
+            reverse('search_products') + '?q=rtx',
+        ]
+        await self.async_client.aforce_login(self.user)
+        for url in urls:
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertContains(response, 'shopper')
+
+    async def test_cart_and_review(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('add_to_cart'), {'product_id': self.product.pk, 'quantity': 7})
+        self.assertEqual(response.json()['cart_total'], 5)
+        response = await self.async_client.post(reverse('update_cart'), {'product_id': self.product.pk, 'quantity': 2})
+        self.assertEqual(response.json()['cart_items'], 2)
+        item = await CartItem.objects.aget(cart__user=self.user)
+        self.assertEqual(item.quantity, 2)
+
+        url = reverse('product_detail', args=[self.product.category.slug, self.product.company.slug, self.product.slug])
+        response = await self.async_client.post(url, {'rating': 4, 'comment': 'Quiet'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertTrue(await Review.objects.filter(product=self.product, user=self.user).aexists())
+
+
+class CartSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.products = [create_stock_product(100, name=f'Part {i}') for i in range(20)]
+        # 10.01 less 50% is 5.005, charged as 5.01
+        Product.objects.filter(pk=cls.products[0].pk).update(price=Decimal('10.01'), discount_percentage=Decimal('50'))
+
+    def fill_cart(self, count):
+        CartItem.objects.filter(cart=self.cart).delete()
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, product=product, quantity=3) for product in self.products[:count]
+        )
+
+    def test_aggregate_matches_lines(self):
+        self.fill_cart(20)
+        lines = list(self.cart.items.select_related('product'))
+        expected = sum(item.total_price for item in lines)
+        self.assertEqual(expected, Decimal('5.01') * 3 + Decimal('1000.00') * 57)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cart.summary(), (60, expected))
+        annotated = Cart.objects.with_totals().get(pk=self.cart.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(annotated.summary(), (60, expected))
+
+    def test_empty_cart(self):
+        self.assertEqual(self.cart.summary(), (0, Decimal('0.00')))
+        self.assertEqual(Cart.objects.with_totals().get(pk=self.cart.pk).summary(), (0, Decimal('0.00')))
+
+    def test_cart_views_do_not_walk_the_cart(self):
+        self.client.force_login(self.user)
+        for count in (1, 20):
+            self.fill_cart(count)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(reverse('remove_from_cart'), {'product_id': self.products[0].pk})
+            self.assertEqual(response.json()['cart_items'], 3 * (count - 1))
+            if count == 1:
+                baseline = len(ctx.captured_queries)
+            self.assertEqual(len(ctx.captured_queries), baseline)
+
+    def test_admin_changelist(self):
+        self.client.force_login(self.user)
+        for i in range(5):
+            cart = Cart.objects.create(user=User.objects.create_user(f'shopper{i}'))
+            CartItem.objects.create(cart=cart, product=self.products[i], quantity=2)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('admin:pcapp_cart_changelist'))
+        self.assertContains(response, '2000.00')
+        self.assertLess(len(ctx.captured_queries), 10)
+
+
+class CheckoutPipelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.products = [create_stock_product(10, name=f'Part {i}') for i in range(50)]
+        Product.objects.filter(pk=cls.products[0].pk).update(discount_percentage=Decimal('12.5'), price=Decimal('999.99'))
+
+    def fill_cart(self, count):
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, product=product, quantity=2) for product in self.products[:count]
+        )
+
+    def new_order(self):
+        return Order(user=self.user, payment_method='upi', **{
+            key: value for key, value in CHECKOUT_FORM.items() if key != 'payment_method'
+        })
+
+    def test_query_count_does_not_grow_with_cart(self):
+        for count in (1, 50):
+            self.fill_cart(count)
+            with self.assertNumQueries(10):
+                items = place_order(self.cart, self.new_order())
+            self.assertEqual(len(items), count)
+        self.assertEqual(OrderItem.objects.count(), 51)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_totals_use_rounded_unit_prices(self):
+        self.fill_cart(2)
+        order = self.new_order()
+        items = place_order(self.cart, order)
+        # 999.99 less 12.5% is 874.99125, charged as 874.99
+        self.assertEqual(items[0].price, Decimal('874.99'))
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('874.99') * 2 + Decimal('1000.00') * 2)
+
+    def test_failed_checkout_keeps_cart(self):
+        self.fill_cart(3)
+        Product.objects.filter(pk=self.products[1].pk).update(stock=1)
+        with self.assertRaises(InsufficientStock):
+            place_order(self.cart, self.new_order())
+        self.assertEqual(self.cart.items.count(), 3)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 10)
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('integrator', password='pw')
+        cls.products = [create_stock_product(10, name=f'Part {i}') for i in range(3)]
+        ProductImage.objects.create(product=cls.products[1], image='products/part-1.webp')
+        cls.orders = []
+        for i in range(ORDERS_PER_PAGE + 5):
+            order = Order.objects.create(user=cls.user, total_price=Decimal('10.00'), **CHECKOUT_FORM)
+            for product in cls.products[:i % 3 + 1]:
+                OrderItem.objects.create(order=order, product=product, price=Decimal('5.00'), quantity=2)
+            cls.orders.append(order)
+        cls.orders.reverse()  # Newest first, as listed
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_pages_follow_the_cursor(self):
+        response = self.client.get(reverse('order_history'))
+        first = response.context['orders']
+        self.assertEqual([order.pk for order in first], [order.pk for order in self.orders[:ORDERS_PER_PAGE]])
+        newest = first[0]
+        lines = newest.items.count()
+        self.assertEqual((newest.line_count, newest.item_count), (lines, lines * 2))
+        self.assertEqual(newest.thumbnail_name or '', 'products/part-1.webp' if lines > 1 else '')
+
+        response = self.client.get(reverse('order_history'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(
+            [order.pk for order in response.context['orders']],
+            [order.pk for order in self.orders[ORDERS_PER_PAGE:]],
+        )
+        self.assertIsNone(response.context['next_cursor'])
+        # A bad cursor starts over
+        response = self.client.get(reverse('order_history'), {'cursor': 'nonsense'})
+        self.assertEqual(response.context['orders'][0].pk, self.orders[0].pk)
+
+    def test_order_pages_run_constant_queries(self):
+        small = next(order for order in self.orders if order.items.count() == 1)
+        large = next(order for order in self.orders if order.items.count() == 3)
+        for name in ('order_detail', 'order_confirmation'):
+            # Warm the navigation and cart caches the base template reads
+            self.client.get(reverse(name, args=[small.pk]))
+            counts = []
+            for order in (small, large):
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.get(reverse(name, args=[order.pk]))
+                    str(response.context['order_items'][0])
+                self.assertContains(response, 'Part 0')
+                counts.append(len(ctx.captured_queries))
+            self.assertEqual(counts[0], counts[1], name)
+
+
+class GenerateCatalogueTests(TestCase):
+    def test_generates_consistent_dataset(self):
+        call_command(
+            'generate_catalogue', categories=3, products=40, images=2, users=10, reviews=60, carts=3, orders=8,
+            stdout=StringIO(),
+        )
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(ProductImage.objects.filter(is_primary=True).count(), 40)
+        self.assertEqual(Cart.objects.count(), 3)
+        self.assertTrue(ProductSpec.objects.exists())
+
+        # The denormalized rating statistics match the bulk-inserted reviews
+        self.assertEqual(Product.objects.aggregate(total=Sum('rating_count'))['total'], Review.objects.count())
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.total_price, sum(item.price * item.quantity for item in order.items.all()))
+
+        # Running it again adds to the catalogue instead of colliding
+        call_command('generate_catalogue', categories=3, products=5, users=2, reviews=0, carts=0, orders=0,
+                     stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 45)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """
+    Many buyers checking out the last units at once must never oversell.
+    """
+
+    BUYERS = 12
+    STOCK = 5
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        product = create_stock_product(self.STOCK)
+        users = []
+        for i in range(self.BUYERS):
+            user = User.objects.create_user(f'buyer{i}', password='secret')
+            cart = Cart.objects.create(user=user)
+            # Items put in the cart earlier whose reservations have lapsed
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            users.append(user)
+
+        clients = []
+        for user in users:
+            client = self.client_class()
+            client.force_login(user)
+            clients.append(client)
+
+        barrier = threading.Barrier(self.BUYERS, timeout=30)
+        statuses = []
+
+        def buy(client):
+            try:
+                barrier.wait()
+                statuses.append(client.post(reverse('checkout'), CHECKOUT_FORM).url)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=buy, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(statuses), self.BUYERS)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+        self.assertEqual(sum(OrderItem.objects.values_list('quantity', flat=True)), self.STOCK)
+        self.assertEqual(statuses.count(reverse('cart_view')), self.BUYERS - self.STOCK)
@@ -18,9 +18,11 @@ urlpatterns = [
     # Product Detail Page
     path('category/<slug:category_slug>/company/<slug:company_slug>/product/<slug:product_slug>/', 
          views.product_detail, name='product_detail'),
+    path('product/<int:product_id>/reviews/', views.product_reviews_api, name='product_reviews_api'),
     
     # Search
     path('search/', views.search_products, name='search_products'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     
     # Cart
     path('cart/', views.view_cart, name='view_view'),
@@ -49,6 +51,11 @@ urlpatterns = [
     
     # Compatibility Checker
     path('compatibility-checker/', views.compatibility_checker, name='compatibility_checker'),
+    path('compatibility-checker/check/', views.compatibility_check_api, name='compatibility_check_api'),
+    path('compatibility-checker/compatible/', views.compatible_parts_api, name='compatible_parts_api'),
+    
+    # Request metrics (staff only)
+    path('internal/request-stats/', views.request_stats, name='request_stats'),
     
     # Test View
     path('test/', views.test_view, name='test_view'),
@@ -1,11 +1,16 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db.models import Avg, Count, Q
-from django.http import JsonResponse, HttpResponse
+from django.db.models import Count, Q
+from django.http import Http404, JsonResponse, HttpResponse
 from django.views.decorators.http import require_POST
 from django.core.paginator import Paginator
 from django.contrib.auth import login, authenticate, logout
+from django.db import transaction
 from .models import (
     Category, Company, Product, ProductImage, Review,
     Cart, CartItem, Order, OrderItem, UserProfile,
@@ -13,9 +18,24 @@ from .models import (
 )
 from .forms import (
     UserRegistrationForm, UserLoginForm, UserProfileForm,
-    ReviewForm, ContactForm, NewsletterForm, OrderForm
+    ReviewForm, ContactForm, NewsletterForm, OrderForm, CompatibilityForm
+)
+from .compatibility import ROLES, get_catalogue
+from .carts import aget_cart, get_cart
+from .inventory import InsufficientStock
+from .orders import EmptyCart, place_order
+from .keyset import CachedCountPaginator, InvalidCursor, encode_cursor, paginate
+from .home_page import HOME_REFRESH, get_home
+from .page_cache import (
+    cache_anonymous_page, category_last_modified, category_scope, home_last_modified, home_scope,
+    listing_last_modified, listing_scope, product_last_modified, product_scope,
 )
-from django.utils.text import slugify
+from .product_cache import get_product_page
+from .reviews import DEFAULT_SORT, REVIEW_SORTS, review_data, review_page
+from .instrumentation import registry as request_stats_registry
+from .facets import apply_filters, facet_counts, parse_filters
+from .search import MAX_RESULTS, filter_products, search_count, search_product_ids
+from .suggest import suggest
 from django.template.loader import get_template
 
 # User Registration
@@ -41,57 +61,90 @@ def logout_view(request):
     messages.success(request, 'You have been successfully logged out.')
     return redirect('home')
 
+# Rendering runs the context processors and any lazy lookups in the
+# templates (request.user, related objects), so async views render in a thread
+arender = sync_to_async(render)
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
 # Home Page
-def home(request):
-    categories = Category.objects.all()
-    featured_products = Product.objects.filter(is_featured=True)[:8]
-    discounted_products = Product.objects.filter(discount_percentage__gt=0).order_by('-discount_percentage')[:8]
-    
-    # Ensure all categories have a slug
-    for category in categories:
-        if not category.slug:
-            category.slug = slugify(category.name)
-            category.save()
-    
-    context = {
-        'categories': categories,
-        'featured_products': featured_products,
-        'discounted_products': discounted_products,
-    }
-    return render(request, 'pcapp/home.html', context)
+# Kept no longer than the payload, so get_home() still notices when it is stale
+@cache_anonymous_page(home_scope, home_last_modified, timeout=HOME_REFRESH)
+async def home(request):
+    # Both product lists come from one cached payload; see pcapp.home_page.
+    # Categories come from the cached navigation tree (categories_processor)
+    context = await sync_to_async(get_home)()
+    return await arender(request, 'pcapp/home.html', context)
 
 # Category Page
-def category_detail(request, slug):
+@cache_anonymous_page(category_scope, category_last_modified)
+async def category_detail(request, slug):
     # Ensure slug is not empty
     if not slug:
         messages.error(request, "Invalid URL parameter.")
         return redirect('home')
         
     try:
-        category = get_object_or_404(Category, slug=slug)
-        companies = category.companies.all()
+        category = await aget_object_or_404(Category, slug=slug)
+        companies = await _alist(category.companies.all())
         
         context = {
             'category': category,
             'companies': companies,
         }
-        return render(request, 'pcapp/category_detail.html', context)
+        return await arender(request, 'pcapp/category_detail.html', context)
     except Exception as e:
         messages.error(request, f"An error occurred: {str(e)}")
         return redirect('home')
 
+PRODUCTS_PER_PAGE = 12
+
+# Listing sorts, each ending in the id so keyset cursors are unambiguous
+PRODUCT_SORTS = {
+    'name': ('name', 'id'),
+    'price_low': ('price', 'id'),
+    'price_high': ('-price', '-id'),
+    'newest': ('-created_at', '-id'),
+}
+
+def _paginate_products(request, products, ordering):
+    """
+    Page a product listing. ``?page=N`` gives numbered pages (with a cached
+    count); ``?cursor=`` continues after the last product shown, which
+    costs the same on every page. Returns (page_obj or None, the products,
+    the cursor of the next page or None).
+    """
+    cursor = request.GET.get('cursor')
+    if cursor is not None:
+        try:
+            page = paginate(products, ordering, cursor, PRODUCTS_PER_PAGE)
+        except InvalidCursor:
+            page = paginate(products, ordering, None, PRODUCTS_PER_PAGE)
+        return None, page.items, page.next_cursor
+    
+    page_obj = CachedCountPaginator(products, PRODUCTS_PER_PAGE).get_page(request.GET.get('page'))
+    page_obj.object_list = list(page_obj.object_list)
+    next_cursor = None
+    if page_obj.has_next():
+        next_cursor = encode_cursor(products, ordering, page_obj.object_list[-1])
+    return page_obj, page_obj.object_list, next_cursor
+
 # Company Products Page
-def company_products(request, category_slug, company_slug):
+@cache_anonymous_page(listing_scope, listing_last_modified)
+async def company_products(request, category_slug, company_slug):
     # Ensure slugs are not empty
     if not category_slug or not company_slug:
         messages.error(request, "Invalid URL parameters.")
         return redirect('home')
         
     try:
-        category = get_object_or_404(Category, slug=category_slug)
-        company = get_object_or_404(Company, slug=company_slug)
+        category, company = await asyncio.gather(
+            aget_object_or_404(Category, slug=category_slug),
+            aget_object_or_404(Company, slug=company_slug),
+        )
         
-        products = Product.objects.filter(category=category, company=company)
+        products = Product.objects.for_listing().filter(category=category, company=company)
         
         # Filtering
         min_price = request.GET.get('min_price')
@@ -103,69 +156,69 @@ def company_products(request, category_slug, company_slug):
         if max_price:
             products = products.filter(price__lte=max_price)
         
-        # Sorting
-        if sort_by == 'price_low':
-            products = products.order_by('price')
-        elif sort_by == 'price_high':
-            products = products.order_by('-price')
-        elif sort_by == 'newest':
-            products = products.order_by('-created_at')
-        else:  # Default: name
-            products = products.order_by('name')
+        # Specification facets (socket, memory type, VRAM, ...)
+        spec_filters = parse_filters(request.GET)
+        unfiltered = products
+        products = apply_filters(products, spec_filters)
+        
+        # Sorting, with the id breaking ties so every product has one place
+        if sort_by not in PRODUCT_SORTS:
+            sort_by = 'name'
+        ordering = PRODUCT_SORTS[sort_by]
+        products = products.order_by(*ordering)
+        
+        # Pagination, alongside the facet counts
+        (page_obj, product_list, next_cursor), facets = await asyncio.gather(
+            sync_to_async(_paginate_products)(request, products, ordering),
+            sync_to_async(facet_counts)(unfiltered, spec_filters, category),
+        )
         
-        # Pagination
-        paginator = Paginator(products, 12)  # 12 products per page
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        # Current filters, for the pagination links
+        filter_params = request.GET.copy()
+        filter_params.pop('page', None)
+        filter_params.pop('cursor', None)
         
         context = {
             'category': category,
             'company': company,
             'page_obj': page_obj,
+            'products': product_list,
+            'next_cursor': next_cursor,
             'min_price': min_price,
             'max_price': max_price,
             'sort_by': sort_by,
+            'facets': facets,
+            'filter_query': filter_params.urlencode(),
         }
-        return render(request, 'pcapp/company_products.html', context)
+        return await arender(request, 'pcapp/company_products.html', context)
     except Exception as e:
         messages.error(request, f"An error occurred: {str(e)}")
         return redirect('home')
 
 # Product Detail Page
-def product_detail(request, category_slug, company_slug, product_slug):
+@cache_anonymous_page(product_scope, product_last_modified)
+async def product_detail(request, category_slug, company_slug, product_slug):
     # Ensure slugs are not empty
     if not category_slug or not company_slug or not product_slug:
         messages.error(request, "Invalid URL parameters.")
         return redirect('home')
         
     try:
-        product = get_object_or_404(
-            Product,
-            slug=product_slug,
-            category__slug=category_slug,
-            company__slug=company_slug
-        )
-        
-        # Get product images
-        images = product.images.all()
-        
-        # Get related products
-        related_products = Product.objects.filter(
-            category=product.category
-        ).exclude(id=product.id)[:4]
-        
-        # Get reviews
-        reviews = product.reviews.all().order_by('-created_at')
-        avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-        review_count = reviews.count()
+        # Page data comes from the cache; see pcapp.product_cache
+        page = await sync_to_async(get_product_page)(category_slug, company_slug, product_slug)
+        if page is None:
+            raise Http404('No Product matches the given query.')
+        product = page['product']
+        # Stock moves with every cart, so it is never cached
+        product.stock = await Product.objects.filter(pk=product.pk).values_list('stock', flat=True).afirst() or 0
         
         # Review form
-        if request.method == 'POST' and request.user.is_authenticated:
+        if request.method == 'POST' and (user := await request.auser()).is_authenticated:
             form = ReviewForm(request.POST)
-            if form.is_valid():
-                review, created = Review.objects.update_or_create(
+            if await sync_to_async(form.is_valid)():
+                review, created = await Review.objects.aupdate_or_create(
                     product=product,
-                    user=request.user,
+                    user=user,
                     defaults={
                         'rating': form.cleaned_data['rating'],
                         'comment': form.cleaned_data['comment']
@@ -181,58 +234,128 @@ def product_detail(request, category_slug, company_slug, product_slug):
             'product': product,
             'category': product.category,
             'company': product.company,
-            'images': images,
-            'related_products': related_products,
-            'reviews': reviews,
-            'avg_rating': avg_rating,
-            'review_count': review_count,
+            'images': page['images'],
+            'related_products': page['related_products'],
+            'reviews': page['reviews'],
+            'reviews_cursor': page['reviews_cursor'],
+            'review_sorts': REVIEW_SORTS,
+            'avg_rating': page['avg_rating'],
+            'review_count': page['review_count'],
             'form': form,
         }
-        return render(request, 'pcapp/product_detail.html', context)
+        return await arender(request, 'pcapp/product_detail.html', context)
     except Exception as e:
         messages.error(request, f"An error occurred: {str(e)}")
         return redirect('home')
 
+# Product reviews ("load more")
+def product_reviews_api(request, product_id):
+    sort = request.GET.get('sort', DEFAULT_SORT)
+    if sort not in REVIEW_SORTS:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Unknown sort order.'
+        }, status=400)
+    
+    try:
+        page = review_page(product_id, sort, request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid cursor.'
+        }, status=400)
+    
+    return JsonResponse({
+        'sort': sort,
+        'reviews': [review_data(review) for review in page.items],
+        'next_cursor': page.next_cursor,
+    })
+
 # Search Products
-def search_products(request):
+async def search_products(request):
     query = request.GET.get('q', '')
     
-    if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query) |
-            Q(company__name__icontains=query)
-        ).distinct()
+    sort_by = request.GET.get('sort_by', 'relevance')
+    
+    if sort_by in PRODUCT_SORTS:
+        # Every match, not only the ranked ones, sorted and paged in the
+        # database like a listing
+        ordering = PRODUCT_SORTS[sort_by]
+        products = (await sync_to_async(filter_products)(Product.objects.for_listing(), query)).order_by(*ordering)
+        page_obj, product_list, next_cursor = await sync_to_async(_paginate_products)(request, products, ordering)
+        if page_obj is not None:
+            result_count = page_obj.paginator.count
+        else:
+            result_count = await sync_to_async(search_count)(query)
     else:
-        products = Product.objects.none()
+        sort_by = 'relevance'
+        # Ranked product ids from the search index, the best MAX_RESULTS only
+        product_ids = await sync_to_async(search_product_ids)(query) if query else []
+        result_count = len(product_ids)
+        if result_count >= MAX_RESULTS:
+            # The ranking was cut short, so count the rest
+            result_count = await sync_to_async(search_count)(query)
+        # The ranked ids are already in memory, so paging them is a slice
+        page_obj = Paginator(product_ids, PRODUCTS_PER_PAGE).get_page(request.GET.get('page'))
+        
+        # Load only the products on this page, keeping the ranking order
+        products = await Product.objects.for_listing().ain_bulk(page_obj.object_list)
+        page_obj.object_list = [products[pk] for pk in page_obj.object_list if pk in products]
+        product_list, next_cursor = page_obj.object_list, None
     
-    # Pagination
-    paginator = Paginator(products, 12)  # 12 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Current query and sort, for the pagination links
+    filter_params = request.GET.copy()
+    filter_params.pop('page', None)
+    filter_params.pop('cursor', None)
     
     context = {
         'query': query,
+        'sort_by': sort_by,
+        'result_count': result_count,
+        'max_ranked': MAX_RESULTS,
         'page_obj': page_obj,
+        'products': product_list,
+        'next_cursor': next_cursor,
+        'filter_query': filter_params.urlencode(),
     }
-    return render(request, 'pcapp/search_results.html', context)
+    return await arender(request, 'pcapp/search_results.html', context)
+
+# Search Suggestions (typeahead)
+def search_suggest(request):
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', 8))
+    except ValueError:
+        limit = 8
+    
+    return JsonResponse({
+        'query': query,
+        'suggestions': suggest(query, max(limit, 1)),
+    })
 
 # Cart Management
-@login_required
 def view_cart(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
+    cart = get_cart(request)
     
     context = {
         'cart': cart,
-        'cart_items': cart_items,
+        'cart_items': cart.lines(),
     }
     return render(request, 'pcapp/cart.html', context)
 
-@login_required
+async def _cart_product_id(request):
+    """
+    The product a cart form refers to: product_id, or the legacy item_id of
+    a signed-in user's CartItem.
+    """
+    product_id = request.POST.get('product_id')
+    if not product_id and request.POST.get('item_id') and (user := await request.auser()).is_authenticated:
+        item = await aget_object_or_404(CartItem, id=request.POST.get('item_id'), cart__user=user)
+        return item.product_id
+    return product_id
+
 @require_POST
-def add_to_cart(request):
+async def add_to_cart(request):
     try:
         product_id = request.POST.get('product_id')
         if not product_id:
@@ -251,39 +374,33 @@ def add_to_cart(request):
                 'message': 'Invalid quantity'
             }, status=400)
         
-        product = get_object_or_404(Product, id=product_id)
+        product = await aget_object_or_404(Product, id=product_id)
         
         # Check if product is available
-        if not product.is_available or product.stock <= 0:
+        if not product.is_available:
             return JsonResponse({
                 'success': False,
                 'message': f'{product.name} is currently out of stock'
             }, status=400)
             
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        cart = await aget_cart(request)
+        wanted = quantity + await cart.aquantity(product.id)
+        held = await cart.aset(product, wanted)
+        if held == 0:
+            return JsonResponse({
+                'success': False,
+                'message': f'{product.name} is currently out of stock'
+            }, status=400)
         
-        # Check if requested quantity exceeds stock
-        if cart_item.quantity > product.stock:
-            cart_item.quantity = product.stock
-            cart_item.save()
-            message = f'Only {product.stock} units of {product.name} are available. Your cart has been updated.'
+        if held < wanted:
+            message = f'Only {held} units of {product.name} are available. Your cart has been updated.'
         else:
             message = f'{product.name} added to cart'
         
         return JsonResponse({
             'success': True,
             'message': message,
-            'cart_total': cart.total_items
+            'cart_total': (await cart.asummary()).total_items
         })
     except Exception as e:
         return JsonResponse({
@@ -291,54 +408,54 @@ def add_to_cart(request):
             'message': f'An error occurred: {str(e)}'
         }, status=500)
 
-@login_required
 @require_POST
-def update_cart(request):
-    item_id = request.POST.get('item_id')
-    quantity = int(request.POST.get('quantity', 1))
-    
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    
-    if quantity > 0:
-        cart_item.quantity = quantity
-        cart_item.save()
-    else:
-        cart_item.delete()
+async def update_cart(request):
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except (TypeError, ValueError):
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid quantity'
+        }, status=400)
+    product = await aget_object_or_404(Product, id=await _cart_product_id(request))
     
-    cart = cart_item.cart
+    cart = await aget_cart(request)
+    quantity = await cart.aset(product, quantity) if quantity > 0 else 0
+    if quantity == 0:
+        await cart.aremove(product.id)
     
+    summary = await cart.asummary()
     return JsonResponse({
         'success': True,
-        'item_total': cart_item.total_price if quantity > 0 else 0,
-        'cart_total': cart.total_price,
-        'cart_items': cart.total_items
+        'item_total': product.unit_price * quantity,
+        'cart_total': summary.total_price,
+        'cart_items': summary.total_items
     })
 
-@login_required
 @require_POST
-def remove_from_cart(request):
-    item_id = request.POST.get('item_id')
+async def remove_from_cart(request):
+    product = await aget_object_or_404(Product, id=await _cart_product_id(request))
     
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-    cart = cart_item.cart
-    cart_item.delete()
+    cart = await aget_cart(request)
+    await cart.aremove(product.id)
     
+    summary = await cart.asummary()
     return JsonResponse({
         'success': True,
-        'message': f'{cart_item.product.name} removed from cart',
-        'cart_total': cart.total_price,
-        'cart_items': cart.total_items
+        'message': f'{product.name} removed from cart',
+        'cart_total': summary.total_price,
+        'cart_items': summary.total_items
     })
 
 # Checkout and Order
 @login_required
 def checkout(request):
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.items.all()
+    cart = get_cart(request)
+    cart_items = cart.lines()
     
     if not cart_items:
         messages.warning(request, 'Your cart is empty.')
-        return redirect('view_cart')
+        return redirect('cart_view')
     
     # Get user profile for pre-filling the form
     try:
@@ -363,20 +480,16 @@ def checkout(request):
         if form.is_valid():
             order = form.save(commit=False)
             order.user = request.user
-            order.total_price = cart.total_price
-            order.save()
             
-            # Create order items
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    price=cart_item.product.discounted_price,
-                    quantity=cart_item.quantity
-                )
-            
-            # Clear the cart
-            cart_items.delete()
+            try:
+                place_order(cart.cart, order)
+            except EmptyCart:
+                messages.warning(request, 'Your cart is empty.')
+                return redirect('cart_view')
+            except InsufficientStock as error:
+                short = ', '.join(Product.objects.filter(id__in=error.product_ids).values_list('name', flat=True))
+                messages.error(request, f'Sorry, there is not enough stock left for: {short}. Please update your cart.')
+                return redirect('cart_view')
             
             messages.success(request, 'Your order has been placed successfully!')
             return redirect('order_confirmation', order_id=order.id)
@@ -390,10 +503,20 @@ def checkout(request):
     }
     return render(request, 'pcapp/checkout.html', context)
 
+def _order_with_items(request, order_id):
+    """
+    One of the user's orders and its lines, in two queries however many
+    lines it has. Items keep the prices charged at checkout, so only the
+    products (for their names) are joined.
+    """
+    order = get_object_or_404(Order.objects.select_related('user'), id=order_id, user=request.user)
+    # The lines come back with .order set, so OrderItem.__str__ does not query
+    order_items = list(order.items.select_related('product').order_by('id'))
+    return order, order_items
+
 @login_required
 def order_confirmation(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    order_items = order.items.all()
+    order, order_items = _order_with_items(request, order_id)
     
     context = {
         'order': order,
@@ -401,19 +524,34 @@ def order_confirmation(request, order_id):
     }
     return render(request, 'pcapp/order_confirmation.html', context)
 
+ORDERS_PER_PAGE = 20
+# Newest first, with the id breaking ties so cursors are unambiguous;
+# served by the pcapp_order_user_recent index
+ORDER_HISTORY_ORDERING = ('-created_at', '-id')
+
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    """
+    The user's orders, ORDERS_PER_PAGE at a time: ``?cursor=`` continues
+    after the last order shown, so a buyer with thousands of orders gets
+    every page in one query.
+    """
+    orders = Order.objects.filter(user=request.user).for_history()
+    try:
+        page = paginate(orders, ORDER_HISTORY_ORDERING, request.GET.get('cursor'), ORDERS_PER_PAGE)
+    except InvalidCursor:
+        page = paginate(orders, ORDER_HISTORY_ORDERING, None, ORDERS_PER_PAGE)
     
     context = {
-        'orders': orders,
+        'orders': page.items,
+        'next_cursor': page.next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
     }
     return render(request, 'pcapp/order_history.html', context)
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    order_items = order.items.all()
+    order, order_items = _order_with_items(request, order_id)
     
     context = {
         'order': order,
@@ -466,10 +604,11 @@ def contact_us(request):
 
 # Newsletter Subscription
 @require_POST
-def subscribe_newsletter(request):
+async def subscribe_newsletter(request):
     form = NewsletterForm(request.POST)
-    if form.is_valid():
-        form.save()
+    # Validation checks the address is not subscribed yet
+    if await sync_to_async(form.is_valid)():
+        await sync_to_async(form.save)()
         return JsonResponse({
             'success': True,
             'message': 'Thank you for subscribing to our newsletter!'
@@ -481,33 +620,80 @@ def subscribe_newsletter(request):
 
 # Compatibility Checker Tool
 def compatibility_checker(request):
-    # This is a simplified version. In a real application, you would need
-    # to implement a more sophisticated compatibility checking logic.
-    cpu = request.GET.get('cpu')
-    motherboard = request.GET.get('motherboard')
-    ram = request.GET.get('ram')
-    gpu = request.GET.get('gpu')
+    context = {}
+    if request.method == 'POST':
+        form = CompatibilityForm(request.POST)
+        if form.is_valid():
+            report = get_catalogue().check(form.selection())
+            for role, details in report['results'].items():
+                details['label'] = ROLES[role][0]
+            context.update({
+                'results': report['results'],
+                'is_compatible': report['is_compatible'],
+                'compatibility_issues': report['issues'],
+                'compatibility_warnings': report['warnings'],
+                'recommendations': report['recommendations'],
+                'power_consumption': report['power_consumption'],
+                'power_percentage': report['power_percentage'],
+            })
+    else:
+        form = CompatibilityForm()
     
-    context = {
-        'cpu': cpu,
-        'motherboard': motherboard,
-        'ram': ram,
-        'gpu': gpu,
-        'is_compatible': True,  # Placeholder
-        'compatibility_notes': []  # Placeholder
-    }
+    context['form'] = form
     return render(request, 'pcapp/compatibility_checker.html', context)
 
+def _build_selection(params):
+    selection = {}
+    for role in ROLES:
+        try:
+            selection[role] = int(params[role])
+        except (KeyError, ValueError):
+            continue
+    return selection
+
+def compatibility_check_api(request):
+    selection = _build_selection(request.GET)
+    if len(selection) < 2:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Select at least two components to check.'
+        }, status=400)
+    
+    return JsonResponse(get_catalogue().check(selection))
+
+def compatible_parts_api(request):
+    role = request.GET.get('role')
+    if role not in ROLES:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Unknown component type.'
+        }, status=400)
+    
+    catalogue = get_catalogue()
+    ids = catalogue.compatible_parts(role, _build_selection(request.GET))
+    parts = sorted(
+        ({'id': pk, 'name': catalogue.parts[pk][1]} for pk in ids),
+        key=lambda part: part['name'].casefold(),
+    )
+    return JsonResponse({
+        'role': role,
+        'count': len(parts),
+        'parts': parts,
+    })
+
+@staff_member_required
+def request_stats(request):
+    # Per-route figures collected by RequestMetricsMiddleware in this process
+    return JsonResponse({'routes': request_stats_registry.snapshot()})
+
 def test_view(request):
     return render(request, 'pcapp/cart_test.html', {'message': 'This is a test view.'})
 
-@login_required
 def cart_view(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.items.all()
+    cart = get_cart(request)
     
     context = {
         'cart': cart,
-        'cart_items': cart_items,
+        'cart_items': cart.lines(),
     }
     return render(request, 'pcapp/cart_test.html', context) 
\ No newline at end of file
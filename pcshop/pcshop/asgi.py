@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pcshop.settings')
 
 application = get_asgi_application()
+
+# Load the search suggestions at worker start rather than on the first lookup
+from pcapp.suggest import warm  # noqa: E402
+
+warm()
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pcapp.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,8 +49,15 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'pcapp.carts.CartCookieMiddleware',
 ]
 
+# Share of requests RequestMetricsMiddleware measures (0 turns it off)
+PCAPP_METRICS_SAMPLE_RATE = 0
+
+# Threads generating image derivatives after uploads (0 generates them in the request)
+PCAPP_IMAGE_WORKERS = 2
+
 ROOT_URLCONF = 'pcshop.urls'
 
 TEMPLATES = [
@@ -59,7 +67,6 @@ TEMPLATES = [
             BASE_DIR / 'pcapp' / 'templates',
             BASE_DIR / 'templates',
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -68,6 +75,14 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'pcapp.context_processors.categories_processor',
             ],
+            # Compiled templates are kept in memory; under runserver the
+            # autoreloader clears them when a template changes
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -82,6 +97,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # checkouts queue for it instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # An on-disk test database, since the shared in-memory one fails
+        # concurrent writers with "table is locked" instead of waiting
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Use a shared backend (e.g. Redis or Memcached) in production so that cache
+# invalidation, such as the navigation version key, reaches every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pcshop',
     }
 }
 
@@ -126,6 +165,16 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # collectstatic minifies, fingerprints and precompresses (pcapp.assets)
+    'staticfiles': {
+        'BACKEND': 'pcapp.assets.AssetStorage',
+    },
+}
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'